@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Block scan check: fills a folder with 100k empty blocks, then scans and stats
+it flat, migrates it to the sharded <type>/<yyyymm>/ layout and does the same
+again. Fails (exit 1) when the scanner finds different pools in the two
+layouts, or a scan plus a stat of every block takes longer than the budget
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def scan_and_stat(slicer, blocks_dir):
+    """(pools, seconds) for a scan and a stat of every block, as the duration and hash indexes do"""
+    started = time.perf_counter()
+    pools = slicer.scan_available_blocks(blocks_dir)
+    for blocks in pools:
+        for filename in blocks:
+            slicer.block_stat(blocks_dir, filename)
+    return pools, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blocks', type=int, default=100000, help="Blocks in the folder (default 100000)")
+    parser.add_argument('--budget', type=float, default=2.0, help="Fail when one scan and stat pass takes longer than this many seconds (default 2.0)")
+    parser.add_argument('--dir', help="Create the folder under this directory, e.g. a network mount (default: the system temp dir)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import slicer
+
+    work_dir = tempfile.mkdtemp(prefix="slicer_scan_", dir=args.dir)
+    try:
+        started = time.perf_counter()
+        for index in range(args.blocks):
+            block_type = 'mvvj'[index % 4]
+            month = 1 + index * 24 // args.blocks
+            filename = f"{block_type}{2024 + (month - 1) // 12}{(month - 1) % 12 + 1:02d}{index:010d}.mp3"
+            open(os.path.join(work_dir, filename), 'wb').close()
+        print(f"Created {args.blocks} blocks in {time.perf_counter() - started:.1f}s")
+
+        failed = False
+        flat_pools, flat_time = scan_and_stat(slicer, work_dir)
+        print(f"flat: {sum(map(len, flat_pools))} blocks scanned and stat'ed in {flat_time * 1000:.0f} ms")
+
+        started = time.perf_counter()
+        moved = slicer.migrate_blocks_layout(work_dir, 'sharded')
+        print(f"Migrated {moved} blocks to the sharded layout in {time.perf_counter() - started:.1f}s")
+        sharded_pools, sharded_time = scan_and_stat(slicer, work_dir)
+        print(f"sharded: {sum(map(len, sharded_pools))} blocks scanned and stat'ed in {sharded_time * 1000:.0f} ms")
+
+        if sharded_pools != flat_pools:
+            print("FAIL: the sharded folder scans to different pools than the flat one")
+            failed = True
+        for layout, elapsed in (('flat', flat_time), ('sharded', sharded_time)):
+            if elapsed > args.budget:
+                print(f"FAIL: the {layout} scan took {elapsed:.2f}s (budget {args.budget:g}s)")
+                failed = True
+        if not failed:
+            print("OK: both layouts scan to the same pools within budget")
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Ducking overhead check: renders a long sequence plan (3 h by default) with and
+without sidechain ducking and fails (exit 1) when ducking adds more than the
+budget to the render time, or when the ducked mix does not differ from the plain one
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 44100
+BLOCK_SECONDS = 30
+BLOCKS_PER_TYPE = 8
+
+def write_block(path, frequency, rng, rate=SAMPLE_RATE, gaps=False):
+    """One 30 s stereo WAV block: a tone with a little noise (with pauses every few seconds when gaps)"""
+    t = np.arange(BLOCK_SECONDS * rate) / rate
+    mono = 0.4 * np.sin(2 * np.pi * frequency * t) + 0.05 * rng.standard_normal(len(t))
+    if gaps:
+        mono[(t % 6) > 4] = 0
+    samples = (np.clip(mono, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(samples, 2).tobytes())
+
+def render_cpu(slicer, plan, work_dir, output_path):
+    """CPU seconds of a full render of the plan (mix and encode, render cache off)"""
+    started = time.process_time()
+    if not slicer.render_plan(plan, output_path, work_dir, use_cache=False):
+        raise RuntimeError(f"render of {output_path} failed")
+    return time.process_time() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hours', type=float, default=3.0, help="Plan length in hours (default 3)")
+    parser.add_argument('--depth', type=float, default=12.0, help="Ducking depth in dB (default 12)")
+    parser.add_argument('--budget', type=float, default=0.10, help="Fail when ducking adds more than this fraction of render time (default 0.10)")
+    parser.add_argument('--codec', default='mp3', help="Sequence codec of the renders (default mp3)")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import slicer
+
+    work_dir = tempfile.mkdtemp(prefix="slicer_ducking_")
+    try:
+        rng = np.random.default_rng(args.seed)
+        blocks = {}
+        for block_type, base in (('m', 220), ('v', 440), ('j', 660)):
+            blocks[block_type] = []
+            for index in range(BLOCKS_PER_TYPE):
+                name = f"{block_type}{2025010100000000 + index}.wav"
+                write_block(os.path.join(work_dir, name), base + 20 * index, rng, gaps=block_type != 'm')
+                blocks[block_type].append(name)
+
+        picker = random.Random(args.seed)
+        count = int(args.hours * 3600 / BLOCK_SECONDS)
+        m_sequence = [picker.choice(blocks['m']) for _ in range(count)]
+        voice_sequence = [picker.choice(blocks['v'] + blocks['j']) for _ in range(count)]
+        plain = slicer.create_sequence_plan(work_dir, m_sequence, voice_sequence, args.seed)
+        slicer.set_ducking(args.depth)
+        ducked = slicer.create_sequence_plan(work_dir, m_sequence, voice_sequence, args.seed)
+
+        extension = slicer.CODECS[args.codec].extension
+        plain_cpu = render_cpu(slicer, plain, work_dir, os.path.join(work_dir, "plain" + extension))
+        ducked_cpu = render_cpu(slicer, ducked, work_dir, os.path.join(work_dir, "ducked" + extension))
+        overhead = ducked_cpu / plain_cpu - 1
+        print(f"{args.hours:g} h render ({args.codec}): {plain_cpu:.1f}s CPU without ducking, {ducked_cpu:.1f}s with ({overhead * 100:+.1f}%)")
+
+        failed = False
+        if overhead > args.budget:
+            print(f"FAIL: ducking adds {overhead * 100:.1f}% to the render (budget {args.budget * 100:.0f}%)")
+            failed = True
+        plain_window = slicer.render_plan_range(plain, 60, 70, work_dir)
+        ducked_window = slicer.render_plan_range(ducked, 60, 70, work_dir)
+        if plain_window.raw_data == ducked_window.raw_data:
+            print("FAIL: the ducked mix is identical to the plain one")
+            failed = True
+        if not failed:
+            print(f"OK: ducking stays within {args.budget * 100:.0f}% of the render time")
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Fingerprint check: fingerprints synthetic blocks and altered copies of them
+(quieter, noisier, shifted), then looks up 100k fingerprints in a FingerprintIndex.
+Fails (exit 1) when a copy is not found as a near-duplicate, an unrelated block
+is, or a lookup takes longer than the budget
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 44100
+BLOCK_SECONDS = 30
+
+def synthetic_block(rng, rate=SAMPLE_RATE):
+    """30 s of stereo int16 'music': a random chord every half second over a little noise, faded in and out like a block"""
+    step = rate // 2
+    t = np.arange(step) / rate
+    chords = []
+    for _ in range(BLOCK_SECONDS * 2):
+        frequencies = rng.uniform(150, 4000, size=3)
+        chords.append(sum(np.sin(2 * np.pi * f * t) for f in frequencies) / 3)
+    mono = np.concatenate(chords) + 0.05 * rng.standard_normal(BLOCK_SECONDS * rate)
+    mono *= 1 - np.abs(np.linspace(-1, 1, len(mono)))
+    return to_int16(0.8 * mono / np.abs(mono).max())
+
+def to_int16(mono):
+    return np.repeat((np.clip(mono, -1.0, 1.0) * 32767).astype(np.int16), 2)
+
+def altered_copies(samples, rng, rate=SAMPLE_RATE):
+    """The same block quieter, with added noise, and cut 100 ms later"""
+    mono = samples[::2].astype(np.float64) / 32767
+    shift = rate // 10
+    return {
+        'quieter': to_int16(0.5 * mono),
+        'noisier': to_int16(mono + 0.01 * rng.standard_normal(len(mono))),
+        'shifted': to_int16(np.concatenate([mono[shift:], np.zeros(shift)])),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blocks', type=int, default=20, help="Synthetic blocks fingerprinted (default 20)")
+    parser.add_argument('--library', type=int, default=100000, help="Fingerprints in the lookup index (default 100000)")
+    parser.add_argument('--lookups', type=int, default=1000, help="Timed lookups (default 1000)")
+    parser.add_argument('--budget', type=float, default=0.005, help="Fail when the slowest lookup takes longer than this many seconds (default 0.005)")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import slicer
+
+    rng = np.random.default_rng(args.seed)
+    failed = False
+
+    # Robustness: altered copies stay near their block, other blocks stay far
+    fingerprints = [slicer.audio_fingerprint(synthetic_block(rng), SAMPLE_RATE, 2) for _ in range(args.blocks)]
+    worst_copy = 0
+    for number in range(min(5, args.blocks)):
+        block = synthetic_block(rng)
+        original = slicer.audio_fingerprint(block, SAMPLE_RATE, 2)
+        for name, copy in altered_copies(block, rng).items():
+            distance = slicer.fingerprint_distance(original, slicer.audio_fingerprint(copy, SAMPLE_RATE, 2))
+            worst_copy = max(worst_copy, distance)
+            if distance > slicer.FINGERPRINT_MAX_DISTANCE:
+                print(f"FAIL: the {name} copy of block {number} is {distance} bits away (max {slicer.FINGERPRINT_MAX_DISTANCE})")
+                failed = True
+    closest_other = min(slicer.fingerprint_distance(a, b)
+                        for position, a in enumerate(fingerprints) for b in fingerprints[position + 1:])
+    print(f"Altered copies: at most {worst_copy} bits away; unrelated blocks: at least {closest_other} bits apart")
+    if closest_other <= slicer.FINGERPRINT_MAX_DISTANCE:
+        print(f"FAIL: two unrelated blocks are only {closest_other} bits apart")
+        failed = True
+
+    # Lookup speed: random fingerprints, each looked up with FINGERPRINT_MAX_DISTANCE of its bits flipped
+    picker = random.Random(args.seed)
+    library = {f"m{index:016d}.mp3": f"{picker.getrandbits(64):016x}" for index in range(args.library)}
+    started = time.perf_counter()
+    index = slicer.FingerprintIndex(library)
+    build = time.perf_counter() - started
+
+    names = picker.sample(sorted(library), args.lookups)
+    timings = []
+    for name in names:
+        value = int(library[name], 16)
+        for bit in picker.sample(range(64), slicer.FINGERPRINT_MAX_DISTANCE):
+            value ^= 1 << bit
+        started = time.perf_counter()
+        matches = index.query(f"{value:016x}")
+        timings.append(time.perf_counter() - started)
+        if name not in [match for _, match in matches]:
+            print(f"FAIL: {name} was not found {slicer.FINGERPRINT_MAX_DISTANCE} bits away")
+            failed = True
+    slowest = max(timings)
+    print(f"{args.library} fingerprints indexed in {build:.2f}s; lookups: median {np.median(timings) * 1e6:.0f} us, slowest {slowest * 1e6:.0f} us")
+    if slowest > args.budget:
+        print(f"FAIL: a lookup took {slowest * 1000:.1f} ms (budget {args.budget * 1000:g} ms)")
+        failed = True
+    if not failed:
+        print("OK: near-duplicates are found and lookups stay within budget")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Master bus check: renders a long sequence plan (1 h by default) through the
+master bus and fails (exit 1) when the output misses the target loudness, goes
+over the true-peak ceiling, costs more than the budget over a plain render,
+when planning it decodes any block (it only reads stored loudness stats), or
+when a folder with no stored stats gets a master gain other than 0 dB
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 44100
+BLOCK_SECONDS = 30
+BLOCKS_PER_TYPE = 8
+
+def write_block(path, frequency, level, rng, rate=SAMPLE_RATE, gaps=False):
+    """One 30 s stereo WAV block: a tone with a little noise at level (with pauses every few seconds when gaps)"""
+    t = np.arange(BLOCK_SECONDS * rate) / rate
+    mono = level * (np.sin(2 * np.pi * frequency * t) + 0.1 * rng.standard_normal(len(t)))
+    if gaps:
+        mono[(t % 6) > 4] = 0
+    samples = (np.clip(mono, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(samples, 2).tobytes())
+
+def read_wav(path):
+    """Samples of a stereo WAV as (frames, 2) floats, full scale = 1"""
+    with wave.open(path, 'rb') as wav:
+        data = np.frombuffer(wav.readframes(wav.getnframes()), dtype='<i2')
+    return data.reshape(-1, 2).astype(np.float64) / 32768
+
+def integrated_loudness(samples, rate=SAMPLE_RATE):
+    """Unweighted, absolute-gated loudness (dBFS RMS) over 400 ms blocks, as the master bus counts it"""
+    window = int(0.4 * rate)
+    count = len(samples) // window
+    power = (samples[:count * window].reshape(count, window, 2) ** 2).mean(axis=1).sum(axis=1)
+    return 10 * np.log10(power[power > 1e-7].mean())
+
+def true_peak(samples, oversample=4, taps=48):
+    """Peak of the signal oversampled with a long windowed sinc, an independent reference for the limiter"""
+    peak = np.abs(samples).max()
+    offsets = np.arange(taps) - taps // 2 + 1
+    for phase in range(1, oversample):
+        kernel = np.sinc(phase / oversample - offsets) * np.kaiser(taps, 5.0)
+        kernel /= kernel.sum()
+        for channel in range(samples.shape[1]):
+            peak = max(peak, np.abs(np.convolve(samples[:, channel], kernel[::-1], mode='same')).max())
+    return peak
+
+def render_cpu(slicer, plan, work_dir, output_path):
+    """CPU seconds of a full render of the plan (render cache off)"""
+    started = time.process_time()
+    if not slicer.render_plan(plan, output_path, work_dir, use_cache=False):
+        raise RuntimeError(f"render of {output_path} failed")
+    return time.process_time() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hours', type=float, default=1.0, help="Plan length in hours (default 1)")
+    parser.add_argument('--loudness', type=float, default=-9.0, help="Target loudness in dBFS RMS (default -9, loud enough to keep the limiter busy)")
+    parser.add_argument('--ceiling', type=float, default=-1.0, help="True-peak ceiling in dBTP (default -1)")
+    parser.add_argument('--tolerance', type=float, default=1.0, help="Fail when the loudness misses the target by more than this many dB (default 1)")
+    parser.add_argument('--peak-tolerance', type=float, default=0.3, help="Fail when the true peak exceeds the ceiling by more than this many dB (default 0.3)")
+    parser.add_argument('--budget', type=float, default=0.10, help="Fail when the master bus adds more than this fraction of render time (default 0.10)")
+    parser.add_argument('--codec', default='mp3', help="Sequence codec of the timed renders (default mp3)")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import slicer
+
+    work_dir = tempfile.mkdtemp(prefix="slicer_master_")
+    try:
+        rng = np.random.default_rng(args.seed)
+        blocks = {}
+        for block_type, base in (('m', 220), ('v', 440), ('j', 660)):
+            blocks[block_type] = []
+            for index in range(BLOCKS_PER_TYPE):
+                name = f"{block_type}{2025010100000000 + index}.wav"
+                level = rng.uniform(0.15, 0.5)
+                write_block(os.path.join(work_dir, name), base + 20 * index, level, rng, gaps=block_type != 'm')
+                blocks[block_type].append(name)
+
+        picker = random.Random(args.seed)
+        count = int(args.hours * 3600 / BLOCK_SECONDS)
+        m_sequence = [picker.choice(blocks['m']) for _ in range(count)]
+        voice_sequence = [picker.choice(blocks['v'] + blocks['j']) for _ in range(count)]
+
+        # Nothing measured yet (no block_loudness.json): no prediction, so the gain must stay at 0 dB
+        slicer.set_master_bus(args.loudness, args.ceiling)
+        unmeasured_gain = slicer.create_sequence_plan(work_dir, m_sequence, voice_sequence, args.seed)['master']['gain_db']
+        slicer.set_master_bus(None)
+        print(f"Unmeasured folder: master gain {unmeasured_gain:+.1f} dB")
+
+        plain = slicer.create_sequence_plan(work_dir, m_sequence, voice_sequence, args.seed)
+        extension = slicer.CODECS[args.codec].extension
+        plain_cpu = render_cpu(slicer, plain, work_dir, os.path.join(work_dir, "plain" + extension))
+
+        # Planning only reads stored stats (here recorded by the plain render), so it must not decode any block
+        decodes = []
+        load_audio_file = slicer.load_audio_file
+        slicer.load_audio_file = lambda path, *rest, **options: decodes.append(path) or load_audio_file(path, *rest, **options)
+        try:
+            slicer.set_master_bus(args.loudness, args.ceiling)
+            mastered = slicer.create_sequence_plan(work_dir, m_sequence, voice_sequence, args.seed)
+        finally:
+            slicer.load_audio_file = load_audio_file
+        mastered_cpu = render_cpu(slicer, mastered, work_dir, os.path.join(work_dir, "mastered" + extension))
+        overhead = mastered_cpu / plain_cpu - 1
+
+        # Measured on a lossless render: the encoder's own overshoot is not the limiter's
+        slicer.set_codecs(sequence_codec='wav')
+        render_cpu(slicer, mastered, work_dir, os.path.join(work_dir, "measured.wav"))
+        samples = read_wav(os.path.join(work_dir, "measured.wav"))
+        loudness = integrated_loudness(samples)
+        peak_db = 20 * np.log10(true_peak(samples))
+        print(f"{args.hours:g} h render ({args.codec}): {plain_cpu:.1f}s CPU plain, {mastered_cpu:.1f}s mastered ({overhead * 100:+.1f}%), "
+              f"{loudness:.2f} dBFS (target {args.loudness:g}), true peak {peak_db:.2f} dBTP (ceiling {args.ceiling:g})")
+
+        failed = False
+        if unmeasured_gain != 0.0:
+            print(f"FAIL: a folder with no loudness stats got a master gain of {unmeasured_gain:+.1f} dB (expected 0)")
+            failed = True
+        if decodes:
+            print(f"FAIL: planning the master bus decoded {len(decodes)} blocks")
+            failed = True
+        if abs(loudness - args.loudness) > args.tolerance:
+            print(f"FAIL: loudness is {loudness - args.loudness:+.2f} dB off target (tolerance {args.tolerance:g})")
+            failed = True
+        if peak_db > args.ceiling + args.peak_tolerance:
+            print(f"FAIL: true peak is {peak_db - args.ceiling:.2f} dB over the ceiling (tolerance {args.peak_tolerance:g})")
+            failed = True
+        if overhead > args.budget:
+            print(f"FAIL: the master bus adds {overhead * 100:.1f}% to the render (budget {args.budget * 100:.0f}%)")
+            failed = True
+        if not failed:
+            print("OK: the master bus hits its loudness and true-peak targets in one pass")
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Memory regression check: slices a long synthetic source with --max-memory and
+fails (exit 1) when the slicer's peak RSS goes over a fixed ceiling
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLICER = os.path.join(REPO_DIR, "slicer.py")
+SAMPLE_RATE = 44100
+
+def write_long_source(path, seconds, rate=SAMPLE_RATE, seed=0):
+    """Write a long 16-bit stereo WAV one minute at a time, so generating it stays small too"""
+    rng = np.random.default_rng(seed)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        for minute_start in range(0, int(seconds), 60):
+            length = min(60, seconds - minute_start)
+            t = minute_start + np.arange(int(length * rate)) / rate
+            tone = 0.4 * np.sin(2 * np.pi * 220 * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 0.02 * t))
+            mono = tone + 0.05 * rng.standard_normal(len(t))
+            samples = (np.clip(mono, -1.0, 1.0) * 32767).astype('<i2')
+            wav.writeframes(np.repeat(samples, 2).tobytes())
+
+def write_labels(path, seconds, every):
+    """One label every `every` seconds, cycling through m/v/j"""
+    types = ['m', 'v', 'j']
+    with open(path, 'w', encoding='utf-8') as f:
+        for index, climax in enumerate(np.arange(every / 2, seconds - 30, every)):
+            f.write(f"{climax:.2f}\t{climax:.2f}\t{types[index % 3]}\tlabel_{index + 1}\n")
+
+def run_slicer(slicer, source, blocks_dir, report_base, budget):
+    """Run the slicer in a fresh process; returns (exit code, seconds, report dict)"""
+    cmd = [sys.executable, slicer, '--profile', report_base]
+    if budget is not None:
+        cmd += ['--max-memory', str(budget)]
+    cmd += ['slice', source, '-o', blocks_dir]
+    started = time.perf_counter()
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    if os.path.exists(report_base + '.json'):
+        with open(report_base + '.json', encoding='utf-8') as f:
+            report = json.load(f)
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+    return result.returncode, elapsed, report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hours', type=float, default=2.0, help="Synthetic source length (default 2)")
+    parser.add_argument('--label-every', type=float, default=300, help="Seconds between labels (default 300)")
+    parser.add_argument('--budget', type=int, default=256, help="--max-memory passed to the slicer in MB (default 256)")
+    parser.add_argument('--ceiling', type=float, default=200, help="Fail when peak RSS exceeds this many MB (default 200)")
+    parser.add_argument('--unbounded', action='store_true', help="Also run without --max-memory for comparison (needs several GB)")
+    parser.add_argument('--slicer', default=SLICER, help="Slicer script to run (default: this checkout)")
+    parser.add_argument('--keep', action='store_true', help="Keep the synthetic data directory")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="slicer_memory_")
+    try:
+        seconds = int(args.hours * 3600)
+        source = os.path.join(work_dir, "long_source.wav")
+        print(f"Generating {args.hours:g} h synthetic source...")
+        write_long_source(source, seconds)
+        write_labels(os.path.join(work_dir, "long_source.txt"), seconds, args.label_every)
+        expected_blocks = len(np.arange(args.label_every / 2, seconds - 30, args.label_every))
+
+        runs = [('bounded', args.budget)] + ([('unbounded', None)] if args.unbounded else [])
+        failed = False
+        for name, budget in runs:
+            blocks_dir = os.path.join(work_dir, f"blocks_{name}")
+            os.makedirs(blocks_dir)
+            code, elapsed, report = run_slicer(args.slicer, source, blocks_dir, os.path.join(work_dir, f"report_{name}"), budget)
+            blocks = len([f for f in os.listdir(blocks_dir) if f[:1] in 'mvj' and not f.endswith('.xlsx')])
+            peak = report.get('peak_rss_mb')
+            peak_text = f"{peak:.0f} MB" if peak is not None else "unknown"
+            print(f"{name:<10} exit={code} blocks={blocks}/{expected_blocks} time={elapsed:.1f}s peak RSS={peak_text}")
+            for stage, data in sorted(report.get('stages', {}).items()):
+                stage_peak = data['counters'].get('rss_peak_mb')
+                if stage_peak is not None:
+                    print(f"           {stage:<16} high-water {stage_peak:.0f} MB")
+
+            if name != 'bounded':
+                continue
+            if code != 0 or blocks != expected_blocks:
+                print(f"FAIL: slicing did not complete ({blocks}/{expected_blocks} blocks)")
+                failed = True
+            elif peak is None:
+                print("FAIL: the slicer did not report its peak RSS")
+                failed = True
+            elif peak > args.ceiling:
+                print(f"FAIL: peak RSS {peak:.0f} MB is over the {args.ceiling:.0f} MB ceiling")
+                failed = True
+            else:
+                print(f"OK: peak RSS {peak:.0f} MB is within the {args.ceiling:.0f} MB ceiling")
+        return 1 if failed else 0
+    finally:
+        if args.keep:
+            print(f"Data kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark: times the main slicer stages on synthetic data and
+writes throughput and peak RSS per stage to JSON for comparison across commits
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+SAMPLE_RATE = 44100
+BLOCK_SECONDS = 30
+UNIQUE_BLOCKS_PER_TYPE = 4
+
+# ============================================================================
+# SYNTHETIC DATA
+# ============================================================================
+
+def synth_tones(seconds, rng, rate=SAMPLE_RATE):
+    """Slowly changing chord of sine tones"""
+    t = np.arange(int(seconds * rate)) / rate
+    freqs = rng.uniform(110, 880, size=3)
+    signal = sum(np.sin(2 * np.pi * f * t + rng.uniform(0, np.pi)) for f in freqs) / 3
+    return 0.5 * signal * (0.6 + 0.4 * np.sin(2 * np.pi * 0.05 * t))
+
+def synth_noise(seconds, rng, rate=SAMPLE_RATE):
+    """Softened noise (white noise through a short moving average)"""
+    white = rng.standard_normal(int(seconds * rate))
+    smoothed = np.convolve(white, np.ones(8) / 8, mode='same')
+    return 0.3 * smoothed / (np.abs(smoothed).max() or 1.0)
+
+def synth_speech(seconds, rng, rate=SAMPLE_RATE):
+    """Speech-like bursts: band-limited noise gated at syllable rate with pauses"""
+    count = int(seconds * rate)
+    t = np.arange(count) / rate
+    carrier = np.convolve(rng.standard_normal(count), np.ones(4) / 4, mode='same')
+    carrier *= 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(120, 220) * t)
+    syllables = np.clip(np.sin(2 * np.pi * 4.0 * t), 0, None) ** 2
+    # Pauses: roughly one second of silence every few seconds
+    phrase = (np.sin(2 * np.pi * 0.25 * t + rng.uniform(0, np.pi)) > -0.6).astype(float)
+    return 0.6 * carrier * syllables * phrase / (np.abs(carrier).max() or 1.0)
+
+SYNTHS = {'tones': synth_tones, 'noise': synth_noise, 'speech': synth_speech}
+
+def write_wav(path, mono, rate=SAMPLE_RATE):
+    """Write a mono float signal as a 16-bit stereo WAV"""
+    samples = (np.clip(mono, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(samples, 2).tobytes())
+
+def generate_source(path, seconds, seed):
+    """Long source made of alternating tone, noise and speech-like sections"""
+    rng = np.random.default_rng(seed)
+    section = 60
+    parts = []
+    kinds = list(SYNTHS)
+    for index in range(int(np.ceil(seconds / section))):
+        parts.append(SYNTHS[kinds[index % len(kinds)]](min(section, seconds - index * section), rng))
+    write_wav(path, np.concatenate(parts))
+
+def generate_labels(path, duration, count, seed):
+    """Audacity-style label file with count labels spread over the source"""
+    rng = np.random.default_rng(seed)
+    half = BLOCK_SECONDS / 2
+    with open(path, 'w', encoding='utf-8') as f:
+        for climax in np.sort(rng.uniform(half, duration - half, size=count)):
+            audio_type = rng.choice(['m', 'v', 'j'])
+            f.write(f"{climax:.2f}\t{climax:.2f}\t{audio_type} synthetic label at {climax:.0f}s\n")
+
+def generate_block_folder(folder, count, pool_dir, extension):
+    """
+    Fill folder with count blocks named like real ones (about half music).
+    Files are hard links to a small pool of unique blocks so 10k blocks do
+    not need 10k x 5 MB of disk; listing and per-file work stay real.
+    """
+    os.makedirs(folder, exist_ok=True)
+    music_count = count // 2
+    jingle_count = max(1, (count - music_count) // 4)
+    for index in range(count):
+        if index < music_count:
+            block_type = 'm'
+        elif index < music_count + jingle_count:
+            block_type = 'j'
+        else:
+            block_type = 'v'
+        source = os.path.join(pool_dir, f"{block_type}{index % UNIQUE_BLOCKS_PER_TYPE}{extension}")
+        target = os.path.join(folder, f"{block_type}{2025010100000000 + index}{extension}")
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+def generate_block_pool(pool_dir, extension, seed):
+    """A few unique 30 s blocks per type: music from tones/noise, voice and jingles from speech"""
+    os.makedirs(pool_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for block_type, kinds in (('m', ['tones', 'noise']), ('v', ['speech']), ('j', ['tones', 'speech'])):
+        for index in range(UNIQUE_BLOCKS_PER_TYPE):
+            mono = SYNTHS[kinds[index % len(kinds)]](BLOCK_SECONDS, rng)
+            wav_path = os.path.join(pool_dir, f"{block_type}{index}.wav")
+            write_wav(wav_path, mono)
+            if extension != '.wav':
+                bitrate = ['-b:a', '192k'] if extension in ('.mp3', '.opus') else []
+                subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', wav_path] + bitrate +
+                               [os.path.join(pool_dir, f"{block_type}{index}{extension}")], check=True)
+
+# ============================================================================
+# STAGES (each runs in a fresh process so peak RSS is per stage)
+# ============================================================================
+
+def _import_slicer():
+    sys.path.insert(0, REPO_DIR)
+    import slicer
+    return slicer
+
+def stage_parse_audio_txt(slicer, params):
+    slices = slicer.parse_audio_txt(params['labels'], params['source_seconds'])
+    return {'items': len(slices)}
+
+def stage_process_audio_slice_mp3(slicer, params):
+    slicer.set_codecs(block_codec=params['block_codec'])
+    audio = slicer.AudioSegment.from_file(params['source'])
+    output = tempfile.mkdtemp(dir=params['workdir'])
+    slices = slicer.parse_audio_txt(params['labels'], params['source_seconds'])[:params['slice_count']]
+    created = sum(1 for s in slices if slicer.process_audio_slice_mp3(audio, s, output, params['source']))
+    return {'items': created, 'audio_seconds': created * BLOCK_SECONDS}
+
+def _pool_blocks(params):
+    """Block files of the unique pool, cycled to params['slice_count'] paths"""
+    names = sorted(f for f in os.listdir(params['pool_dir']) if f.endswith(params['extension']))
+    return [os.path.join(params['pool_dir'], names[i % len(names)]) for i in range(params['slice_count'])]
+
+def stage_block_io_pydub(slicer, params):
+    """Decode and re-encode blocks the way pydub does it (for comparison)"""
+    output = tempfile.mkdtemp(dir=params['workdir'])
+    blocks = _pool_blocks(params)
+    for index, path in enumerate(blocks):
+        audio = slicer.AudioSegment.from_file(path)
+        audio.export(os.path.join(output, f"{index}.mp3"), format="mp3", bitrate="192k")
+    return {'items': len(blocks), 'audio_seconds': len(blocks) * BLOCK_SECONDS}
+
+def stage_block_io_piped(slicer, params):
+    """Decode and re-encode blocks through the slicer's piped decoder and encoder pool"""
+    output = tempfile.mkdtemp(dir=params['workdir'])
+    blocks = _pool_blocks(params)
+    for index, path in enumerate(blocks):
+        audio = slicer.load_audio_file(path)
+        slicer.write_audio(audio, os.path.join(output, f"{index}.mp3"))
+    return {'items': len(blocks), 'audio_seconds': len(blocks) * BLOCK_SECONDS}
+
+def stage_block_decode(slicer, params):
+    """Decode blocks in the pool's format (what the sequencer pays per block)"""
+    blocks = _pool_blocks(params)
+    for path in blocks:
+        slicer.load_audio_file(path)
+    return {'items': len(blocks), 'audio_seconds': len(blocks) * BLOCK_SECONDS}
+
+def stage_check_for_corrupted_files(slicer, params):
+    m_blocks, v_blocks, j_blocks = slicer.scan_available_blocks(params['folder'])
+    valid, problematic = slicer.check_for_corrupted_files(params['folder'], m_blocks + v_blocks + j_blocks)
+    return {'items': len(valid) + len(problematic)}
+
+def stage_build_multi_channel_sequence(slicer, params):
+    m_blocks, v_blocks, j_blocks = slicer.scan_available_blocks(params['folder'])
+    count = min(params['sequence_blocks'], len(m_blocks), len(v_blocks) + len(j_blocks))
+    audio = slicer.build_multi_channel_sequence(params['folder'], m_blocks[:count], (v_blocks + j_blocks)[:count])
+    return {'items': count * 2, 'audio_seconds': len(audio) / 1000 if audio else 0}
+
+def stage_build_sequence_parallel(slicer, params):
+    """Same mix as build_multi_channel_sequence, rendered in segments on every core"""
+    m_blocks, v_blocks, j_blocks = slicer.scan_available_blocks(params['folder'])
+    count = min(params['sequence_blocks'], len(m_blocks), len(v_blocks) + len(j_blocks))
+    audio = slicer.build_multi_channel_sequence(params['folder'], m_blocks[:count], (v_blocks + j_blocks)[:count],
+                                                workers=max(2, os.cpu_count() or 1))
+    return {'items': count * 2, 'audio_seconds': len(audio) / 1000 if audio else 0}
+
+def stage_update_excel_from_folder(slicer, params):
+    slicer.update_excel_from_folder(params['folder'], params['excel'])
+    m_blocks, v_blocks, j_blocks = slicer.scan_available_blocks(params['folder'])
+    return {'items': len(m_blocks) + len(v_blocks) + len(j_blocks)}
+
+def stage_verify_files_vs_excel(slicer, params):
+    slicer.verify_files_vs_excel(params['folder'], params['excel'])
+    m_blocks, v_blocks, j_blocks = slicer.scan_available_blocks(params['folder'])
+    return {'items': len(m_blocks) + len(v_blocks) + len(j_blocks)}
+
+def stage_generate_sequence_timeline(slicer, params):
+    m_blocks, v_blocks, j_blocks = slicer.scan_available_blocks(params['folder'])
+    count = min(len(m_blocks), len(v_blocks) + len(j_blocks))
+    output = os.path.join(params['workdir'], f"timeline_{params['size']}.mp3")
+    slicer.generate_sequence_timeline(output, params['folder'], m_blocks[:count],
+                                      (v_blocks + j_blocks)[:count], count * BLOCK_SECONDS)
+    return {'items': count * 2}
+
+STAGES = {
+    'parse_audio_txt': stage_parse_audio_txt,
+    'process_audio_slice_mp3': stage_process_audio_slice_mp3,
+    'block_io_pydub': stage_block_io_pydub,
+    'block_io_piped': stage_block_io_piped,
+    'block_decode': stage_block_decode,
+    'check_for_corrupted_files': stage_check_for_corrupted_files,
+    'build_multi_channel_sequence': stage_build_multi_channel_sequence,
+    'build_sequence_parallel': stage_build_sequence_parallel,
+    'update_excel_from_folder': stage_update_excel_from_folder,
+    'verify_files_vs_excel': stage_verify_files_vs_excel,
+    'generate_sequence_timeline': stage_generate_sequence_timeline,
+}
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unsupported"""
+    # On Linux ru_maxrss survives exec, so a spawned child would report the
+    # parent's peak; VmHWM belongs to the child's own address space.
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except Exception:
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+class TempIOCounter:
+    """
+    Counts temp files created through the tempfile module (including pydub's
+    imported names) and their size when closed, i.e. the temp-dir traffic.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+
+    def _wrap(self, factory):
+        def create(*args, **kwargs):
+            handle = factory(*args, **kwargs)
+            self.files += 1
+            close = handle.close
+
+            def counted_close():
+                try:
+                    self.bytes += os.path.getsize(handle.name)
+                except (OSError, TypeError, AttributeError):
+                    pass
+                return close()
+            handle.close = counted_close
+            return handle
+        return create
+
+    def install(self):
+        import pydub.audio_segment
+        for module in (tempfile, pydub.audio_segment):
+            for name in ('NamedTemporaryFile', 'TemporaryFile'):
+                if hasattr(module, name):
+                    setattr(module, name, self._wrap(getattr(module, name)))
+        mkstemp = tempfile.mkstemp
+
+        def counted_mkstemp(*args, **kwargs):
+            self.files += 1
+            return mkstemp(*args, **kwargs)
+        tempfile.mkstemp = counted_mkstemp
+
+def _stage_child(queue, stage, params):
+    """Child process body: import, run one stage with stdout silenced, report timing"""
+    import warnings
+    warnings.simplefilter("ignore")
+    try:
+        slicer = _import_slicer()
+        # Load the lazy dependencies before timing so import cost is not counted
+        slicer.pd.DataFrame, slicer.AudioSegment.empty, slicer.eyed3.load
+        baseline = _peak_rss_mb()
+        temp_io = TempIOCounter()
+        temp_io.install()
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            result = STAGES[stage](slicer, params)
+            result['seconds'] = time.perf_counter() - started
+        # The stages' own output folders come from mkdtemp, which is not counted
+        result['temp_files'] = temp_io.files
+        result['temp_bytes'] = temp_io.bytes
+        result['peak_rss_mb'] = _peak_rss_mb()
+        result['baseline_rss_mb'] = baseline
+        queue.put(result)
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+
+def run_stage(stage, params):
+    """Run one stage in a fresh spawned process and return its result record"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_stage_child, args=(queue, stage, params))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    record = {'stage': stage, 'size': params.get('size')}
+    record.update(result)
+    if record.get('items'):
+        record['temp_files_per_item'] = record.get('temp_files', 0) / record['items']
+        record['temp_bytes_per_item'] = record.get('temp_bytes', 0) / record['items']
+    if 'seconds' in record and record['seconds'] > 0:
+        record['items_per_second'] = record.get('items', 0) / record['seconds']
+        if record.get('audio_seconds'):
+            record['realtime_factor'] = record['audio_seconds'] / record['seconds']
+    return record
+
+# ============================================================================
+# DRIVER
+# ============================================================================
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def library_versions():
+    versions = {}
+    for name in ('pydub', 'pandas', 'numpy', 'eyed3', 'openpyxl'):
+        try:
+            from importlib.metadata import version
+            versions[name] = version(name)
+        except Exception:
+            versions[name] = None
+    return versions
+
+def print_record(record):
+    if 'error' in record:
+        print(f"  {record['stage']:<30} {str(record['size']):>6}  ERROR {record['error']}")
+        return
+    rss = f"{record['peak_rss_mb']:.0f} MB" if record.get('peak_rss_mb') is not None else "n/a"
+    temp = ""
+    if record.get('temp_files'):
+        temp = f"  temp {record['temp_files_per_item']:.1f} files, {record['temp_bytes_per_item'] / 1024:.0f} KB per item"
+    print(f"  {record['stage']:<30} {str(record['size']):>6}  {record['seconds']:8.3f}s  "
+          f"{record.get('items_per_second', 0):10.1f} items/s  peak RSS {rss}{temp}")
+
+def compare_results(previous_path, current):
+    """Print the speed change of every stage against an earlier results file"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    old = {(r['stage'], r['size']): r for r in previous['results'] if 'seconds' in r}
+    print(f"\nCompared with {previous.get('commit')} ({previous_path}):")
+    for record in current['results']:
+        before = old.get((record['stage'], record['size']))
+        if before and 'seconds' in record:
+            change = (record['seconds'] / before['seconds'] - 1) * 100
+            print(f"  {record['stage']:<30} {str(record['size']):>6}  {change:+7.1f}% time")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the slicer pipeline on synthetic data")
+    parser.add_argument('--sizes', default="100,1000,10000", help="Block folder sizes (default 100,1000,10000)")
+    parser.add_argument('--source-minutes', type=float, default=60, help="Synthetic source length (default 60)")
+    parser.add_argument('--labels', type=int, default=1000, help="Labels in the synthetic label file (default 1000)")
+    parser.add_argument('--slices', type=int, default=20, help="Slices exported in the slicing stage (default 20)")
+    parser.add_argument('--sequence-blocks', type=int, default=60, help="Blocks per lane in the mixing stage (default 60)")
+    parser.add_argument('--format', choices=['wav', 'mp3', 'flac', 'opus'], help="Block format (default: mp3 if ffmpeg is found, else wav)")
+    parser.add_argument('--block-codec', default='mp3', help="Codec the slicing stage writes blocks in (default mp3)")
+    parser.add_argument('--stages', help="Comma-separated subset of stages to run")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--workdir', help="Where to generate data (default: temporary folder)")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated data")
+    parser.add_argument('--output', help="Results JSON path (default: benchmarks/results/<time>_<commit>.json)")
+    parser.add_argument('--compare', help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    has_ffmpeg = shutil.which('ffmpeg') is not None
+    block_format = args.format or ('mp3' if has_ffmpeg else 'wav')
+    extension = '.' + block_format
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    stages = args.stages.split(',') if args.stages else list(STAGES)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="slicer_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"Generating synthetic data in {workdir} ({block_format} blocks)...")
+    source_seconds = args.source_minutes * 60
+    source = os.path.join(workdir, "source.wav")
+    labels = os.path.join(workdir, "source.txt")
+    generate_source(source, source_seconds, args.seed)
+    generate_labels(labels, source_seconds, args.labels, args.seed)
+    pool_dir = os.path.join(workdir, "pool")
+    generate_block_pool(pool_dir, extension, args.seed)
+
+    common = {
+        'workdir': workdir, 'source': source, 'labels': labels, 'source_seconds': source_seconds,
+        'slice_count': args.slices, 'sequence_blocks': args.sequence_blocks,
+        'pool_dir': pool_dir, 'extension': extension, 'block_codec': args.block_codec
+    }
+    results = []
+    try:
+        for stage in ('parse_audio_txt', 'process_audio_slice_mp3', 'block_io_pydub', 'block_io_piped', 'block_decode'):
+            if stage not in stages:
+                continue
+            needs_ffmpeg = stage != 'parse_audio_txt' and not (stage == 'block_decode' and extension == '.wav')
+            if needs_ffmpeg and not has_ffmpeg:
+                results.append({'stage': stage, 'size': None, 'skipped': "ffmpeg not found"})
+                print(f"  {stage:<30}         skipped (ffmpeg not found)")
+                continue
+            results.append(run_stage(stage, dict(common, size=None)))
+            print_record(results[-1])
+
+        for size in sizes:
+            folder = os.path.join(workdir, f"blocks_{size}")
+            generate_block_folder(folder, size, pool_dir, extension)
+            params = dict(common, size=size, folder=folder, excel=os.path.join(folder, "blocks_list.xlsx"))
+            # Catalog update first so verification has a catalog to read
+            for stage in ('update_excel_from_folder', 'verify_files_vs_excel', 'check_for_corrupted_files',
+                          'build_multi_channel_sequence', 'build_sequence_parallel', 'generate_sequence_timeline'):
+                if stage in stages:
+                    results.append(run_stage(stage, params))
+                    print_record(results[-1])
+            if not args.keep:
+                shutil.rmtree(folder, ignore_errors=True)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'libraries': library_versions(),
+        'parameters': {
+            'sizes': sizes, 'source_minutes': args.source_minutes, 'labels': args.labels,
+            'slices': args.slices, 'sequence_blocks': args.sequence_blocks,
+            'format': block_format, 'seed': args.seed
+        },
+        'results': results
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{report['commit'] or 'nogit'}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare_results(args.compare, report)
+    return 0 if not any('error' in r for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Preview latency check: renders short windows of 1 h and 8 h sequence plans with
+render_plan_range and fails (exit 1) when any window takes longer than the budget,
+so preview cost stays independent of the sequence length
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 44100
+BLOCK_SECONDS = 30
+BLOCKS_PER_TYPE = 8
+
+def write_block(path, frequency, rng, rate=SAMPLE_RATE):
+    """One 30 s stereo WAV block: a tone with a little noise"""
+    t = np.arange(BLOCK_SECONDS * rate) / rate
+    mono = 0.4 * np.sin(2 * np.pi * frequency * t) + 0.05 * rng.standard_normal(len(t))
+    samples = (np.clip(mono, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(samples, 2).tobytes())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hours', default="1,8", help="Plan lengths in hours (default 1,8)")
+    parser.add_argument('--windows', type=int, default=10, help="Windows previewed per plan (default 10)")
+    parser.add_argument('--window-seconds', type=float, default=20, help="Window length (default 20)")
+    parser.add_argument('--budget', type=float, default=1.0, help="Fail when a window takes longer than this many seconds (default 1.0)")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import slicer
+
+    work_dir = tempfile.mkdtemp(prefix="slicer_preview_")
+    try:
+        rng = np.random.default_rng(args.seed)
+        blocks = {}
+        for block_type, base in (('m', 220), ('v', 440), ('j', 660)):
+            blocks[block_type] = []
+            for index in range(BLOCKS_PER_TYPE):
+                name = f"{block_type}{2025010100000000 + index}.wav"
+                write_block(os.path.join(work_dir, name), base + 20 * index, rng)
+                blocks[block_type].append(name)
+
+        picker = random.Random(args.seed)
+        failed = False
+        for hours in [float(h) for h in args.hours.split(',') if h]:
+            count = int(hours * 3600 / BLOCK_SECONDS)
+            m_sequence = [picker.choice(blocks['m']) for _ in range(count)]
+            voice_sequence = [picker.choice(blocks['v'] + blocks['j']) for _ in range(count)]
+            plan = slicer.create_sequence_plan(work_dir, m_sequence, voice_sequence, args.seed)
+
+            timings = []
+            for _ in range(args.windows):
+                start = picker.uniform(0, plan['duration'] - args.window_seconds)
+                started = time.perf_counter()
+                audio = slicer.render_plan_range(plan, start, start + args.window_seconds)
+                timings.append(time.perf_counter() - started)
+                if abs(len(audio) / 1000 - args.window_seconds) > 0.01:
+                    print(f"FAIL: window at {start:.1f}s returned {len(audio) / 1000:.3f}s of audio")
+                    failed = True
+            slowest = max(timings)
+            print(f"{hours:g} h plan ({count} blocks per lane): median {np.median(timings) * 1000:.0f} ms, slowest {slowest * 1000:.0f} ms")
+            if slowest > args.budget:
+                print(f"FAIL: a {args.window_seconds:g}s preview took {slowest:.2f}s (budget {args.budget:g}s)")
+                failed = True
+        if not failed:
+            print(f"OK: every preview rendered within {args.budget:g}s")
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Radio mode soak check: streams hours of radio output as fast as possible into a
+counting sink and fails (exit 1) when producing it costs more than a fraction of
+real time or when RSS keeps growing after the warm-up, so a radio can run for days
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 44100
+BLOCK_SECONDS = 30
+
+def write_block(path, frequency, rng, rate=SAMPLE_RATE):
+    """One 30 s stereo WAV block: a tone with a little noise"""
+    t = np.arange(BLOCK_SECONDS * rate) / rate
+    mono = 0.4 * np.sin(2 * np.pi * frequency * t) + 0.05 * rng.standard_normal(len(t))
+    samples = (np.clip(mono, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(samples, 2).tobytes())
+
+class CountingSink:
+    """Radio sink that only counts bytes and samples RSS as the stream goes"""
+
+    def __init__(self, slicer, sample_every):
+        self.slicer = slicer
+        self.header = b''
+        self.closed = False
+        self.bytes = 0
+        self.sample_every = sample_every
+        self.next_sample = 0
+        self.rss = []
+
+    def write(self, data):
+        self.bytes += len(data)
+        if self.bytes >= self.next_sample:
+            self.rss.append(self.slicer.current_rss_bytes() / self.slicer.MEGABYTE)
+            self.next_sample += self.sample_every
+
+    def close(self):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hours', type=float, default=2.0, help="Hours of stream to produce (default 2)")
+    parser.add_argument('--blocks', type=int, default=12, help="Blocks per type, so the rotation wraps many times (default 12)")
+    parser.add_argument('--cpu-budget', type=float, default=0.25, help="Fail when CPU time exceeds this fraction of the stream length (default 0.25)")
+    parser.add_argument('--growth', type=float, default=20, help="Fail when RSS grows more than this many MB after the first 10%% (default 20)")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import slicer
+
+    work_dir = tempfile.mkdtemp(prefix="slicer_radio_")
+    try:
+        rng = np.random.default_rng(args.seed)
+        for block_type, base in (('m', 220), ('v', 440), ('j', 660)):
+            for index in range(args.blocks):
+                write_block(os.path.join(work_dir, f"{block_type}{2025010100000000 + index}.wav"), base + 20 * index, rng)
+
+        seconds = args.hours * 3600
+        sink = CountingSink(slicer, sample_every=int(60 * SAMPLE_RATE * 4))
+        cpu_started, started = time.process_time(), time.perf_counter()
+        ok = slicer.run_radio(work_dir, sink, format='pcm', seed=args.seed, duration=seconds, realtime=False)
+        cpu = time.process_time() - cpu_started
+        elapsed = time.perf_counter() - started
+
+        produced = sink.bytes / (SAMPLE_RATE * 4)
+        warm = sink.rss[max(1, len(sink.rss) // 10):] or sink.rss
+        growth = max(warm) - warm[0]
+        print(f"{produced / 3600:.2f} h streamed in {elapsed:.1f}s: CPU {cpu:.1f}s ({cpu / produced * 100:.2f}% of real time), "
+              f"RSS {warm[0]:.0f} -> {max(warm):.0f} MB, {threading.active_count()} threads")
+
+        failed = False
+        if not ok or abs(produced - seconds) > 1:
+            print(f"FAIL: the stream stopped after {produced:.0f}s of {seconds:.0f}s")
+            failed = True
+        if cpu / produced > args.cpu_budget:
+            print(f"FAIL: CPU is {cpu / produced * 100:.1f}% of real time (budget {args.cpu_budget * 100:.0f}%)")
+            failed = True
+        if growth > args.growth:
+            print(f"FAIL: RSS grew {growth:.0f} MB after warm-up (budget {args.growth:g} MB)")
+            failed = True
+        if not failed:
+            print("OK: radio stream stays within its CPU and memory budgets")
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Rotation check: logs a year of daily sequences from a 100k-block library into
+the usage store, then fails (exit 1) when reading the history and ordering the
+library for rotation takes longer than the budget, or when LRU rotation picks a
+block that played recently while unplayed ones are left
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--library', type=int, default=100000, help="Blocks in the library (default 100000)")
+    parser.add_argument('--days', type=int, default=365, help="Days of logged sequences (default 365)")
+    parser.add_argument('--per-day', type=int, default=240, help="Blocks per daily sequence (default 240, 2 h of 30 s blocks)")
+    parser.add_argument('--budget', type=float, default=0.25, help="Fail when history plus ordering takes longer than this many seconds (default 0.25)")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import slicer
+
+    work_dir = tempfile.mkdtemp(prefix="slicer_rotation_")
+    try:
+        picker = random.Random(args.seed)
+        blocks = [f"m{2025010100000000 + index}.mp3" for index in range(args.library)]
+        now = time.time()
+        started = time.perf_counter()
+        for day in range(args.days):
+            slicer.record_block_usage(work_dir, f"day{day:03d}.mp3", picker.sample(blocks, args.per_day),
+                                      used=now - 86400 * (args.days - day))
+        print(f"Logged {args.days} sequences of {args.per_day} blocks in {time.perf_counter() - started:.2f}s")
+
+        failed = False
+        for mode in slicer.ROTATION_MODES:
+            started = time.perf_counter()
+            last_used = slicer.block_last_used(work_dir)
+            order = slicer.rotate_blocks(picker.sample(blocks, len(blocks)), last_used, random.Random(args.seed), mode=mode, now=now)
+            elapsed = time.perf_counter() - started
+            chosen = order[:args.per_day]
+            recent = sum(1 for block in chosen if block in last_used and now - last_used[block][0] < 7 * 86400)
+            print(f"{mode}: {len(last_used)} played blocks read and {len(blocks)} ordered in {elapsed * 1000:.0f} ms; "
+                  f"{recent} of the next {len(chosen)} played in the last week")
+            if elapsed > args.budget:
+                print(f"FAIL: {mode} rotation took {elapsed:.3f}s (budget {args.budget:g}s)")
+                failed = True
+            if mode == 'lru' and recent and len(last_used) + args.per_day <= len(blocks):
+                print("FAIL: lru picked recently played blocks while unplayed ones were left")
+                failed = True
+        if not failed:
+            print("OK: rotation reads the history and orders the library within budget")
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: time from process launch to the first menu prompt
+"""
+
+import argparse
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT_MARKER = b"Select option"
+
+def time_to_prompt(cmd, timeout=30):
+    """Launch cmd and return seconds until the main menu prompt appears on stdout"""
+    started = time.perf_counter()
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, cwd=REPO_DIR)
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    try:
+        output = b""
+        while PROMPT_MARKER not in output:
+            chunk = os.read(process.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError(f"{' '.join(cmd)} exited before showing the menu")
+            output += chunk
+        return time.perf_counter() - started
+    finally:
+        timer.cancel()
+        process.kill()
+        process.wait()
+
+def find_frozen_build():
+    """Look for an executable produced by builder.py or the release workflow"""
+    names = ["AudioSlicer", "AudioSlicerSequencer", "slicer"]
+    suffix = ".exe" if platform.system() == "Windows" else ""
+    for name in names:
+        path = os.path.join(REPO_DIR, "dist", name + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+def measure(label, cmd, runs, budget):
+    """Run the measurement several times and compare the median with the budget"""
+    # First launch warms the OS file cache (and the --onefile unpack directory)
+    time_to_prompt(cmd)
+    samples = [time_to_prompt(cmd) for _ in range(runs)]
+    median = statistics.median(samples)
+    status = "OK" if median <= budget else "OVER BUDGET"
+    print(f"{label:<8} median {median:.3f}s  min {min(samples):.3f}s  max {max(samples):.3f}s  "
+          f"budget {budget:.2f}s  {status}")
+    return median <= budget
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure launch-to-menu time of slicer.py and the frozen build")
+    parser.add_argument('--runs', type=int, default=5, help="Measured launches per target (default 5)")
+    parser.add_argument('--budget', type=float, default=1.0, help="Budget for the script in seconds (default 1.0)")
+    parser.add_argument('--frozen', help="Path to the PyInstaller executable (default: look in dist/)")
+    parser.add_argument('--frozen-budget', type=float, default=3.0, help="Budget for the frozen build in seconds (default 3.0)")
+    parser.add_argument('--require-frozen', action='store_true', help="Fail if no frozen build is found")
+    args = parser.parse_args()
+    
+    ok = measure("script", [sys.executable, os.path.join(REPO_DIR, "slicer.py")], args.runs, args.budget)
+    
+    frozen = args.frozen or find_frozen_build()
+    if frozen:
+        ok = measure("frozen", [frozen], args.runs, args.frozen_budget) and ok
+    elif args.require_frozen:
+        print("frozen   no executable found in dist/ - build it with builder.py first")
+        ok = False
+    else:
+        print("frozen   skipped (no executable found in dist/)")
+    
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,22 +3,73 @@
 Advanced Audio Slicer with Excel Tracking
 """
 
-from pydub import AudioSegment
-from pydub.effects import normalize
-import pandas as pd
 import os
 import argparse
-import tkinter as tk
-from tkinter import filedialog, messagebox
 import sys
 from colorama import Fore, Back, Style, init
 import random
-import eyed3
-from eyed3.id3.frames import ImageFrame
 import json
+from collections import namedtuple
 # Initialize colorama (this makes colors work on Windows too)
 init()
 
+# ============================================================================
+# LAZY IMPORTS
+# ============================================================================
+# pydub, pandas, numpy and eyed3 take most of the startup time (pandas alone
+# is ~0.3s, much more when unpacked from the PyInstaller --onefile archive),
+# so they are only imported on the code paths that use them. The loaders use
+# plain import statements so PyInstaller still finds and bundles them.
+
+class _LazyImport:
+    """Module-level stand-in that imports the real object on first use"""
+    
+    def __init__(self, name, loader):
+        self._name = name
+        self._loader = loader
+    
+    def _resolve(self):
+        target = self._loader()
+        # Replace the stand-in so later lookups hit the real object directly
+        globals()[self._name] = target
+        return target
+    
+    def __getattr__(self, attribute):
+        return getattr(self._resolve(), attribute)
+    
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+def _load_audio_segment():
+    from pydub import AudioSegment
+    return AudioSegment
+
+def _load_normalize():
+    from pydub.effects import normalize
+    return normalize
+
+def _load_pandas():
+    import pandas
+    return pandas
+
+def _load_numpy():
+    import numpy
+    return numpy
+
+def _load_eyed3():
+    import eyed3
+    return eyed3
+
+def _load_id3():
+    import eyed3.id3
+    return eyed3.id3
+
+AudioSegment = _LazyImport('AudioSegment', _load_audio_segment)
+normalize = _LazyImport('normalize', _load_normalize)
+pd = _LazyImport('pd', _load_pandas)
+np = _LazyImport('np', _load_numpy)
+eyed3 = _LazyImport('eyed3', _load_eyed3)
+
 def get_base_path():
     """
     Get the base path for the application.
@@ -32,6 +83,263 @@ def get_base_path():
         base_path = os.path.dirname(os.path.abspath(__file__))
     return base_path
 
+# ============================================================================
+# PROFILING & TRACING
+# ============================================================================
+# Stages are wrapped in trace_span(...). With tracing off (the default) that
+# returns a shared no-op object, so the cost is one function call per stage.
+
+MEGABYTE = 1024 * 1024
+
+def _read_proc_status(field):
+    """Read a kB field (VmRSS, VmHWM) from /proc/self/status in bytes, None off Linux"""
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def current_rss_bytes():
+    """Resident set size of this process in bytes (0 if the platform gives no way to read it)"""
+    rss = _read_proc_status('VmRSS')
+    if rss is not None:
+        return rss
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+def peak_rss_bytes():
+    """High-water resident set size of this process in bytes"""
+    peak = _read_proc_status('VmHWM')
+    if peak is not None:
+        return peak
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return 0
+
+class _NullSpan:
+    """Span used when tracing is off: does nothing"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+    
+    def add(self, **counters):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    """A timed stage with counters (bytes, blocks, ...)"""
+    
+    def __init__(self, tracer, name, counters):
+        self.tracer = tracer
+        self.name = name
+        self.counters = counters
+    
+    def __enter__(self):
+        import time
+        if self.tracer.active is not None:
+            self.rss_peak = current_rss_bytes()
+            with self.tracer.lock:
+                self.tracer.active.add(self)
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        import time
+        ended = time.perf_counter()
+        if self.tracer.active is not None:
+            with self.tracer.lock:
+                self.tracer.active.discard(self)
+            self.counters['rss_peak_mb'] = max(self.rss_peak, current_rss_bytes()) / MEGABYTE
+        self.tracer.record(self.name, self.started, ended, self.counters, failed=exc_type is not None)
+        return False
+    
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+class Tracer:
+    """Collects spans for the JSON run summary and the Chrome trace file"""
+    
+    def __init__(self):
+        import threading
+        import time
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.active = None
+    
+    def span(self, name, **counters):
+        return _Span(self, name, counters)
+    
+    def track_memory(self, interval=0.05):
+        """Sample RSS in a background thread; every open span keeps its own high-water mark"""
+        import threading
+        if self.active is not None:
+            return
+        self.active = set()
+        
+        def sample():
+            import time
+            while True:
+                rss = current_rss_bytes()
+                with self.lock:
+                    for span in self.active:
+                        span.rss_peak = max(span.rss_peak, rss)
+                time.sleep(interval)
+        
+        threading.Thread(target=sample, name='rss-sampler', daemon=True).start()
+    
+    def record(self, name, started, ended, counters, failed=False, pid=None, tid=None):
+        import threading
+        event = {
+            'name': name,
+            'ts': started * 1e6,
+            'dur': (ended - started) * 1e6,
+            'pid': pid or os.getpid(),
+            'tid': tid or threading.get_ident(),
+            'args': dict(counters, failed=True) if failed else dict(counters)
+        }
+        with self.lock:
+            self.events.append(event)
+    
+    def merge(self, events):
+        """Add events recorded by a worker process (perf_counter is system-wide, so times line up)"""
+        with self.lock:
+            self.events.extend(events)
+    
+    def summary(self):
+        """Aggregate spans per stage: calls, total/max time, summed counters and max *_peak_mb"""
+        stages = {}
+        for event in self.events:
+            stage = stages.setdefault(event['name'], {'calls': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'counters': {}})
+            seconds = event['dur'] / 1e6
+            stage['calls'] += 1
+            stage['total_seconds'] += seconds
+            stage['max_seconds'] = max(stage['max_seconds'], seconds)
+            for key, value in event['args'].items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                if key.endswith('_peak_mb'):
+                    stage['counters'][key] = max(stage['counters'].get(key, 0), value)
+                else:
+                    stage['counters'][key] = stage['counters'].get(key, 0) + value
+        return stages
+
+_TRACER = None
+
+def trace_span(name, **counters):
+    """Context manager timing one stage; free when tracing is off"""
+    if _TRACER is None:
+        return _NULL_SPAN
+    return _TRACER.span(name, **counters)
+
+def traced(stage):
+    """Decorator: run the whole function inside trace_span(stage)"""
+    import functools
+    
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _TRACER is None:
+                return func(*args, **kwargs)
+            with _TRACER.span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def load_audio_file(file_path):
+    """decode_audio_file inside a 'load' span counting bytes read"""
+    with trace_span('load', bytes=os.path.getsize(file_path), files=1):
+        return decode_audio_file(file_path)
+
+def enable_tracing():
+    """Start collecting spans for this process"""
+    global _TRACER
+    _TRACER = Tracer()
+    return _TRACER
+
+def tracing_enabled():
+    return _TRACER is not None
+
+def collect_trace_events():
+    """Return and clear this process's events (used by pool workers)"""
+    if _TRACER is None:
+        return []
+    with _TRACER.lock:
+        events, _TRACER.events = _TRACER.events, []
+    return events
+
+def write_trace_report(path):
+    """
+    Write <path>.json (per-stage summary) and <path>.trace.json (Chrome trace
+    format, open in chrome://tracing or Perfetto) and print the run report.
+    """
+    if _TRACER is None:
+        return False
+    import time
+    
+    base = path[:-len('.json')] if path.lower().endswith('.json') else path
+    wall_seconds = time.perf_counter() - _TRACER.origin
+    stages = _TRACER.summary()
+    
+    summary = {
+        'wall_seconds': wall_seconds,
+        'peak_rss_mb': peak_rss_bytes() / MEGABYTE,
+        'memory_budget_mb': MEMORY_BUDGET_MB,
+        'stages': stages
+    }
+    origin_us = _TRACER.origin * 1e6
+    trace = {
+        'traceEvents': [dict(event, ts=event['ts'] - origin_us, ph='X', cat='slicer') for event in _TRACER.events],
+        'displayTimeUnit': 'ms'
+    }
+    try:
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        with open(base + '.trace.json', 'w', encoding='utf-8') as f:
+            json.dump(trace, f)
+    except Exception as e:
+        print(f"{Fore.RED}❌ Error writing profile: {e}{Style.RESET_ALL}")
+        return False
+    
+    print_trace_report()
+    print(f"{Fore.GREEN}✅ Profile written: {base}.json, {base}.trace.json{Style.RESET_ALL}")
+    return True
+
+def print_trace_report():
+    """Print per-stage time, counters and RSS high-water marks, plus the process peak"""
+    if _TRACER is None:
+        return
+    import time
+    
+    wall_seconds = time.perf_counter() - _TRACER.origin
+    peak_mb = peak_rss_bytes() / MEGABYTE
+    print(f"\n{Fore.CYAN}--- Run Report ({wall_seconds:.1f}s wall, peak RSS {peak_mb:.0f} MB) ---{Style.RESET_ALL}")
+    for name, stage in sorted(_TRACER.summary().items(), key=lambda item: item[1]['total_seconds'], reverse=True):
+        counters = ", ".join(f"{key}={value:,.0f}" for key, value in sorted(stage['counters'].items()))
+        print(f"  {name:<16} {stage['calls']:6d} calls {stage['total_seconds']:9.2f}s  {counters}")
+    if MEMORY_BUDGET_MB is not None and peak_mb > MEMORY_BUDGET_MB:
+        print(f"{Fore.YELLOW}⚠️  Peak RSS {peak_mb:.0f} MB exceeded the {MEMORY_BUDGET_MB} MB budget{Style.RESET_ALL}")
+
 # ============================================================================
 # FOLDER MEMORY SYSTEM
 # ============================================================================
@@ -91,6 +399,10 @@ def get_initial_directory():
 
 def select_audio_file():
     """Let user select audio file and return its path"""
+    # Imported here so headless (CLI) runs never load Tk
+    import tkinter as tk
+    from tkinter import filedialog
+    
     root = tk.Tk()
     root.withdraw()
     
@@ -113,6 +425,10 @@ def select_audio_file():
 
 def select_output_folder():
     """Let user select output folder for slices"""
+    # Imported here so headless (CLI) runs never load Tk
+    import tkinter as tk
+    from tkinter import filedialog
+    
     root = tk.Tk()
     root.withdraw()
     
@@ -131,6 +447,10 @@ def select_output_folder():
 
 def select_blocks_folder():
     """Let user select blocks folder for sequencing"""
+    # Imported here so headless (CLI) runs never load Tk
+    import tkinter as tk
+    from tkinter import filedialog
+    
     root = tk.Tk()
     root.withdraw()
     
@@ -149,6 +469,10 @@ def select_blocks_folder():
 
 def ask_save_file(default_ext=".mp3", filetypes=[("MP3 files", "*.mp3"), ("All files", "*.*")]):
     """Ask user to save a file"""
+    # Imported here so headless (CLI) runs never load Tk
+    import tkinter as tk
+    from tkinter import filedialog
+    
     root = tk.Tk()
     root.withdraw()
     
@@ -167,6 +491,13 @@ def ask_save_file(default_ext=".mp3", filetypes=[("MP3 files", "*.mp3"), ("All f
     
     return file_path
 
+def ask_sequence_save_file():
+    """Save dialog for a sequence, defaulting to the sequence codec's extension"""
+    codec = CODECS[SEQUENCE_CODEC or 'mp3']
+    pattern = f"*{codec.extension}"
+    return ask_save_file(default_ext=codec.extension,
+                         filetypes=[(f"{codec.name.upper()} files", pattern), ("All files", "*.*")])
+
 # ============================================================================
 # ORIGINAL FUNCTIONS (with updated dialog calls)
 # ============================================================================
@@ -175,6 +506,7 @@ def ask_save_file(default_ext=".mp3", filetypes=[("MP3 files", "*.mp3"), ("All f
 SLICE_SIZE = 30  # seconds
 FADE_DURATION = SLICE_SIZE / 2  # seconds
 
+@traced('parse')
 def parse_audio_txt(file_path, audio_duration=None):
     """Parse the audio.txt file and return list of slices that fit within audio boundaries"""
     slices = []
@@ -234,6 +566,7 @@ def parse_audio_txt(file_path, audio_duration=None):
     
     return slices
 
+@traced('catalog')
 def update_excel_file(excel_path, slice_info, timestamp_id, origin_file):
     """Update the Excel file with new slice information"""
     try:
@@ -279,6 +612,40 @@ def update_excel_file(excel_path, slice_info, timestamp_id, origin_file):
     except Exception as e:
         print(f"{Fore.RED}❌ Error updating Excel file: {e}{Style.RESET_ALL}")
         
+@traced('catalog')
+def append_catalog_entries(excel_path, entries):
+    """
+    Append many catalog rows in one write. Each entry is a dict with
+    'type', 'name', 'origin' and 'description', and optionally 'fingerprint'.
+    """
+    if not entries:
+        return True
+    try:
+        sheets = {}
+        for sheet_name in ['m', 'v', 'j']:
+            try:
+                sheets[sheet_name] = pd.read_excel(excel_path, sheet_name=sheet_name)
+            except Exception:
+                sheets[sheet_name] = pd.DataFrame(columns=[sheet_name, 'origin', 'description'])
+        
+        for sheet_name in ['m', 'v', 'j']:
+            rows = [{sheet_name: e['name'], 'origin': e['origin'], 'description': e['description'],
+                     'fingerprint': e.get('fingerprint') or ''}
+                    for e in entries if e['type'] == sheet_name]
+            if rows:
+                sheets[sheet_name] = pd.concat([sheets[sheet_name], pd.DataFrame(rows)], ignore_index=True)
+        
+        with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
+            for sheet_name in ['m', 'v', 'j']:
+                sheets[sheet_name].to_excel(writer, sheet_name=sheet_name, index=False)
+        
+        print(f"{Fore.GREEN}✅ Updated Excel: {len(entries)} new entries{Style.RESET_ALL}")
+        return True
+    except Exception as e:
+        print(f"{Fore.RED}❌ Error updating Excel file: {e}{Style.RESET_ALL}")
+        return False
+
+@traced('catalog')
 def verify_files_vs_excel(blocks_dir, excel_path):
     """Verify that files in blocks folder match the Excel database"""
     print(f"\n{Fore.CYAN}=== Verifying Files vs Excel Database ==={Style.RESET_ALL}")
@@ -289,27 +656,25 @@ def verify_files_vs_excel(blocks_dir, excel_path):
         v_df = pd.read_excel(excel_path, sheet_name='v')
         j_df = pd.read_excel(excel_path, sheet_name='j')
         
-        # Get all files in blocks directory
-        all_files = os.listdir(blocks_dir)
-        audio_files = [f for f in all_files if f.endswith('.wav') or f.endswith('.mp3')]
+        # Get all blocks in the folder (flat or sharded), bucketed by type in one pass
+        # Blocks are matched by stem, so the catalog holds whatever format they are in
+        folder_stems = {'m': [], 'v': [], 'j': []}
+        for filename in scan_block_entries(blocks_dir):
+            folder_stems[filename[0]].append(os.path.splitext(filename)[0])
+        m_files_folder, v_files_folder, j_files_folder = folder_stems['m'], folder_stems['v'], folder_stems['j']
         
-        # Extract m, v, and j files from folder
-        m_files_folder = [f for f in audio_files if f.startswith('m')]
-        v_files_folder = [f for f in audio_files if f.startswith('v')]
-        j_files_folder = [f for f in audio_files if f.startswith('j')]
-        
-        # Get file names from Excel
+        # Get file names from Excel (column values directly: iterrows is slow on large catalogs)
         m_files_excel = []
         if not m_df.empty and 'm' in m_df.columns:
-            m_files_excel = [f"{row['m']}.mp3" for _, row in m_df.iterrows() if pd.notna(row['m'])]
+            m_files_excel = [str(value) for value in m_df['m'] if pd.notna(value)]
         
         v_files_excel = []
         if not v_df.empty and 'v' in v_df.columns:
-            v_files_excel = [f"{row['v']}.mp3" for _, row in v_df.iterrows() if pd.notna(row['v'])]
+            v_files_excel = [str(value) for value in v_df['v'] if pd.notna(value)]
         
         j_files_excel = []
         if not j_df.empty and 'j' in j_df.columns:
-            j_files_excel = [f"{row['j']}.mp3" for _, row in j_df.iterrows() if pd.notna(row['j'])]
+            j_files_excel = [str(value) for value in j_df['j'] if pd.notna(value)]
         
         # Compare Music files (m)
         print(f"\n{Fore.CYAN}--- Music Files (m) ---{Style.RESET_ALL}")
@@ -386,13 +751,17 @@ def verify_files_vs_excel(blocks_dir, excel_path):
         
         if total_excel == total_folder:
             print(f"{Fore.GREEN}✅ Overall: Database and folder are synchronized{Style.RESET_ALL}")
+            return True
         else:
             print(f"{Fore.YELLOW}⚠️  Overall: Database and folder are NOT synchronized{Style.RESET_ALL}")
+            return False
             
     except FileNotFoundError:
         print(f"{Fore.RED}❌ Excel file not found - cannot verify{Style.RESET_ALL}")
+        return False
     except Exception as e:
         print(f"{Fore.RED}❌ Error during verification: {e}{Style.RESET_ALL}")
+        return False
 
 def get_corresponding_txt_file(audio_file):
     """Get the corresponding txt file path based on audio file name"""
@@ -434,16 +803,52 @@ def verify_files_exist(audio_file, txt_file):
     
     return True
 
+@traced('validate')
 def check_for_corrupted_files(blocks_dir, file_list):
     """Check if any files in the list are corrupted and return valid files"""
     valid_files = []
     problematic_files = []
+    needs_probe = []  # (filename, pydub error) for files eyed3 accepts but pydub can't read
+    verified = []     # decoded in full for the first time since they last changed
+    
+    # The (cached) folder probe rejects unreadable files early; a playable header still needs one
+    # full decode per file version (a block truncated after a valid header probes fine)
+    probes = probe_folder(blocks_dir, [f for f in file_list if os.path.exists(block_path(blocks_dir, f))])
+    
+    def accept(filename, audio):
+        """Valid unless it decodes to clearly less than the probed duration (truncated)"""
+        probe = probes.get(filename)
+        if probe and is_probe_playable(probe):
+            decoded = len(audio) / 1000
+            if probe['duration'] - decoded > max(BLOCK_LENGTH_MARGIN_SECONDS, TRUNCATION_TOLERANCE * probe['duration']):
+                problematic_files.append((filename, f"Truncated: decodes to {decoded:.1f}s of {probe['duration']:.1f}s"))
+                return
+            verified.append(filename)
+        valid_files.append(filename)
     
     for filename in file_list:
-        file_path = os.path.join(blocks_dir, filename)
+        file_path = block_path(blocks_dir, filename)
         if not os.path.exists(file_path):
             problematic_files.append((filename, "File not found"))
             continue
+        probe = probes.get(filename)
+        if probe is not None and not is_probe_playable(probe) and probe_false_video_reason(probe) is None:
+            problematic_files.append((filename, f"Unreadable: {probe.get('error') or 'no audio stream'}"))
+            continue
+        if probe is not None and probe.get('verified'):
+            valid_files.append(filename)
+            continue
+        if codec_for_path(filename) != 'mp3':
+            # The MP3 fallbacks below do not apply: one decode through the codec engine decides
+            try:
+                audio = decode_audio_file(file_path)
+                if len(audio) == 0:
+                    problematic_files.append((filename, "Empty audio file"))
+                else:
+                    accept(filename, audio)
+            except Exception as e:
+                problematic_files.append((filename, f"Could not decode: {e}"))
+            continue
             
         try:
             # Method 1: Try with pydub using specific codec
@@ -452,7 +857,7 @@ def check_for_corrupted_files(blocks_dir, file_list):
                 if len(audio) == 0:
                     problematic_files.append((filename, "Empty audio file (pydub)"))
                 else:
-                    valid_files.append(filename)
+                    accept(filename, audio)
                     continue
             except Exception as e1:
                 # Method 2: Try with different format parameter
@@ -461,7 +866,7 @@ def check_for_corrupted_files(blocks_dir, file_list):
                     if len(audio) == 0:
                         problematic_files.append((filename, "Empty audio file (pydub auto)"))
                     else:
-                        valid_files.append(filename)
+                        accept(filename, audio)
                         continue
                 except Exception as e2:
                     # Method 3: Try using eyed3 to check if it's a valid MP3
@@ -472,47 +877,30 @@ def check_for_corrupted_files(blocks_dir, file_list):
                         elif audiofile.info is None:
                             problematic_files.append((filename, "MP3 file has no audio info"))
                         else:
-                            # File seems valid but pydub can't read it - check for false video detection
-                            if _is_false_video_detection(file_path):
-                                problematic_files.append((filename, "False video detection by FFmpeg"))
-                            else:
-                                problematic_files.append((filename, f"Pydub incompatible: {str(e1)}"))
+                            # File seems valid but pydub can't read it - check for false video detection below
+                            needs_probe.append((filename, e1))
                     except Exception as e3:
                         problematic_files.append((filename, f"All methods failed: pydub1:{e1}, pydub2:{e2}, eyed3:{e3}"))
                         
         except Exception as e:
             problematic_files.append((filename, f"Unexpected error: {e}"))
     
+    # ffprobe all candidates at once instead of one blocking call per file
+    if needs_probe:
+        reasons = probe_false_video([block_path(blocks_dir, filename) for filename, _ in needs_probe])
+        for filename, error in needs_probe:
+            if reasons[block_path(blocks_dir, filename)]:
+                problematic_files.append((filename, "False video detection by FFmpeg"))
+            else:
+                problematic_files.append((filename, f"Pydub incompatible: {str(error)}"))
+    
+    if verified:
+        mark_probes_verified(blocks_dir, verified)
     return valid_files, problematic_files
 
 def _is_false_video_detection(file_path):
     """Check if FFmpeg is falsely detecting audio as video"""
-    try:
-        import subprocess
-        # Use ffprobe to check what FFmpeg thinks the file is
-        cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', file_path]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            import json
-            probe_data = json.loads(result.stdout)
-            
-            if 'streams' in probe_data:
-                for stream in probe_data['streams']:
-                    if 'codec_type' in stream:
-                        # If FFmpeg detects video in an MP3 file, it's a false positive
-                        if stream['codec_type'] == 'video':
-                            codec_name = stream.get('codec_name', 'unknown')
-                            return f"False video detection (codec: {codec_name})"
-            
-            # Check if there are no audio streams
-            audio_streams = [s for s in probe_data.get('streams', []) if s.get('codec_type') == 'audio']
-            if not audio_streams:
-                return "No audio streams detected"
-                
-        return None
-    except Exception as e:
-        return f"Error checking file: {e}"
+    return probe_false_video([file_path])[file_path]
 
 def show_welcome_screen():
     """Display welcome message and program description"""
@@ -615,9 +1003,10 @@ def show_no_labels_menu():
         else:
             print(f"{Fore.RED}❌ Invalid choice. Please enter 1 or 2.{Style.RESET_ALL}")
 
-def slice_audio_from_labels(audio_file, blocks_dir):
+def slice_audio_from_labels(audio_file, blocks_dir, txt_file=None):
     """Slice audio file using labels and return the blocks directory"""
-    txt_file = get_corresponding_txt_file(audio_file)
+    if txt_file is None:
+        txt_file = get_corresponding_txt_file(audio_file)
     
     if not verify_files_exist(audio_file, txt_file):
         return None
@@ -627,13 +1016,15 @@ def slice_audio_from_labels(audio_file, blocks_dir):
     
     print(f"{Fore.GREEN}Audio file: {audio_file}{Style.RESET_ALL}")
     try:
-        audio = AudioSegment.from_file(audio_file)
-        audio_duration = len(audio) / 1000
+        audio, audio_duration = load_source_audio(audio_file)
         print(f"{Fore.GREEN}✅ Audio loaded: {audio_duration:.2f} seconds{Style.RESET_ALL}")
     except Exception as e:
         print(f"{Fore.RED}❌ Error loading audio file: {e}{Style.RESET_ALL}")
         return None
     
+    # Cache the peak overview while the source is in memory, so later previews are instant
+    get_peak_pyramid(audio_file, audio)
+    
     # Parse audio.txt with duration checking
     print(f"{Fore.BLUE}Parsing audio.txt...{Style.RESET_ALL}")
     slices = parse_audio_txt(txt_file, audio_duration)
@@ -649,10 +1040,13 @@ def slice_audio_from_labels(audio_file, blocks_dir):
     
     # Process each slice
     print(f"\n{Fore.CYAN}Processing slices...{Style.RESET_ALL}")
+    created = []
     for slice_info in slices:       
         # Process the slice as MP3
         output_path = process_audio_slice_mp3(audio, slice_info, blocks_dir, audio_file)
+        created.append(output_path)
         print()
+    index_new_blocks(blocks_dir, created)
     
     # Verify files vs Excel database
     verify_files_vs_excel(blocks_dir, excel_path)
@@ -660,8 +1054,11 @@ def slice_audio_from_labels(audio_file, blocks_dir):
     print(f"{Fore.GREEN}✅ Audio slicing completed!{Style.RESET_ALL}")
     return blocks_dir
 
-def diagnose_problematic_file(file_path):
-    """Diagnose why a file can't be loaded and suggest fixes"""
+def diagnose_problematic_file(file_path, command_results=None):
+    """
+    Diagnose why a file can't be loaded and suggest fixes.
+    command_results: output of run_diagnosis_commands, when diagnosing many files at once
+    """
     print(f"{Fore.CYAN}🔍 Diagnosing problematic file: {os.path.basename(file_path)}{Style.RESET_ALL}")
     
     if not os.path.exists(file_path):
@@ -675,14 +1072,13 @@ def diagnose_problematic_file(file_path):
         print(f"{Fore.RED}❌ File is empty (0 bytes){Style.RESET_ALL}")
         return False
     
-    # Try to get basic file info
-    try:
-        import subprocess
-        result = subprocess.run(['file', file_path], capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"{Fore.BLUE}   File type: {result.stdout.strip()}{Style.RESET_ALL}")
-    except:
-        pass
+    if command_results is None:
+        command_results = run_diagnosis_commands([file_path])[file_path]
+    file_result, ffmpeg_result = command_results
+    
+    # Basic file info
+    if file_result.returncode == 0:
+        print(f"{Fore.BLUE}   File type: {file_result.stdout.strip()}{Style.RESET_ALL}")
     
     # Check if it's actually an MP3
     try:
@@ -719,60 +1115,23 @@ def diagnose_problematic_file(file_path):
     except Exception as e:
         print(f"{Fore.YELLOW}   ⚠️  Fails without format: {e}{Style.RESET_ALL}")
     
-    # Method 3: Try with ffmpeg directly
-    try:
-        import subprocess
-        # Test if ffmpeg can read the file
-        cmd = ['ffmpeg', '-i', file_path, '-f', 'null', '-']
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"{Fore.GREEN}   ✅ FFmpeg can read the file{Style.RESET_ALL}")
-            return True
-        else:
-            print(f"{Fore.RED}   ❌ FFmpeg cannot read the file{Style.RESET_ALL}")
-            print(f"{Fore.RED}   FFmpeg error: {result.stderr}{Style.RESET_ALL}")
-    except Exception as e:
-        print(f"{Fore.YELLOW}   ⚠️  FFmpeg test failed: {e}{Style.RESET_ALL}")
+    # Method 3: ffmpeg decoding the whole file directly
+    if ffmpeg_result.returncode == 0:
+        print(f"{Fore.GREEN}   ✅ FFmpeg can read the file{Style.RESET_ALL}")
+        return True
+    elif ffmpeg_result.timed_out or ffmpeg_result.returncode < 0:
+        print(f"{Fore.YELLOW}   ⚠️  FFmpeg test failed: {ffmpeg_result.stderr}{Style.RESET_ALL}")
+    else:
+        print(f"{Fore.RED}   ❌ FFmpeg cannot read the file{Style.RESET_ALL}")
+        print(f"{Fore.RED}   FFmpeg error: {ffmpeg_result.stderr}{Style.RESET_ALL}")
     
     print(f"{Fore.YELLOW}💡 Suggestion: Try re-encoding the file with Audacity or another audio editor{Style.RESET_ALL}")
     return False
 
 def fix_problematic_file(file_path):
     """Attempt to fix a problematic MP3 file by re-encoding it"""
-    try:
-        print(f"{Fore.BLUE}🛠️  Attempting to fix: {os.path.basename(file_path)}{Style.RESET_ALL}")
-        
-        # Create a temporary file
-        import tempfile
-        temp_dir = tempfile.gettempdir()
-        temp_output = os.path.join(temp_dir, f"fixed_{os.path.basename(file_path)}")
-        
-        # Use FFmpeg to re-encode the file
-        import subprocess
-        cmd = [
-            'ffmpeg', '-y', '-i', file_path,
-            '-c:a', 'libmp3lame', '-b:a', '192k',
-            '-map_metadata', '0',  # Copy metadata
-            temp_output
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0 and os.path.exists(temp_output):
-            # Replace the original file with the fixed one
-            import shutil
-            shutil.move(temp_output, file_path)
-            print(f"{Fore.GREEN}✅ Successfully fixed: {os.path.basename(file_path)}{Style.RESET_ALL}")
-            return True
-        else:
-            print(f"{Fore.RED}❌ Failed to fix: {os.path.basename(file_path)}{Style.RESET_ALL}")
-            if os.path.exists(temp_output):
-                os.remove(temp_output)
-            return False
-            
-    except Exception as e:
-        print(f"{Fore.RED}❌ Error fixing file: {e}{Style.RESET_ALL}")
-        return False
+    print(f"{Fore.BLUE}🛠️  Attempting to fix: {os.path.basename(file_path)}{Style.RESET_ALL}")
+    return fix_problematic_files([file_path])[file_path]
 
 def calculate_slice_density(audio_duration_seconds):
     """Calculate number of slices based on audio duration (~1 per 2 minutes)"""
@@ -785,13 +1144,14 @@ def generate_random_labels(audio_file):
     """Generate random slice positions throughout the audio file with proper density"""
     try:
         print(f"{Fore.BLUE}Loading audio to calculate duration...{Style.RESET_ALL}")
-        audio = AudioSegment.from_file(audio_file)
-        duration_seconds = len(audio) / 1000
+        audio, duration_seconds = load_source_audio(audio_file)
         print(f"{Fore.GREEN}✅ Audio duration: {duration_seconds:.1f} seconds{Style.RESET_ALL}")
         
         num_slices = calculate_slice_density(duration_seconds)
         print(f"{Fore.BLUE}Calculated {num_slices} slices for {duration_seconds:.1f}s audio{Style.RESET_ALL}")
         
+        pyramid = get_peak_pyramid(audio_file, audio)
+        
         max_start_time = duration_seconds - SLICE_SIZE
         if max_start_time <= 0:
             print(f"{Fore.RED}❌ Audio file is too short ({duration_seconds:.1f}s) for {SLICE_SIZE}s slices{Style.RESET_ALL}")
@@ -813,6 +1173,10 @@ def generate_random_labels(audio_file):
                         overlap = True
                         break
                 
+                # Reject positions that would produce a silent block
+                if not overlap and pyramid and is_silent_region(pyramid, start_time, start_time + SLICE_SIZE):
+                    overlap = True
+                
                 if not overlap:
                     break
                 attempt += 1
@@ -835,34 +1199,57 @@ def generate_random_labels(audio_file):
         print(f"{Fore.RED}❌ Error generating random labels: {e}{Style.RESET_ALL}")
         return None
 
-def process_audio_slice_mp3(audio, slice_info, output_folder, origin_file):
-    """Process a single audio slice and export as MP3 192kbps with metadata"""
+def process_audio_slice_mp3(audio, slice_info, output_folder, origin_file, timestamp_id=None, audio_offset=0.0, encoder=None):
+    """
+    Process a single audio slice and export it in BLOCK_CODEC with metadata
+    (MP3 192kbps with an ID3 tag by default).
+    audio_offset is the source time (seconds) at which audio starts, for callers
+    that only loaded the slice's range instead of the whole source.
+    audio=None decodes just this slice's range from origin_file.
+    encoder: EncoderPool to encode with (default: the shared process pool).
+    """
     try:
-        begin_ms = int(slice_info['slice_begin'] * 1000)
-        end_ms = int(slice_info['slice_end'] * 1000)
+        if audio is None:
+            audio = load_audio_range(origin_file, slice_info['slice_begin'], slice_info['slice_end'])
+            audio_offset = slice_info['slice_begin']
+        
+        begin_ms = int((slice_info['slice_begin'] - audio_offset) * 1000)
+        end_ms = int((slice_info['slice_end'] - audio_offset) * 1000)
         
         begin_ms = max(0, begin_ms)
         end_ms = min(len(audio), end_ms)
         
-        slice_audio = audio[begin_ms:end_ms]
+        with trace_span('slice', blocks=1):
+            slice_audio = audio[begin_ms:end_ms]
         
-        fade_duration_ms = int(FADE_DURATION * 1000)
-        slice_audio = slice_audio.fade_in(fade_duration_ms).fade_out(fade_duration_ms)
+        with trace_span('fade/normalize'):
+            fade_duration_ms = int(FADE_DURATION * 1000)
+            slice_audio = slice_audio.fade_in(fade_duration_ms).fade_out(fade_duration_ms)
+            
+            slice_audio = normalize(slice_audio)
         
-        slice_audio = normalize(slice_audio)
+        with trace_span('fingerprint', blocks=1):
+            fingerprint = segment_fingerprint(slice_audio)
         
-        timestamp_id = generate_timestamp_id()
-        filename = f"{slice_info['type']}{timestamp_id}.mp3"
-        output_path = os.path.join(output_folder, filename)
+        if timestamp_id is None:
+            timestamp_id = generate_timestamp_id()
+        filename = f"{slice_info['type']}{timestamp_id}{CODECS[BLOCK_CODEC].extension}"
+        output_path = block_path(output_folder, filename)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)  # a new shard in a sharded folder
         
-        slice_audio.export(output_path, format="mp3", bitrate="192k")
+        with trace_span('export', blocks=1) as span:
+            block_data = (encoder or get_encoder_pool()).encode(slice_audio, codec=BLOCK_CODEC)
+            span.add(bytes=len(block_data))
         
-        metadata_success = write_audio_metadata(
+        metadata_success = write_block_metadata(
             output_path, 
             origin_file, 
             slice_info['description'], 
             slice_info['type'], 
-            slice_info['climax_time']
+            slice_info['climax_time'],
+            block_data,
+            slice_audio,
+            fingerprint
         )
         
         if metadata_success:
@@ -882,7 +1269,7 @@ def run_random_slicer():
     print(f"{Fore.CYAN}=== Random Audio Slicer Started ==={Style.RESET_ALL}")
     print(f"Slice size: {SLICE_SIZE} seconds")
     print(f"Fade duration: {FADE_DURATION} seconds")
-    print(f"Output format: MP3 192kbps{Style.RESET_ALL}")
+    print(f"Output format: {describe_codec(BLOCK_CODEC)}{Style.RESET_ALL}")
     print()
     
     audio_file = select_audio_file()
@@ -913,37 +1300,44 @@ def run_random_slicer():
     
     print(f"{Fore.BLUE}Loading audio file...{Style.RESET_ALL}")
     try:
-        audio = AudioSegment.from_file(audio_file)
-        print(f"{Fore.GREEN}✅ Audio loaded: {len(audio)/1000:.2f} seconds{Style.RESET_ALL}")
+        audio, audio_duration = load_source_audio(audio_file)
+        print(f"{Fore.GREEN}✅ Audio loaded: {audio_duration:.2f} seconds{Style.RESET_ALL}")
     except Exception as e:
         print(f"{Fore.RED}❌ Error loading audio file: {e}{Style.RESET_ALL}")
         return
     
     print(f"\n{Fore.CYAN}Processing slices...{Style.RESET_ALL}")
+    created = []
     for slice_info in slices:
         
         output_path = process_audio_slice_mp3(audio, slice_info, blocks_dir, audio_file)
+        created.append(output_path)
         print()
+    index_new_blocks(blocks_dir, created)
     
     verify_files_vs_excel(blocks_dir, excel_path)
     print(f"{Fore.CYAN}=== Random Audio Slicer Completed ==={Style.RESET_ALL}")
 
 def scan_available_blocks(blocks_dir):
-    """Scan blocks directory for m, v, and j audio files"""
+    """Scan blocks directory for m, v, and j audio files (any block format, flat or sharded layout)"""
     if not os.path.exists(blocks_dir):
         return [], [], []
     
-    all_files = os.listdir(blocks_dir)
-    m_blocks = [f for f in all_files if f.startswith('m') and (f.endswith('.mp3') or f.endswith('.wav'))]
-    v_blocks = [f for f in all_files if f.startswith('v') and (f.endswith('.mp3') or f.endswith('.wav'))]
-    j_blocks = [f for f in all_files if f.startswith('j') and (f.endswith('.mp3') or f.endswith('.wav'))]
+    # One os.scandir pass (per shard when sharded) buckets the blocks by type
+    pools = {'m': [], 'v': [], 'j': []}
+    for filename in scan_block_entries(blocks_dir):
+        pools[filename[0]].append(filename)
     
     # Sort by number for consistent ordering before shuffling
-    m_blocks.sort(key=lambda x: int(x[1:].split('.')[0]) if x[1:].split('.')[0].isdigit() else 0)
-    v_blocks.sort(key=lambda x: int(x[1:].split('.')[0]) if x[1:].split('.')[0].isdigit() else 0)
-    j_blocks.sort(key=lambda x: int(x[1:].split('.')[0]) if x[1:].split('.')[0].isdigit() else 0)
+    for blocks in pools.values():
+        blocks.sort(key=_block_number)
     
-    return m_blocks, v_blocks, j_blocks
+    return pools['m'], pools['v'], pools['j']
+
+def _block_number(filename):
+    """m2025031412000000.mp3 -> 2025031412000000 (0 for names without a numeric ID)"""
+    stem = filename[1:].split('.')[0]
+    return int(stem) if stem.isdigit() else 0
 
 def validate_sequence_requirements(m_blocks, v_blocks, j_blocks):
     """Validate that we have enough blocks for sequencing"""
@@ -959,8 +1353,13 @@ def validate_sequence_requirements(m_blocks, v_blocks, j_blocks):
     print(f"{Fore.GREEN}✅ Found {len(m_blocks)} music blocks and {total_voice_jingle} voice+jingle blocks{Style.RESET_ALL}")
     return True
 
-def create_voice_sequence(v_blocks, j_blocks):
-    """Create a voice sequence that mixes v and j blocks, starting with a jingle if available"""
+def create_voice_sequence(v_blocks, j_blocks, rng=None):
+    """
+    Create a voice sequence that mixes v and j blocks, starting with a jingle if available
+    (v_blocks may hold any other block type; the lanes of a layout pass theirs)
+    rng: random.Random to draw from (default: the module-level generator)
+    """
+    rng = rng or random
     all_voice_blocks = v_blocks + j_blocks
     
     if not all_voice_blocks:
@@ -968,100 +1367,39 @@ def create_voice_sequence(v_blocks, j_blocks):
     
     # Separate jingles for potential first position
     jingles = [b for b in all_voice_blocks if b.startswith('j')]
-    voice_only = [b for b in all_voice_blocks if b.startswith('v')]
+    voice_only = [b for b in all_voice_blocks if not b.startswith('j')]
     
     # Start with a jingle if available
     if jingles:
-        first_block = random.choice(jingles)
+        first_block = rng.choice(jingles)
         jingles.remove(first_block)
         remaining_blocks = voice_only + jingles
-        random.shuffle(remaining_blocks)
+        rng.shuffle(remaining_blocks)
         voice_sequence = [first_block] + remaining_blocks
     else:
         # No jingles, just shuffle all voice blocks
         voice_sequence = voice_only.copy()
-        random.shuffle(voice_sequence)
+        rng.shuffle(voice_sequence)
     
     return voice_sequence
 
-def create_random_sequence(m_blocks, v_blocks, j_blocks):
-    """Create random sequences for music and mixed voice channels"""
-    # Shuffle music blocks randomly
-    random.shuffle(m_blocks)
-    
-    # Create mixed voice sequence
-    voice_sequence = create_voice_sequence(v_blocks, j_blocks)
-    
-    # Use the minimum length to determine sequence duration
-    sequence_length = min(len(m_blocks), len(voice_sequence))
-    
-    # Take only the blocks we'll actually use
-    m_sequence = m_blocks[:sequence_length]
-    voice_sequence_trimmed = voice_sequence[:sequence_length]  # Trim to match length
-    
-    # Show which blocks are used vs skipped
-    print(f"{Fore.BLUE}🎵 Sequence Configuration:{Style.RESET_ALL}")
-    print(f"{Fore.GREEN}   Using {sequence_length} blocks from each channel{Style.RESET_ALL}")
-    
-    if len(m_blocks) > sequence_length:
-        print(f"{Fore.YELLOW}   Skipping {len(m_blocks) - sequence_length} music blocks{Style.RESET_ALL}")
-    if len(v_blocks) + len(j_blocks) > sequence_length:
-        print(f"{Fore.YELLOW}   Skipping {len(v_blocks) + len(j_blocks) - sequence_length} voice+jingle blocks{Style.RESET_ALL}")
-    
-    return m_sequence, voice_sequence_trimmed
-
-def build_multi_channel_sequence(blocks_dir, m_sequence, voice_sequence):
-    """Build the final sequence with 15-second music channel offset"""
+def build_multi_channel_sequence(blocks_dir, m_sequence, voice_sequence, workers=None):
+    """
+    Build the final sequence with 15-second music channel offset (the 'classic' lane layout)
+    workers > 1 mixes time ranges in parallel processes (see render_plan_audio)
+    """
     try:
-        print(f"{Fore.BLUE}🔊 Building audio sequence...{Style.RESET_ALL}")
-        
-        # Validate sequences have the same length
-        if len(m_sequence) != len(voice_sequence):
-            print(f"{Fore.RED}❌ Error: Music sequence ({len(m_sequence)}) and voice sequence ({len(voice_sequence)}) have different lengths{Style.RESET_ALL}")
+        # Lanes may differ in length (a sequence fitted to a duration ends on music); the shorter one is padded
+        if not m_sequence:
+            print(f"{Fore.RED}❌ Error: the music sequence is empty{Style.RESET_ALL}")
             return None
-        
-        # Create 15 seconds of silence for voice channel offset
-        silence_15s = AudioSegment.silent(duration=15000)
-
-        # Initialize channels - music starts immediately, voice starts after 15s
-        music_channel = AudioSegment.empty()  # ← Music starts at 0:00
-        voice_channel = silence_15s  # ← Voice starts at 0:15 (after 15s silence)
-        
-        # Load and concatenate music blocks
-        print(f"{Fore.BLUE}   Loading music channel...{Style.RESET_ALL}")
-        for i, block in enumerate(m_sequence, 1):
-            block_path = os.path.join(blocks_dir, block)
-            if not os.path.exists(block_path):
-                print(f"{Fore.RED}❌ Music block not found: {block}{Style.RESET_ALL}")
-                return None
-            audio_segment = AudioSegment.from_file(block_path)
-            music_channel += audio_segment
-            print(f"{Fore.GREEN}     [{i}/{len(m_sequence)}] Added: {block}{Style.RESET_ALL}")
-        
-        # Load and concatenate voice blocks (mixed v and j)
-        print(f"{Fore.BLUE}   Loading voice channel...{Style.RESET_ALL}")
-        for i, block in enumerate(voice_sequence, 1):
-            block_path = os.path.join(blocks_dir, block)
-            if not os.path.exists(block_path):
-                print(f"{Fore.RED}❌ Voice block not found: {block}{Style.RESET_ALL}")
+        for block in m_sequence + voice_sequence:
+            if not os.path.exists(block_path(blocks_dir, block)):
+                print(f"{Fore.RED}❌ Block not found: {block}{Style.RESET_ALL}")
                 return None
-            audio_segment = AudioSegment.from_file(block_path)
-            voice_channel += audio_segment
-            block_type = "JINGLE" if block.startswith('j') else "VOICE"
-            print(f"{Fore.GREEN}     [{i}/{len(voice_sequence)}] Added: {block} ({block_type}){Style.RESET_ALL}")
-        
-        # Ensure both channels are the same length (pad with silence if needed)
-        if len(music_channel) > len(voice_channel):
-            voice_channel += AudioSegment.silent(duration=len(music_channel) - len(voice_channel))
-        elif len(voice_channel) > len(music_channel):
-            music_channel += AudioSegment.silent(duration=len(voice_channel) - len(music_channel))
-        
-        # Mix the two stereo channels
-        print(f"{Fore.BLUE}   Mixing channels...{Style.RESET_ALL}")
-        final_audio = music_channel.overlay(voice_channel)
         
-        print(f"{Fore.GREEN}✅ Sequence built: {len(final_audio)/1000:.1f}s total duration{Style.RESET_ALL}")
-        return final_audio
+        plan = create_sequence_plan(blocks_dir, m_sequence, voice_sequence)
+        return render_plan_audio(plan, blocks_dir, workers)
         
     except Exception as e:
         print(f"{Fore.RED}❌ Error building sequence: {e}{Style.RESET_ALL}")
@@ -1091,8 +1429,7 @@ def run_sequencer():
     if not validate_sequence_requirements(m_blocks, v_blocks, j_blocks):
         return
     
-    max_blocks = min(len(m_blocks), len(v_blocks) + len(j_blocks))
-    max_minutes = (max_blocks * 30) / 60
+    max_minutes = max_sequence_minutes(blocks_dir, m_blocks, v_blocks, j_blocks)
     
     print(f"{Fore.GREEN}✅ Found {len(m_blocks)} music blocks and {len(v_blocks) + len(j_blocks)} voice+jingle blocks{Style.RESET_ALL}")
     print(f"{Fore.GREEN}📊 Maximum sequence: {max_minutes:.1f} minutes{Style.RESET_ALL}")
@@ -1120,24 +1457,13 @@ def run_sequencer():
         print(f"{Fore.RED}❌ Sequencing failed{Style.RESET_ALL}")
         return
     
-    output_path = ask_save_file()
+    output_path = ask_sequence_save_file()
     
     if not output_path:
         print(f"{Fore.RED}❌ No output file selected. Exiting.{Style.RESET_ALL}")
         return
     
-    try:
-        print(f"{Fore.BLUE}Exporting sequence...{Style.RESET_ALL}")
-        final_audio.export(output_path, format="mp3", bitrate="192k")
-        print(f"{Fore.GREEN}✅ Sequence saved: {output_path}{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}🎵 Final duration: {blocks_info['total_duration']:.1f} seconds{Style.RESET_ALL}")
-        
-        generate_sequence_timeline(output_path, blocks_dir, 
-                                 blocks_info['m_sequence'], blocks_info['voice_sequence'], 
-                                 blocks_info['total_duration'])
-        
-    except Exception as e:
-        print(f"{Fore.RED}❌ Error exporting sequence: {e}{Style.RESET_ALL}")
+    if not export_sequence(final_audio, output_path, blocks_info):
         return
     
     print(f"{Fore.CYAN}=== Audio Sequencer Completed ==={Style.RESET_ALL}")
@@ -1170,8 +1496,7 @@ def run_slice_and_sequence_with_labels():
         print(f"{Fore.RED}❌ Not enough blocks for sequencing{Style.RESET_ALL}")
         return
 
-    max_blocks = min(len(m_blocks), len(v_blocks) + len(j_blocks))
-    max_minutes = (max_blocks * 30) / 60
+    max_minutes = max_sequence_minutes(blocks_dir, m_blocks, v_blocks, j_blocks)
 
     print(f"{Fore.GREEN}✅ Available: {len(m_blocks)} music + {len(v_blocks)} voice + {len(j_blocks)} jingle blocks{Style.RESET_ALL}")
     print(f"{Fore.GREEN}📊 Maximum sequence: {max_minutes:.1f} minutes{Style.RESET_ALL}")
@@ -1198,30 +1523,54 @@ def run_slice_and_sequence_with_labels():
         print(f"{Fore.RED}❌ Sequencing failed{Style.RESET_ALL}")
         return
 
-    output_path = ask_save_file()
+    output_path = ask_sequence_save_file()
     
     if not output_path:
         print(f"{Fore.RED}❌ No output file selected. Exiting.{Style.RESET_ALL}")
         return
     
+    if not export_sequence(final_audio, output_path, blocks_info):
+        return
+    
+    print(f"{Fore.CYAN}=== Slice & Sequence Workflow Completed ==={Style.RESET_ALL}")
+
+def export_sequence(final_audio, output_path, blocks_info):
+    """Export a built sequence in its codec (see sequence_codec_for) and write its timeline next to it"""
     try:
-        print(f"{Fore.BLUE}Exporting final sequence...{Style.RESET_ALL}")
-        final_audio.export(output_path, format="mp3", bitrate="192k")
-        print(f"{Fore.GREEN}✅ Final sequence saved: {output_path}{Style.RESET_ALL}")
+        codec = sequence_codec_for(output_path)
+        print(f"{Fore.BLUE}Exporting sequence ({describe_codec(codec)})...{Style.RESET_ALL}")
+        block_count = len(plan_blocks(blocks_info['plan'])) if blocks_info.get('plan') else len(blocks_info['m_sequence']) + len(blocks_info['voice_sequence'])
+        with trace_span('encode', blocks=block_count) as span:
+            if isinstance(final_audio, StreamedSequence):
+                final_audio.export(output_path, format=codec, bitrate=f"{ENCODER_BITRATE_KBPS}k")
+                span.add(bytes=os.path.getsize(output_path))
+            else:
+                span.add(bytes=write_audio(final_audio, output_path, codec=codec))
+        print(f"{Fore.GREEN}✅ Sequence saved: {output_path}{Style.RESET_ALL}")
         print(f"{Fore.GREEN}🎵 Final duration: {blocks_info['total_duration']:.1f} seconds{Style.RESET_ALL}")
         
-        generate_sequence_timeline(output_path, blocks_dir, 
-                                 blocks_info['m_sequence'], blocks_info['voice_sequence'],
-                                 blocks_info['total_duration'])
+        generate_sequence_timeline(output_path, blocks_info['blocks_dir'], 
+                                 blocks_info['m_sequence'], blocks_info['voice_sequence'], 
+                                 blocks_info['total_duration'], blocks_info.get('plan'))
+        if blocks_info.get('plan'):
+            save_sequence_plan(blocks_info['plan'], sequence_plan_path(output_path))
+            played = [block['file'] for block in plan_blocks(blocks_info['plan'])]
+        else:
+            played = blocks_info['m_sequence'] + blocks_info['voice_sequence']
+        record_block_usage(blocks_info['blocks_dir'], os.path.basename(output_path), played)
+        return True
         
     except Exception as e:
         print(f"{Fore.RED}❌ Error exporting sequence: {e}{Style.RESET_ALL}")
-        return
-    
-    print(f"{Fore.CYAN}=== Slice & Sequence Workflow Completed ==={Style.RESET_ALL}")
+        return False
 
-def generate_sequence_timeline(sequence_path, blocks_dir, m_sequence, voice_sequence, audio_duration):
-    """Generate a timeline text file for the created sequence"""
+@traced('catalog')
+def generate_sequence_timeline(sequence_path, blocks_dir, m_sequence, voice_sequence, audio_duration, plan=None):
+    """
+    Generate a timeline text file for the created sequence. Blocks and start times
+    come from the plan (all its lanes) when given, else from the two classic lanes
+    and the blocks' real durations (duration index).
+    """
     try:
         txt_path = os.path.splitext(sequence_path)[0] + '.txt'
         
@@ -1232,9 +1581,19 @@ def generate_sequence_timeline(sequence_path, blocks_dir, m_sequence, voice_sequ
         seconds = int(audio_duration % 60)
         duration_str = f"{minutes:02d}:{seconds:02d}"
         
+        # Block start times: from the plan (every lane), else the classic lanes played
+        # back to back at their real lengths, voice 15 s in
+        if plan:
+            placed = [(block['offset'], block['file']) for block in plan_blocks(plan)]
+        else:
+            durations = block_durations(blocks_dir, m_sequence + voice_sequence)
+            placed = (list(zip(lane_block_offsets(m_sequence, durations), m_sequence)) +
+                      list(zip(lane_block_offsets(voice_sequence, durations, VOICE_OFFSET_SECONDS), voice_sequence)))
+        sequence_blocks = [block for _, block in placed]
+        
         # Count blocks by category
         block_counts = {}
-        for block in m_sequence + voice_sequence:
+        for block in sequence_blocks:
             category = block[0]
             block_counts[category] = block_counts.get(category, 0) + 1
         
@@ -1265,7 +1624,7 @@ def generate_sequence_timeline(sequence_path, blocks_dir, m_sequence, voice_sequ
             print(f"{Fore.YELLOW}⚠️  Could not read Excel for metadata: {e}{Style.RESET_ALL}")
         
         # Fall back to MP3 metadata
-        for block in m_sequence + voice_sequence:
+        for block in sorted(set(sequence_blocks)):
             block_name = os.path.splitext(block)[0]
             
             if (block_name not in descriptions or 
@@ -1273,7 +1632,7 @@ def generate_sequence_timeline(sequence_path, blocks_dir, m_sequence, voice_sequ
                 block_name not in origins or 
                 origins.get(block_name) == 'Unknown origin'):
                 
-                mp3_path = os.path.join(blocks_dir, block)
+                mp3_path = block_path(blocks_dir, block)
                 if os.path.exists(mp3_path):
                     metadata = read_audio_metadata(mp3_path)
                     if metadata:
@@ -1285,48 +1644,18 @@ def generate_sequence_timeline(sequence_path, blocks_dir, m_sequence, voice_sequ
         # Build timeline entries
         timeline_entries = []
         
-        for i in range(len(m_sequence)):
-            # Music block start time (delayed by 15 seconds)
-            music_time = (i * 30) + 0
-            music_minutes = music_time // 60
-            music_seconds = music_time % 60
-            music_time_str = f"{music_minutes:02d}:{music_seconds:02d}"
-            
-            music_block = m_sequence[i]
-            music_name = os.path.splitext(music_block)[0]
-            music_desc = descriptions.get(music_name, 'No description')
-            music_origin = origins.get(music_name, 'Unknown origin')
-            
+        for block_time, block in placed:
+            block_minutes = int(block_time // 60)
+            block_seconds = int(block_time % 60)
+            block_name = os.path.splitext(block)[0]
             timeline_entries.append({
-                'time': music_time,
-                'time_str': music_time_str,
-                'block': music_name,
-                'description': music_desc,
-                'origin': music_origin,
-                'type': 'music'
+                'time': block_time,
+                'time_str': f"{block_minutes:02d}:{block_seconds:02d}",
+                'block': block_name,
+                'description': descriptions.get(block_name, 'No description'),
+                'origin': origins.get(block_name, 'Unknown origin'),
+                'type': "jingle" if block.startswith('j') else "voice" if block.startswith('v') else "music"
             })
-            
-            # Voice/jingle block start time (starts immediately)
-            if i < len(voice_sequence):
-                voice_time = i * 30 + 15
-                voice_minutes = voice_time // 60
-                voice_seconds = voice_time % 60
-                voice_time_str = f"{voice_minutes:02d}:{voice_seconds:02d}"
-                
-                voice_block = voice_sequence[i]
-                voice_name = os.path.splitext(voice_block)[0]
-                voice_desc = descriptions.get(voice_name, 'No description')
-                voice_origin = origins.get(voice_name, 'Unknown origin')
-                voice_type = "jingle" if voice_block.startswith('j') else "voice"
-                
-                timeline_entries.append({
-                    'time': voice_time,
-                    'time_str': voice_time_str,
-                    'block': voice_name,
-                    'description': voice_desc,
-                    'origin': voice_origin,
-                    'type': voice_type
-                })
         
         # Sort all entries by time
         timeline_entries.sort(key=lambda x: x['time'])
@@ -1356,8 +1685,12 @@ def calculate_max_possible_minutes(audio_duration_seconds, slice_duration=30, mi
     max_minutes = (max_slices * slice_duration) / 60
     return max_minutes
 
-def generate_balanced_random_slices(audio_duration_seconds, total_minutes, slice_duration=30, min_spacing=60):
-    """Generate random slices with balanced m/v/j split and proper spacing"""
+def generate_balanced_random_slices(audio_duration_seconds, total_minutes, slice_duration=30, min_spacing=60, pyramid=None):
+    """
+    Generate random slices with balanced m/v/j split and proper spacing.
+    If a peak pyramid is given, silent positions are rejected and each slice is
+    centred on the loudest moment near its random position.
+    """
     num_slices = int(total_minutes * 2)
     
     # Ensure divisible by 3 for balanced distribution
@@ -1377,7 +1710,7 @@ def generate_balanced_random_slices(audio_duration_seconds, total_minutes, slice
     for i in range(num_m):
         slice_info = _generate_slice_with_spacing(
             safe_start, safe_end, used_positions, min_spacing, 
-            'm', f"Random music segment {i+1}", slice_duration
+            'm', f"Random music segment {i+1}", slice_duration, pyramid
         )
         if slice_info:
             slices.append(slice_info)
@@ -1386,7 +1719,7 @@ def generate_balanced_random_slices(audio_duration_seconds, total_minutes, slice
     for i in range(num_v):
         slice_info = _generate_slice_with_spacing(
             safe_start, safe_end, used_positions, min_spacing,
-            'v', f"Random voice segment {i+1}", slice_duration
+            'v', f"Random voice segment {i+1}", slice_duration, pyramid
         )
         if slice_info:
             slices.append(slice_info)
@@ -1395,7 +1728,7 @@ def generate_balanced_random_slices(audio_duration_seconds, total_minutes, slice
     for i in range(num_j):
         slice_info = _generate_slice_with_spacing(
             safe_start, safe_end, used_positions, min_spacing,
-            'j', f"Random jingle segment {i+1}", slice_duration
+            'j', f"Random jingle segment {i+1}", slice_duration, pyramid
         )
         if slice_info:
             slices.append(slice_info)
@@ -1403,13 +1736,19 @@ def generate_balanced_random_slices(audio_duration_seconds, total_minutes, slice
     slices.sort(key=lambda x: x['climax_time'])
     return slices
 
-def _generate_slice_with_spacing(safe_start, safe_end, used_positions, min_spacing, slice_type, description, slice_duration):
+def _generate_slice_with_spacing(safe_start, safe_end, used_positions, min_spacing, slice_type, description, slice_duration, pyramid=None):
     """Helper function to generate a single slice with proper spacing"""
     max_attempts = 100
     
     for attempt in range(max_attempts):
         center = random.uniform(safe_start, safe_end)
         
+        if pyramid:
+            # Snap to the loudest moment nearby and skip silent stretches
+            center = min(safe_end, max(safe_start, find_climax(pyramid, center - slice_duration / 4, center + slice_duration / 4)))
+            if is_silent_region(pyramid, center - slice_duration / 2, center + slice_duration / 2):
+                continue
+        
         too_close = any(abs(center - pos) < min_spacing for pos in used_positions)
         
         if not too_close:
@@ -1442,8 +1781,7 @@ def generate_random_slices_and_sequence():
     
     print(f"{Fore.BLUE}Loading audio file...{Style.RESET_ALL}")
     try:
-        audio = AudioSegment.from_file(audio_file)
-        audio_duration_seconds = len(audio) / 1000
+        audio, audio_duration_seconds = load_source_audio(audio_file)
         audio_duration_minutes = audio_duration_seconds / 60
         
         print(f"{Fore.GREEN}✅ Audio loaded: {audio_duration_minutes:.1f} minutes ({audio_duration_seconds:.0f} seconds){Style.RESET_ALL}")
@@ -1451,6 +1789,8 @@ def generate_random_slices_and_sequence():
         print(f"{Fore.RED}❌ Error loading audio file: {e}{Style.RESET_ALL}")
         return
     
+    pyramid = get_peak_pyramid(audio_file, audio)
+    
     max_minutes = calculate_max_possible_minutes(audio_duration_seconds)
     print(f"{Fore.BLUE}Maximum content that can be extracted: {max_minutes:.1f} minutes{Style.RESET_ALL}")
     print()
@@ -1474,7 +1814,7 @@ def generate_random_slices_and_sequence():
             print(f"{Fore.RED}❌ Please enter a valid number{Style.RESET_ALL}")
     
     print(f"{Fore.BLUE}Generating {requested_minutes:.1f} minutes of random slices...{Style.RESET_ALL}")
-    slices = generate_balanced_random_slices(audio_duration_seconds, requested_minutes)
+    slices = generate_balanced_random_slices(audio_duration_seconds, requested_minutes, pyramid=pyramid)
     
     if not slices:
         print(f"{Fore.RED}❌ Could not generate valid slices{Style.RESET_ALL}")
@@ -1494,57 +1834,40 @@ def generate_random_slices_and_sequence():
     
     excel_path = os.path.join(blocks_dir, "blocks_list.xlsx")
 
-    import tempfile
-    temp_txt_path = os.path.join(tempfile.gettempdir(), "random_slices_temp.txt")
+    print(f"{Fore.BLUE}Step 3: Slicing audio...{Style.RESET_ALL}")
+    print(f"{Fore.GREEN}Audio file: {audio_file}{Style.RESET_ALL}")
+    print(f"{Fore.GREEN}Output directory: {blocks_dir}{Style.RESET_ALL}")
+    print()
     
-    try:
-        with open(temp_txt_path, 'w', encoding='utf-8') as f:
-            for slice_info in slices:
-                f.write(f"{slice_info['climax_time']:.2f}\t{slice_info['climax_time']:.2f}\t{slice_info['type']}\t{slice_info['description']}\n")
-        
-        print(f"{Fore.GREEN}✅ Created slice definitions{Style.RESET_ALL}")
-        
-        print(f"{Fore.BLUE}Step 3: Slicing audio...{Style.RESET_ALL}")
-                
-        print(f"{Fore.GREEN}Audio file: {audio_file}{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}Output directory: {blocks_dir}{Style.RESET_ALL}")
+    print(f"{Fore.CYAN}Processing slices...{Style.RESET_ALL}")
+    created = []
+    for slice_info in slices:
+        output_path = process_audio_slice_mp3(audio, slice_info, blocks_dir, audio_file)
+        created.append(output_path)
         print()
-        
-        print(f"{Fore.CYAN}Processing slices...{Style.RESET_ALL}")
-        for slice_info in slices:
-
-            
-            output_path = process_audio_slice_mp3(audio, slice_info, blocks_dir, audio_file)
-            print()
-        
-        verify_files_vs_excel(blocks_dir, excel_path)
-        print(f"{Fore.GREEN}✅ Audio slicing completed!{Style.RESET_ALL}")
-        
-        print(f"{Fore.BLUE}Step 4: Sequencing slices...{Style.RESET_ALL}")
-        success, final_audio, blocks_info = create_sequence_from_blocks(blocks_dir, requested_minutes)
-        if not success:
-            print(f"{Fore.YELLOW}⚠️  Sequencing failed, but slicing completed successfully{Style.RESET_ALL}")
-            return
-
-        output_path = ask_save_file()
-        
-        if not output_path:
-            print(f"{Fore.YELLOW}⚠️  No output file selected, but slicing completed successfully{Style.RESET_ALL}")
-            return
-        
-        final_audio.export(output_path, format="mp3", bitrate="192k")
-        print(f"{Fore.GREEN}✅ Final sequence saved: {output_path}{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}🎵 Final duration: {len(final_audio)/1000:.1f} seconds{Style.RESET_ALL}")
-        
-        generate_sequence_timeline(output_path, blocks_dir, blocks_info['m_sequence'], blocks_info['voice_sequence'], blocks_info['total_duration'])
-        
-        print(f"{Fore.CYAN}=== Option 3 → Option 2 Workflow Completed ==={Style.RESET_ALL}")
-        actual_minutes = blocks_info['total_duration'] / 60
-        print(f"{Fore.GREEN}🎉 Successfully created {actual_minutes:.1f} minutes of sequenced content!{Style.RESET_ALL}")
+    index_new_blocks(blocks_dir, created)
+    
+    verify_files_vs_excel(blocks_dir, excel_path)
+    print(f"{Fore.GREEN}✅ Audio slicing completed!{Style.RESET_ALL}")
+    
+    print(f"{Fore.BLUE}Step 4: Sequencing slices...{Style.RESET_ALL}")
+    success, final_audio, blocks_info = create_sequence_from_blocks(blocks_dir, requested_minutes)
+    if not success:
+        print(f"{Fore.YELLOW}⚠️  Sequencing failed, but slicing completed successfully{Style.RESET_ALL}")
+        return
 
-    finally:
-        if os.path.exists(temp_txt_path):
-            os.remove(temp_txt_path)
+    output_path = ask_sequence_save_file()
+    
+    if not output_path:
+        print(f"{Fore.YELLOW}⚠️  No output file selected, but slicing completed successfully{Style.RESET_ALL}")
+        return
+    
+    if not export_sequence(final_audio, output_path, blocks_info):
+        return
+    
+    print(f"{Fore.CYAN}=== Option 3 → Option 2 Workflow Completed ==={Style.RESET_ALL}")
+    actual_minutes = blocks_info['total_duration'] / 60
+    print(f"{Fore.GREEN}🎉 Successfully created {actual_minutes:.1f} minutes of sequenced content!{Style.RESET_ALL}")
 
 def run_audio_slicer_with_labels():
     """Run audio slicer with existing label file"""
@@ -1572,19 +1895,23 @@ def generate_timestamp_id():
     now = datetime.now()
     return now.strftime("%Y%m%d%H%M%S") + f"{now.microsecond // 10000:02d}"
 
-def create_sequence_from_blocks(blocks_dir, desired_minutes=None):
+def select_sequence_blocks(blocks_dir, desired_minutes=None, fix_problematic=None, rng=None, tolerance=None, specs=None):
     """
-    Core sequencing function used by both Option 2 and Option 3.2
-    If desired_minutes is None, use all available blocks
-    Returns: success (bool), final_audio (AudioSegment), selected_blocks_info (dict)
+    Scan, narrow the pools with --pool, check (and optionally repair) the blocks,
+    drop near-duplicates with --skip-duplicates, and pick the random order of every lane of the layout
+    (specs, default: lane_layout()). With desired_minutes,
+    the lanes are fitted to that length by the blocks' real durations (see
+    select_lane_sequences); otherwise every block is used. Returns [blocks per
+    lane], or None when there are not enough valid blocks.
     """
-    print(f"{Fore.CYAN}=== Creating Audio Sequence ==={Style.RESET_ALL}")
-    
     print(f"{Fore.BLUE}Scanning for audio blocks...{Style.RESET_ALL}")
     m_blocks, v_blocks, j_blocks = scan_available_blocks(blocks_dir)
+    if POOL_QUERY:
+        m_blocks, v_blocks, j_blocks = filter_block_pools(blocks_dir, POOL_QUERY, m_blocks, v_blocks, j_blocks)
+        print(f"{Fore.BLUE}🔎 Pool narrowed by --pool to {len(m_blocks)} m, {len(v_blocks)} v, {len(j_blocks)} j blocks{Style.RESET_ALL}")
     
     if not validate_sequence_requirements(m_blocks, v_blocks, j_blocks):
-        return False, None, None
+        return None
     
     # Check for problematic files
     print(f"{Fore.BLUE}Checking audio files...{Style.RESET_ALL}")
@@ -1601,16 +1928,20 @@ def create_sequence_from_blocks(blocks_dir, desired_minutes=None):
         
         # Offer to fix problematic files
         if all_problematic:
-            response = input(f"{Fore.WHITE}Would you like to attempt to fix these files? (y/N): {Style.RESET_ALL}").strip().lower()
-            if response in ['y', 'yes']:
+            if fix_problematic is None:
+                response = input(f"{Fore.WHITE}Would you like to attempt to fix these files? (y/N): {Style.RESET_ALL}").strip().lower()
+                fix_problematic = response in ['y', 'yes']
+            if fix_problematic:
                 fixed_count = 0
+                print(f"{Fore.BLUE}🛠️  Re-encoding {len(all_problematic)} files...{Style.RESET_ALL}")
+                fixed = fix_problematic_files([block_path(blocks_dir, filename) for filename, _ in all_problematic])
                 for filename, error in all_problematic:
-                    file_path = os.path.join(blocks_dir, filename)
-                    if fix_problematic_file(file_path):
+                    file_path = block_path(blocks_dir, filename)
+                    if fixed[file_path]:
                         fixed_count += 1
                         # Re-check if the file is now valid
                         try:
-                            audio = AudioSegment.from_file(file_path)
+                            audio = decode_audio_file(file_path)
                             if len(audio) > 0:
                                 # Add to valid lists based on file prefix
                                 if filename.startswith('m'):
@@ -1632,68 +1963,126 @@ def create_sequence_from_blocks(blocks_dir, desired_minutes=None):
     v_blocks = v_blocks_valid
     j_blocks = j_blocks_valid
     
+    if SKIP_DUPLICATES:
+        duplicates = find_duplicate_blocks(blocks_dir, m_blocks + v_blocks + j_blocks)
+        if duplicates:
+            print(f"{Fore.YELLOW}⏭️  Skipping {len(duplicates)} near-duplicate blocks{Style.RESET_ALL}")
+            m_blocks = [block for block in m_blocks if block not in duplicates]
+            v_blocks = [block for block in v_blocks if block not in duplicates]
+            j_blocks = [block for block in j_blocks if block not in duplicates]
+    
     # Check if we still have enough files
     if len(m_blocks) < 3 or (len(v_blocks) + len(j_blocks)) < 3:
         print(f"{Fore.RED}❌ Not enough valid files after filtering. Need at least 3 music and 3 voice+jingle blocks.{Style.RESET_ALL}")
         print(f"{Fore.RED}   Valid music: {len(m_blocks)}, Valid voice+jingle: {len(v_blocks) + len(j_blocks)}{Style.RESET_ALL}")
-        return False, None, None
+        return None
     
+    pools = {'m': m_blocks, 'v': v_blocks, 'j': j_blocks}
     if desired_minutes is not None:
-        blocks_needed = int((desired_minutes * 60) / 30)
-        blocks_to_use = min(blocks_needed, len(m_blocks), len(v_blocks) + len(j_blocks))
-        print(f"{Fore.BLUE}Using {blocks_to_use} blocks from each channel for {desired_minutes} minute sequence{Style.RESET_ALL}")
-    else:
-        blocks_to_use = min(len(m_blocks), len(v_blocks) + len(j_blocks))
-        print(f"{Fore.BLUE}Using all available blocks: {blocks_to_use} from each channel{Style.RESET_ALL}")
+        selection = select_lane_sequences(blocks_dir, pools, specs, desired_minutes * 60, tolerance, rng)
+        if selection:
+            return selection
     
-    m_sequence, voice_sequence = create_random_sequence(m_blocks, v_blocks, j_blocks)
+    print(f"{Fore.BLUE}Using all available blocks{Style.RESET_ALL}")
+    return select_lane_sequences(blocks_dir, pools, specs, rng=rng)
+
+def create_sequence_from_blocks(blocks_dir, desired_minutes=None, fix_problematic=None, workers=None, seed=None, tolerance=None):
+    """
+    Core sequencing function used by both Option 2 and Option 3.2
+    If desired_minutes is None, use all available blocks
+    The lanes follow the current layout (set_lane_layout, --lanes)
+    fix_problematic: None asks the user, True/False decides without prompting
+    workers: mix time ranges on this many processes (see render_plan_audio)
+    seed: seed of the block order (default: a fresh one); it is recorded in the plan
+    tolerance: seconds the length may miss desired_minutes by (default SEQUENCE_DURATION_TOLERANCE)
+    Returns: success (bool), final_audio (AudioSegment), selected_blocks_info (dict, with the sequence plan)
+    """
+    print(f"{Fore.CYAN}=== Creating Audio Sequence ==={Style.RESET_ALL}")
     
-    if desired_minutes is not None:
-        m_sequence = m_sequence[:blocks_to_use]
-        voice_sequence = voice_sequence[:blocks_to_use]
-        print(f"{Fore.GREEN}Selected {blocks_to_use} blocks from each channel{Style.RESET_ALL}")
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    specs = lane_layout()
+    selection = select_sequence_blocks(blocks_dir, desired_minutes, fix_problematic, random.Random(seed), tolerance, specs)
+    if not selection:
+        return False, None, None
+    plan = create_lane_plan(blocks_dir, selection, specs, seed)
     
-    final_audio = build_multi_channel_sequence(blocks_dir, m_sequence, voice_sequence)
+    if fits_in_memory(estimate_pcm_bytes(plan['duration']) * 2):
+        final_audio = render_plan_audio(plan, blocks_dir, workers)
+    else:
+        final_audio = stream_plan_audio(plan, blocks_dir)
     if not final_audio:
         return False, None, None
     
+    m_sequence, voice_sequence = plan_sequences(plan)
     selected_blocks_info = {
         'm_sequence': m_sequence,
         'voice_sequence': voice_sequence,
         'blocks_dir': blocks_dir,
-        'total_duration': len(final_audio) / 1000
+        'total_duration': len(final_audio) / 1000,
+        'plan': plan
     }
     
     return True, final_audio, selected_blocks_info
 
-def write_audio_metadata(file_path, origin, description, audio_type, climax_time):
-    """Write metadata to MP3 file including origin and description"""
+@traced('tag write')
+def write_audio_metadata(file_path, origin, description, audio_type, climax_time, mp3_data=None, fingerprint=None):
+    """
+    Write metadata to MP3 file including origin and description.
+    With mp3_data, file_path is created: the tag is written first and the audio
+    appended after it, since tagging a finished file makes eyed3 rewrite it
+    through a temp file. The audio is written even if tagging fails.
+    fingerprint: the block's audio fingerprint (see audio_fingerprint), if known.
+    """
+    tagged = False
     try:
-        audiofile = eyed3.load(file_path)
-        if audiofile.tag is None:
-            audiofile.initTag()
+        if mp3_data is None:
+            audiofile = eyed3.load(file_path)
+            if audiofile.tag is None:
+                audiofile.initTag()
+            tag = audiofile.tag
+        else:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            tag = _load_id3().Tag()
         
-        audiofile.tag.artist = f"Audio Slicer - {audio_type}"
-        audiofile.tag.album = "Audio Blocks"
-        audiofile.tag.title = f"{audio_type} block - {description[:50]}"
+        tag.artist = f"Audio Slicer - {audio_type}"
+        tag.album = "Audio Blocks"
+        tag.title = f"{audio_type} block - {description[:50]}"
         
-        audiofile.tag.comments.set(f"Origin: {origin} | Description: {description} | Climax: {climax_time}s | Type: {audio_type}")
+        tag.comments.set(f"Origin: {origin} | Description: {description} | Climax: {climax_time}s | Type: {audio_type}")
 
-        audiofile.tag.user_text_frames.set("ORIGIN_FILE", origin)
-        audiofile.tag.user_text_frames.set("DESCRIPTION", description)
-        audiofile.tag.user_text_frames.set("AUDIO_TYPE", audio_type)
-        audiofile.tag.user_text_frames.set("CLIMAX_TIME", str(climax_time))
-        audiofile.tag.user_text_frames.set("SLICE_SIZE", str(SLICE_SIZE))
+        tag.user_text_frames.set("ORIGIN_FILE", origin)
+        tag.user_text_frames.set("DESCRIPTION", description)
+        tag.user_text_frames.set("AUDIO_TYPE", audio_type)
+        tag.user_text_frames.set("CLIMAX_TIME", str(climax_time))
+        tag.user_text_frames.set("SLICE_SIZE", str(SLICE_SIZE))
+        if fingerprint:
+            tag.user_text_frames.set("FINGERPRINT", fingerprint)
         
-        audiofile.tag.save()
+        if mp3_data is None:
+            tag.save()
+        else:
+            tag.save(file_path)
+        tagged = True
         print(f"{Fore.BLUE}   📝 Metadata written: origin, description, type{Style.RESET_ALL}")
-        return True
     except Exception as e:
         print(f"{Fore.YELLOW}⚠️  Could not write metadata to {file_path}: {e}{Style.RESET_ALL}")
-        return False
+    if mp3_data is not None:
+        with open(file_path, 'ab' if tagged else 'wb') as f:
+            f.write(mp3_data)
+    return tagged
 
 def read_audio_metadata(file_path):
-    """Read metadata from MP3 file, including parsing the Origin comment field"""
+    """
+    Read metadata from MP3 file, including parsing the Origin comment field.
+    Other block formats are read from their .meta.json sidecar.
+    """
+    if codec_for_path(file_path, 'mp3') != 'mp3':
+        sidecar = read_metadata_sidecar(file_path)
+        if sidecar is None:
+            return None
+        return {key: sidecar.get(key) for key in ('origin', 'description', 'audio_type', 'climax_time', 'fingerprint')}
     try:
         audiofile = eyed3.load(file_path)
         if audiofile.tag is None:
@@ -1703,7 +2092,8 @@ def read_audio_metadata(file_path):
             'origin': None,
             'description': None, 
             'audio_type': None,
-            'climax_time': None
+            'climax_time': None,
+            'fingerprint': None
         }
         
         for frame in audiofile.tag.user_text_frames:
@@ -1715,6 +2105,8 @@ def read_audio_metadata(file_path):
                 metadata['audio_type'] = frame.text
             elif frame.description == "CLIMAX_TIME":
                 metadata['climax_time'] = frame.text
+            elif frame.description == "FINGERPRINT":
+                metadata['fingerprint'] = frame.text
         
         if (not metadata['origin'] or not metadata['description']) and audiofile.tag.comments:
             for comment in audiofile.tag.comments:
@@ -1746,18 +2138,17 @@ def verify_audio_metadata(blocks_dir):
     print(f"\n{Fore.CYAN}=== Verifying Audio File Metadata ==={Style.RESET_ALL}")
     
     try:
-        all_files = os.listdir(blocks_dir)
-        audio_files = [f for f in all_files if f.endswith('.mp3')]
+        audio_files = list(scan_block_entries(blocks_dir))
         
         if not audio_files:
-            print(f"{Fore.YELLOW}⚠️  No MP3 files found in {blocks_dir}{Style.RESET_ALL}")
+            print(f"{Fore.YELLOW}⚠️  No audio blocks found in {blocks_dir}{Style.RESET_ALL}")
             return
         
         metadata_count = 0
         missing_metadata = []
         
         for audio_file in audio_files:
-            file_path = os.path.join(blocks_dir, audio_file)
+            file_path = block_path(blocks_dir, audio_file)
             metadata = read_audio_metadata(file_path)
             
             if metadata and metadata.get('origin') and metadata.get('description'):
@@ -1786,6 +2177,7 @@ def update_excel_from_folder(blocks_dir, excel_path):
     # ... existing code ...
     
     # Remove entries for files that don't exist
+    block_stems = {os.path.splitext(block)[0] for block in all_blocks}
     cleanup_count = 0
     for sheet_name in ['m', 'v', 'j']:
         existing_df = existing_data[sheet_name]
@@ -1795,8 +2187,8 @@ def update_excel_from_folder(blocks_dir, excel_path):
             # Keep only entries where the file actually exists
             valid_entries = []
             for _, row in existing_df.iterrows():
-                filename = f"{row[column_name]}.mp3"
-                if filename in all_blocks:
+                filename = str(row[column_name])
+                if filename in block_stems:
                     valid_entries.append(row)
                 else:
                     cleanup_count += 1
@@ -1814,16 +2206,17 @@ def show_advanced_menu():
 {Fore.GREEN}1 - Update Excel from existing blocks folder{Style.RESET_ALL}
 {Fore.BLUE}2 - Verify files vs Excel database{Style.RESET_ALL}
 {Fore.MAGENTA}3 - Verify audio file metadata{Style.RESET_ALL}
-{Fore.YELLOW}4 - Back to main menu{Style.RESET_ALL}
+{Fore.CYAN}4 - Preview label positions (peak overview){Style.RESET_ALL}
+{Fore.YELLOW}5 - Back to main menu{Style.RESET_ALL}
 """
     print(advanced_text)
     
     while True:
-        choice = input(f"{Fore.WHITE}Select option (1-4): {Style.RESET_ALL}").strip()
-        if choice in ['1', '2', '3', '4']:
+        choice = input(f"{Fore.WHITE}Select option (1-5): {Style.RESET_ALL}").strip()
+        if choice in ['1', '2', '3', '4', '5']:
             return choice
         else:
-            print(f"{Fore.RED}❌ Invalid choice. Please enter 1-4.{Style.RESET_ALL}")
+            print(f"{Fore.RED}❌ Invalid choice. Please enter 1-5.{Style.RESET_ALL}")
 
 def run_advanced_options():
     """Run advanced options"""
@@ -1857,12 +2250,28 @@ def run_advanced_options():
                 print(f"{Fore.RED}❌ No folder selected{Style.RESET_ALL}")
                 
         elif choice == '4':
+            # Preview labels from the cached peak pyramid
+            audio_file = select_audio_file()
+            if audio_file:
+                audition_labels(audio_file)
+            else:
+                print(f"{Fore.RED}❌ No audio file selected{Style.RESET_ALL}")
+                
+        elif choice == '5':
             break
         
         input(f"\n{Fore.WHITE}Press Enter to continue...{Style.RESET_ALL}")
 
-def update_excel_from_folder(blocks_dir, excel_path):
-    """Scan blocks folder and update Excel with all files found, removing orphaned entries"""
+@traced('catalog')
+def update_excel_from_folder(blocks_dir, excel_path, skip_duplicates=None):
+    """
+    Scan blocks folder and update Excel with all files found, removing orphaned entries.
+    New entries get the block's fingerprint, and near-duplicates of an earlier
+    block are flagged in 'duplicate_of' (or not added, with skip_duplicates;
+    default: SKIP_DUPLICATES, see --skip-duplicates).
+    """
+    if skip_duplicates is None:
+        skip_duplicates = SKIP_DUPLICATES
     print(f"{Fore.CYAN}=== Updating Excel from Folder Scan ==={Style.RESET_ALL}")
     
     if not os.path.exists(blocks_dir):
@@ -1878,6 +2287,10 @@ def update_excel_from_folder(blocks_dir, excel_path):
         return False
     
     print(f"{Fore.GREEN}Found {len(all_blocks)} audio files to process{Style.RESET_ALL}")
+    fingerprints = block_fingerprints(blocks_dir, all_blocks)
+    duplicates = find_duplicate_blocks(blocks_dir, all_blocks, fingerprints)
+    block_loudness(blocks_dir, all_blocks)  # measures blocks sliced before loudness was recorded, once
+    index_block_attributes(blocks_dir, all_blocks, prune=True)
     
     # Create or load Excel file
     try:
@@ -1898,7 +2311,8 @@ def update_excel_from_folder(blocks_dir, excel_path):
                 'j': pd.DataFrame(columns=['j', 'origin', 'description'])
             }
         
-        # CLEANUP PHASE: Remove orphaned entries
+        # CLEANUP PHASE: Remove orphaned entries (matched by stem, whatever the block format)
+        block_stems = {os.path.splitext(block)[0] for block in all_blocks}
         cleanup_count = 0
         for sheet_name in ['m', 'v', 'j']:
             existing_df = existing_data[sheet_name]
@@ -1908,8 +2322,8 @@ def update_excel_from_folder(blocks_dir, excel_path):
                 # Keep only entries where the file actually exists
                 valid_entries = []
                 for _, row in existing_df.iterrows():
-                    filename = f"{row[column_name]}.mp3"
-                    if filename in all_blocks:
+                    filename = str(row[column_name])
+                    if filename in block_stems:
                         valid_entries.append(row)
                     else:
                         cleanup_count += 1
@@ -1926,7 +2340,7 @@ def update_excel_from_folder(blocks_dir, excel_path):
         skipped_count = 0
         
         for block_file in all_blocks:
-            block_path = os.path.join(blocks_dir, block_file)
+            file_path = block_path(blocks_dir, block_file)
             block_name = os.path.splitext(block_file)[0]  # Remove extension
             
             # Determine type from filename prefix
@@ -1947,8 +2361,16 @@ def update_excel_from_folder(blocks_dir, excel_path):
                     skipped_count += 1
                     continue
             
+            duplicate_of = duplicates.get(block_file)
+            if duplicate_of:
+                if skip_duplicates:
+                    print(f"{Fore.YELLOW}   ⏭️  Skipping {block_file}: near-duplicate of {duplicate_of}{Style.RESET_ALL}")
+                    skipped_count += 1
+                    continue
+                print(f"{Fore.YELLOW}   ⚠️  {block_file} is a near-duplicate of {duplicate_of}{Style.RESET_ALL}")
+            
             # Read metadata from audio file
-            metadata = read_audio_metadata(block_path)
+            metadata = read_audio_metadata(file_path)
             
             if metadata:
                 origin = metadata.get('origin', 'Unknown origin')
@@ -1957,7 +2379,9 @@ def update_excel_from_folder(blocks_dir, excel_path):
                 new_entry = {
                     column_name: block_name,
                     'origin': origin,
-                    'description': description
+                    'description': description,
+                    'fingerprint': fingerprints.get(block_file, ''),
+                    'duplicate_of': os.path.splitext(duplicate_of)[0] if duplicate_of else ''
                 }
                 new_entries[block_type].append(new_entry)
                 print(f"{Fore.GREEN}   ✅ Will add: {block_file}{Style.RESET_ALL}")
@@ -1967,7 +2391,9 @@ def update_excel_from_folder(blocks_dir, excel_path):
                 new_entry = {
                     column_name: block_name,
                     'origin': 'Unknown origin',
-                    'description': 'Imported from folder scan'
+                    'description': 'Imported from folder scan',
+                    'fingerprint': fingerprints.get(block_file, ''),
+                    'duplicate_of': os.path.splitext(duplicate_of)[0] if duplicate_of else ''
                 }
                 new_entries[block_type].append(new_entry)
                 print(f"{Fore.YELLOW}   ⚠️  Adding without metadata: {block_file}{Style.RESET_ALL}")
@@ -2004,6 +2430,4578 @@ def update_excel_from_folder(blocks_dir, excel_path):
         traceback.print_exc()
         return False
 
+# ============================================================================
+# PEAK PYRAMID (multi-resolution min/max/RMS summary per source)
+# ============================================================================
+
+PEAK_BASE_RESOLUTION_MS = 10  # finest bucket size
+PEAK_LEVEL_FACTOR = 8  # each level merges this many buckets of the level below
+PEAK_LEVEL_COUNT = 5  # 10ms, 80ms, 640ms, 5.12s, 40.96s
+PEAK_FILE_VERSION = 1
+PEAK_DECODE_RATE = 22050  # sample rate used when ffmpeg has to decode the source
+SILENCE_THRESHOLD_DBFS = -50.0
+
+def get_peak_file_path(audio_file):
+    """Get the peak pyramid sidecar path for a source audio file"""
+    return os.path.splitext(audio_file)[0] + '.peaks.npz'
+
+def _wav_samples_to_float(raw, sample_width, channels):
+    """Convert interleaved little-endian PCM bytes to a mono float32 array in [-1, 1]"""
+    if sample_width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        as_int = (packed[:, 0].astype(np.int32) | (packed[:, 1].astype(np.int32) << 8) | (packed[:, 2].astype(np.int32) << 16))
+        as_int = np.where(as_int >= 1 << 23, as_int - (1 << 24), as_int)
+        samples = as_int.astype(np.float32) / float(1 << 23)
+    else:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / float(1 << 31)
+    
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+def iter_audio_chunks(audio_file, chunk_seconds=10):
+    """
+    Stream a source file as mono float32 chunks without loading it whole.
+    Yields (sample_rate, samples) tuples. WAV files are read directly,
+    everything else is decoded through an ffmpeg pipe.
+    """
+    if audio_file.lower().endswith('.wav'):
+        import wave
+        try:
+            with wave.open(audio_file, 'rb') as wav:
+                sample_rate = wav.getframerate()
+                channels = wav.getnchannels()
+                sample_width = wav.getsampwidth()
+                chunk_frames = int(sample_rate * chunk_seconds)
+                while True:
+                    raw = wav.readframes(chunk_frames)
+                    if not raw:
+                        break
+                    yield sample_rate, _wav_samples_to_float(raw, sample_width, channels)
+            return
+        except wave.Error:
+            pass  # Not plain PCM (e.g. float WAV) - let ffmpeg decode it
+    
+    import subprocess
+    cmd = ['ffmpeg', '-v', 'error', '-i', audio_file, '-vn',
+           '-f', 's16le', '-ac', '1', '-ar', str(PEAK_DECODE_RATE), 'pipe:1']
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        chunk_bytes = int(PEAK_DECODE_RATE * chunk_seconds) * 2
+        while True:
+            raw = process.stdout.read(chunk_bytes)
+            if not raw:
+                break
+            yield PEAK_DECODE_RATE, _wav_samples_to_float(raw[:len(raw) - len(raw) % 2], 2, 1)
+    finally:
+        process.stdout.close()
+        process.wait()
+        if process.returncode not in (0, None):
+            raise RuntimeError(f"ffmpeg could not decode {audio_file} (exit code {process.returncode})")
+
+def _iter_segment_chunks(audio, chunk_seconds=10):
+    """Yield (sample_rate, samples) mono float32 chunks from an already loaded AudioSegment"""
+    chunk_ms = int(chunk_seconds * 1000)
+    for start_ms in range(0, len(audio), chunk_ms):
+        part = audio[start_ms:start_ms + chunk_ms]
+        yield audio.frame_rate, _wav_samples_to_float(part.raw_data, part.sample_width, part.channels)
+
+def build_peak_pyramid(chunks):
+    """
+    Build a min/max/RMS peak pyramid from a stream of (sample_rate, samples) chunks.
+    Only one base-resolution bucket of samples is carried between chunks, so the
+    source never has to be held in memory.
+    """
+    mins, maxs, squares = [], [], []
+    leftover = np.zeros(0, dtype=np.float32)
+    sample_rate = None
+    total_samples = 0
+    
+    for rate, samples in chunks:
+        if sample_rate is None:
+            sample_rate = rate
+        total_samples += len(samples)
+        samples = np.concatenate([leftover, samples]) if len(leftover) else samples
+        bucket_size = max(1, int(round(sample_rate * PEAK_BASE_RESOLUTION_MS / 1000)))
+        full = len(samples) - len(samples) % bucket_size
+        if full:
+            buckets = samples[:full].reshape(-1, bucket_size)
+            mins.append(buckets.min(axis=1))
+            maxs.append(buckets.max(axis=1))
+            squares.append(np.square(buckets, dtype=np.float64).mean(axis=1))
+        leftover = samples[full:]
+    
+    if sample_rate is None:
+        raise ValueError("No audio data to analyse")
+    
+    if len(leftover):
+        mins.append(np.array([leftover.min()], dtype=np.float32))
+        maxs.append(np.array([leftover.max()], dtype=np.float32))
+        squares.append(np.array([np.square(leftover, dtype=np.float64).mean()]))
+    
+    level_min = np.concatenate(mins)
+    level_max = np.concatenate(maxs)
+    level_sq = np.concatenate(squares)
+    
+    levels = []
+    for _ in range(PEAK_LEVEL_COUNT):
+        levels.append({
+            'min': np.round(np.clip(level_min, -1.0, 1.0) * 32767).astype(np.int16),
+            'max': np.round(np.clip(level_max, -1.0, 1.0) * 32767).astype(np.int16),
+            'rms': np.round(np.sqrt(np.clip(level_sq, 0.0, 1.0)) * 65535).astype(np.uint16)
+        })
+        # Pad to a multiple of the factor and merge into the next coarser level
+        pad = (-len(level_min)) % PEAK_LEVEL_FACTOR
+        if pad:
+            level_min = np.concatenate([level_min, np.full(pad, level_min[-1])])
+            level_max = np.concatenate([level_max, np.full(pad, level_max[-1])])
+            level_sq = np.concatenate([level_sq, np.full(pad, level_sq[-1])])
+        level_min = level_min.reshape(-1, PEAK_LEVEL_FACTOR).min(axis=1)
+        level_max = level_max.reshape(-1, PEAK_LEVEL_FACTOR).max(axis=1)
+        level_sq = level_sq.reshape(-1, PEAK_LEVEL_FACTOR).mean(axis=1)
+    
+    return {
+        'version': PEAK_FILE_VERSION,
+        'sample_rate': sample_rate,
+        'duration': total_samples / sample_rate,
+        'base_ms': PEAK_BASE_RESOLUTION_MS,
+        'factor': PEAK_LEVEL_FACTOR,
+        'levels': levels
+    }
+
+def save_peak_pyramid(pyramid, peak_path, audio_file):
+    """Write a peak pyramid to its sidecar file, stamped with the source size and mtime"""
+    stat = os.stat(audio_file)
+    meta = {
+        'version': pyramid['version'],
+        'sample_rate': pyramid['sample_rate'],
+        'duration': pyramid['duration'],
+        'base_ms': pyramid['base_ms'],
+        'factor': pyramid['factor'],
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns
+    }
+    arrays = {'meta': np.array(json.dumps(meta))}
+    for index, level in enumerate(pyramid['levels']):
+        for key in ('min', 'max', 'rms'):
+            arrays[f"level{index}_{key}"] = level[key]
+    
+    # np.savez appends .npz unless the name already ends with it
+    temp_path = peak_path[:-len('.npz')] + '.tmp.npz'
+    np.savez(temp_path, **arrays)
+    os.replace(temp_path, peak_path)
+
+def load_peak_pyramid(peak_path, audio_file=None):
+    """Load a peak pyramid sidecar. Returns None if missing or stale for audio_file."""
+    if not os.path.exists(peak_path):
+        return None
+    try:
+        with np.load(peak_path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') != PEAK_FILE_VERSION:
+                return None
+            if audio_file:
+                stat = os.stat(audio_file)
+                if stat.st_size != meta['source_size'] or stat.st_mtime_ns != meta['source_mtime_ns']:
+                    return None
+            levels = []
+            index = 0
+            while f"level{index}_min" in data:
+                levels.append({key: data[f"level{index}_{key}"] for key in ('min', 'max', 'rms')})
+                index += 1
+    except Exception as e:
+        print(f"{Fore.YELLOW}⚠️  Could not read peak file {peak_path}: {e}{Style.RESET_ALL}")
+        return None
+    
+    return {
+        'version': meta['version'],
+        'sample_rate': meta['sample_rate'],
+        'duration': meta['duration'],
+        'base_ms': meta['base_ms'],
+        'factor': meta['factor'],
+        'levels': levels
+    }
+
+def get_peak_pyramid(audio_file, audio=None, rebuild=False):
+    """
+    Return the peak pyramid for a source, building and caching it if needed.
+    If the source is already loaded, pass it as audio to avoid a second decode.
+    """
+    peak_path = get_peak_file_path(audio_file)
+    if not rebuild:
+        pyramid = load_peak_pyramid(peak_path, audio_file)
+        if pyramid:
+            return pyramid
+    
+    try:
+        print(f"{Fore.BLUE}📈 Building peak overview for {os.path.basename(audio_file)}...{Style.RESET_ALL}")
+        chunks = _iter_segment_chunks(audio) if audio is not None else iter_audio_chunks(audio_file)
+        pyramid = build_peak_pyramid(chunks)
+    except Exception as e:
+        print(f"{Fore.YELLOW}⚠️  Could not build peak overview: {e}{Style.RESET_ALL}")
+        return None
+    
+    try:
+        save_peak_pyramid(pyramid, peak_path, audio_file)
+    except Exception as e:
+        print(f"{Fore.YELLOW}⚠️  Could not save peak file {peak_path}: {e}{Style.RESET_ALL}")
+    return pyramid
+
+def parse_timestamp(value):
+    """Parse '01:23:45', '23:45.5' or '83.5' into seconds"""
+    parts = str(value).strip().split(':')
+    if len(parts) > 3:
+        raise ValueError(f"Invalid timestamp: {value}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def _amplitude_to_dbfs(amplitude):
+    """Convert a linear amplitude (1.0 = full scale) to dBFS"""
+    if amplitude <= 0:
+        return float('-inf')
+    return 20 * np.log10(amplitude)
+
+def query_peak_window(pyramid, start_seconds, end_seconds, max_buckets=64):
+    """
+    Summarise [start_seconds, end_seconds) from the pyramid.
+    Picks the finest level that covers the window in at most max_buckets buckets,
+    so the cost is independent of the source length.
+    """
+    start_seconds = max(0.0, start_seconds)
+    end_seconds = min(pyramid['duration'], end_seconds)
+    if end_seconds <= start_seconds:
+        return None
+    
+    bucket_seconds = pyramid['base_ms'] / 1000
+    level_index = 0
+    while (level_index < len(pyramid['levels']) - 1 and
+           (end_seconds - start_seconds) / bucket_seconds > max_buckets):
+        level_index += 1
+        bucket_seconds *= pyramid['factor']
+    
+    level = pyramid['levels'][level_index]
+    first = int(start_seconds / bucket_seconds)
+    last = max(first + 1, int(np.ceil(end_seconds / bucket_seconds)))
+    window_min = level['min'][first:last]
+    window_max = level['max'][first:last]
+    window_rms = level['rms'][first:last].astype(np.float64) / 65535
+    if not len(window_rms):
+        return None
+    
+    rms = float(np.sqrt(np.mean(np.square(window_rms))))
+    peak = max(abs(int(window_min.min())), abs(int(window_max.max()))) / 32767
+    return {
+        'start': start_seconds,
+        'end': end_seconds,
+        'min': int(window_min.min()) / 32767,
+        'max': int(window_max.max()) / 32767,
+        'peak': peak,
+        'rms': rms,
+        'peak_dbfs': _amplitude_to_dbfs(peak),
+        'rms_dbfs': _amplitude_to_dbfs(rms),
+        'level': level_index
+    }
+
+def loudness_at(pyramid, timestamp, window_seconds=1.0):
+    """RMS loudness (dBFS) around a timestamp such as '01:23:45'"""
+    center = parse_timestamp(timestamp) if isinstance(timestamp, str) else float(timestamp)
+    summary = query_peak_window(pyramid, center - window_seconds / 2, center + window_seconds / 2)
+    return summary['rms_dbfs'] if summary else None
+
+def format_dbfs(value, width=0):
+    """'-12.3' for a level in dBFS, 'n/a' where there was nothing to measure (right-aligned to width)"""
+    return f"{value:{width}.1f}" if value is not None else "n/a".rjust(width)
+
+def is_silent_region(pyramid, start_seconds, end_seconds, threshold_dbfs=SILENCE_THRESHOLD_DBFS):
+    """Check whether a region of the source stays below the silence threshold"""
+    summary = query_peak_window(pyramid, start_seconds, end_seconds)
+    return summary is None or summary['peak_dbfs'] < threshold_dbfs
+
+def find_climax(pyramid, start_seconds, end_seconds, window_seconds=1.0):
+    """Return the time (seconds) of the loudest window_seconds stretch inside a region"""
+    bucket_seconds = pyramid['base_ms'] / 1000
+    level_index = 0
+    while (level_index < len(pyramid['levels']) - 1 and
+           bucket_seconds * pyramid['factor'] <= window_seconds):
+        level_index += 1
+        bucket_seconds *= pyramid['factor']
+    
+    rms = pyramid['levels'][level_index]['rms']
+    first = max(0, int(start_seconds / bucket_seconds))
+    last = min(len(rms), int(np.ceil(end_seconds / bucket_seconds)))
+    if last <= first:
+        return (start_seconds + end_seconds) / 2
+    
+    # Smooth over the window so a single spike does not win over a loud passage
+    width = max(1, int(round(window_seconds / bucket_seconds)))
+    energy = np.square(rms[first:last].astype(np.float64))
+    if width > 1 and len(energy) >= width:
+        energy = np.convolve(energy, np.ones(width) / width, mode='same')
+    return (first + int(np.argmax(energy)) + 0.5) * bucket_seconds
+
+def render_peak_preview(pyramid, start_seconds, end_seconds, width=60):
+    """Render a one-line text waveform of a region, using only the pyramid"""
+    bars = " ▁▂▃▄▅▆▇█"
+    step = (end_seconds - start_seconds) / width
+    line = []
+    for column in range(width):
+        summary = query_peak_window(pyramid, start_seconds + column * step, start_seconds + (column + 1) * step)
+        if summary is None:
+            line.append(' ')
+            continue
+        # Map -60..0 dBFS onto the bar characters
+        level = (max(-60.0, summary['peak_dbfs']) + 60.0) / 60.0
+        line.append(bars[int(round(level * (len(bars) - 1)))])
+    return ''.join(line)
+
+def audition_labels(audio_file):
+    """Show loudness and a waveform preview for every label, without reloading the source"""
+    txt_file = get_corresponding_txt_file(audio_file)
+    if not verify_files_exist(audio_file, txt_file):
+        return False
+    
+    pyramid = get_peak_pyramid(audio_file)
+    if not pyramid:
+        return False
+    
+    slices = parse_audio_txt(txt_file, pyramid['duration'])
+    print(f"\n{Fore.CYAN}=== Label Preview: {os.path.basename(audio_file)} ({pyramid['duration']:.1f}s) ==={Style.RESET_ALL}")
+    for i, slice_info in enumerate(slices, 1):
+        summary = query_peak_window(pyramid, slice_info['slice_begin'], slice_info['slice_end'])
+        preview = render_peak_preview(pyramid, slice_info['slice_begin'], slice_info['slice_end'], width=30)
+        climax_loudness = loudness_at(pyramid, slice_info['climax_time'])
+        color = Fore.YELLOW if is_silent_region(pyramid, slice_info['slice_begin'], slice_info['slice_end']) else Fore.GREEN
+        print(f"{color}  {i:3d}. {slice_info['type']} @ {slice_info['climax_time']:8.1f}s |{preview}| "
+              f"RMS {format_dbfs(summary['rms_dbfs'] if summary else None, 6)} dBFS, "
+              f"climax {format_dbfs(climax_loudness, 6)} dBFS - {slice_info['description']}{Style.RESET_ALL}")
+    return True
+
+# ============================================================================
+# BATCH SLICING (many sources, one worker pool, one catalog writer)
+# ============================================================================
+
+SOURCE_AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.aiff', '.aac', '.ogg', '.m4a')
+
+def get_audio_duration(audio_file):
+    """
+    Get a source's duration in seconds without decoding it when possible:
+    the file's header (see header_duration), then a fresh peak pyramid, then ffprobe, then a full decode.
+    """
+    duration = header_duration(audio_file)
+    if duration is not None:
+        return duration
+    
+    pyramid = load_peak_pyramid(get_peak_file_path(audio_file), audio_file)
+    if pyramid:
+        return pyramid['duration']
+    
+    try:
+        import subprocess
+        cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', audio_file]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode == 0 and result.stdout.strip():
+            return float(result.stdout.strip())
+    except (OSError, ValueError):
+        pass
+    
+    return len(decode_audio_file(audio_file)) / 1000
+
+@traced('load')
+def load_audio_range(audio_file, start_seconds, end_seconds):
+    """Load only [start_seconds, end_seconds) of a source as an AudioSegment"""
+    start_seconds = max(0.0, start_seconds)
+    if audio_file.lower().endswith('.wav'):
+        import wave
+        try:
+            with wave.open(audio_file, 'rb') as wav:
+                frame_rate = wav.getframerate()
+                wav.setpos(min(wav.getnframes(), int(start_seconds * frame_rate)))
+                raw = wav.readframes(int((end_seconds - start_seconds) * frame_rate))
+                return AudioSegment(data=raw, sample_width=wav.getsampwidth(),
+                                    frame_rate=frame_rate, channels=wav.getnchannels())
+        except wave.Error:
+            pass
+    
+    return decode_audio_pipe(audio_file, start_seconds, end_seconds - start_seconds)
+
+def allocate_timestamp_ids(count, blocks_dir):
+    """Reserve count consecutive block IDs that do not collide with files in blocks_dir"""
+    existing = set()
+    if os.path.exists(blocks_dir):
+        existing = {os.path.splitext(f)[0][1:] for f in scan_block_entries(blocks_dir)}
+    
+    ids = []
+    candidate = int(generate_timestamp_id())
+    while len(ids) < count:
+        if str(candidate) not in existing:
+            ids.append(str(candidate))
+        candidate += 1
+    return ids
+
+def read_batch_manifest(manifest_path):
+    """
+    Read a batch manifest. Accepts JSON (a list of paths or {"audio", "labels"}
+    objects, optionally under a "sources" key) or plain text with one
+    'audio[<TAB>labels]' per line. Relative paths are resolved against the manifest.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    
+    def resolve(path):
+        return path if not path or os.path.isabs(path) else os.path.join(base_dir, path)
+    
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    sources = []
+    if manifest_path.lower().endswith('.json'):
+        data = json.loads(content)
+        if isinstance(data, dict):
+            data = data.get('sources', [])
+        for item in data:
+            if isinstance(item, str):
+                sources.append((resolve(item), None))
+            else:
+                sources.append((resolve(item['audio']), resolve(item.get('labels'))))
+    else:
+        for line in content.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split('\t')
+            sources.append((resolve(parts[0]), resolve(parts[1]) if len(parts) > 1 else None))
+    return sources
+
+def collect_batch_sources(inputs):
+    """Expand directories, manifests and audio paths into (audio_file, txt_file) pairs"""
+    sources = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(SOURCE_AUDIO_EXTENSIONS):
+                    sources.append((os.path.join(path, name), None))
+        elif path.lower().endswith(('.json', '.txt', '.lst')):
+            sources.extend(read_batch_manifest(path))
+        else:
+            sources.append((path, None))
+    
+    return [(audio_file, txt_file or get_corresponding_txt_file(audio_file)) for audio_file, txt_file in sources]
+
+def plan_batch_jobs(sources, blocks_dir, slice_filter=None):
+    """
+    Parse every label file up front and return one job per slice,
+    ordered biggest source first so the longest work starts earliest.
+    slice_filter(audio_file, slice_info) can drop slices that are already done.
+    """
+    planned = []
+    for audio_file, txt_file in sources:
+        if not os.path.exists(audio_file):
+            print(f"{Fore.RED}❌ Skipping {audio_file}: file not found{Style.RESET_ALL}")
+            continue
+        if not txt_file or not os.path.exists(txt_file):
+            print(f"{Fore.YELLOW}⚠️  Skipping {os.path.basename(audio_file)}: no label file{Style.RESET_ALL}")
+            continue
+        try:
+            duration = get_audio_duration(audio_file)
+        except Exception as e:
+            print(f"{Fore.RED}❌ Skipping {os.path.basename(audio_file)}: cannot read duration ({e}){Style.RESET_ALL}")
+            continue
+        
+        slices = parse_audio_txt(txt_file, duration)
+        if slice_filter:
+            slices = [s for s in slices if slice_filter(audio_file, s)]
+        print(f"{Fore.BLUE}   {os.path.basename(audio_file)}: {len(slices)} slices, {duration:.0f}s{Style.RESET_ALL}")
+        planned.append((os.path.getsize(audio_file), audio_file, slices))
+    
+    planned.sort(key=lambda item: item[0], reverse=True)
+    
+    jobs = []
+    for size, audio_file, slices in planned:
+        for slice_info in slices:
+            jobs.append({'audio_file': audio_file, 'slice_info': slice_info, 'source_size': size})
+    
+    for job, timestamp_id in zip(jobs, allocate_timestamp_ids(len(jobs), blocks_dir)):
+        job['timestamp_id'] = timestamp_id
+        job['blocks_dir'] = blocks_dir
+        job['slice_size'] = SLICE_SIZE
+        job['fade_duration'] = FADE_DURATION
+        job['profile'] = tracing_enabled()
+        job['memory_budget'] = MEMORY_BUDGET_MB
+        job['block_codec'] = BLOCK_CODEC
+    return jobs
+
+def _batch_slice_worker(job):
+    """
+    Pool worker: decode one slice's range of its source and export the block.
+    Returns (catalog_entry_or_None, trace_events).
+    """
+    apply_slice_settings(job['slice_size'], job['fade_duration'])
+    set_memory_budget(job.get('memory_budget'))
+    set_codecs(block_codec=job.get('block_codec'))
+    if job.get('profile') and not tracing_enabled():
+        enable_tracing()
+        if MEMORY_BUDGET_MB is not None:
+            _TRACER.track_memory()
+    
+    slice_info = job['slice_info']
+    entry = None
+    try:
+        audio = load_audio_range(job['audio_file'], slice_info['slice_begin'], slice_info['slice_end'])
+        output_path = process_audio_slice_mp3(audio, slice_info, job['blocks_dir'], job['audio_file'],
+                                              timestamp_id=job['timestamp_id'], audio_offset=slice_info['slice_begin'])
+        if output_path:
+            entry = {
+                'type': slice_info['type'],
+                'name': os.path.splitext(os.path.basename(output_path))[0],
+                'file': os.path.basename(output_path),
+                'origin': job['audio_file'],
+                'description': slice_info['description']
+            }
+    except Exception as e:
+        print(f"{Fore.RED}❌ Error loading {os.path.basename(job['audio_file'])} at {slice_info['climax_time']}s: {e}{Style.RESET_ALL}")
+    return entry, collect_trace_events()
+
+def run_slice_jobs(pool, jobs):
+    """Run slice jobs on an executor. Returns (job, catalog_entry_or_None) pairs in block order."""
+    from concurrent.futures import as_completed
+    
+    futures = {pool.submit(_batch_slice_worker, job): job for job in jobs}
+    results = []
+    for future in as_completed(futures):
+        try:
+            entry, events = future.result()
+            if _TRACER is not None:
+                _TRACER.merge(events)
+        except Exception as e:
+            print(f"{Fore.RED}❌ Worker error: {e}{Style.RESET_ALL}")
+            entry = None
+        results.append((futures[future], entry))
+    
+    results.sort(key=lambda result: result[0]['timestamp_id'])
+    return results
+
+def run_batch_slicer(inputs, blocks_dir, workers=None):
+    """
+    Slice many sources on one process pool. Jobs from all sources share the
+    pool, so idle workers keep pulling slices until the whole batch is done,
+    and only the parent process writes the catalog.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import time
+    
+    print(f"{Fore.CYAN}=== Batch Slicer Started ==={Style.RESET_ALL}")
+    os.makedirs(blocks_dir, exist_ok=True)
+    excel_path = os.path.join(blocks_dir, "blocks_list.xlsx")
+    
+    sources = collect_batch_sources(inputs)
+    print(f"{Fore.BLUE}Parsing labels for {len(sources)} sources...{Style.RESET_ALL}")
+    jobs = plan_batch_jobs(sources, blocks_dir)
+    if not jobs:
+        print(f"{Fore.YELLOW}⚠️  No slices to process{Style.RESET_ALL}")
+        return False
+    
+    workers = workers or os.cpu_count() or 1
+    print(f"{Fore.GREEN}Processing {len(jobs)} slices on {workers} workers...{Style.RESET_ALL}")
+    
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = run_slice_jobs(pool, jobs)
+    elapsed = time.perf_counter() - started
+    
+    entries = [entry for job, entry in results if entry]
+    failed = len(results) - len(entries)
+    fingerprints = index_new_blocks(blocks_dir, [entry['file'] for entry in entries])
+    for entry in entries:
+        entry['fingerprint'] = fingerprints.get(entry['file'])
+    append_catalog_entries(excel_path, entries)
+    verify_files_vs_excel(blocks_dir, excel_path)
+    
+    print(f"\n{Fore.CYAN}--- Batch Summary ---{Style.RESET_ALL}")
+    print(f"{Fore.GREEN}✅ Created {len(entries)} blocks in {elapsed:.1f}s ({len(entries) / max(elapsed, 1e-9):.2f} blocks/s){Style.RESET_ALL}")
+    if failed:
+        print(f"{Fore.RED}❌ Failed slices: {failed}{Style.RESET_ALL}")
+    print(f"{Fore.CYAN}=== Batch Slicer Completed ==={Style.RESET_ALL}")
+    return failed == 0
+
+# ============================================================================
+# WATCH FOLDER (incremental slicing of new recordings)
+# ============================================================================
+
+WATCH_STATE_FILE = "processed_slices.json"
+
+def file_content_hash(file_path, known=None):
+    """
+    SHA-1 of a file's contents. known is an optional {'size', 'mtime_ns', 'sha1'}
+    record from a previous run; it is reused when the file has not changed.
+    """
+    import hashlib
+    stat = os.stat(file_path)
+    if known and known.get('size') == stat.st_size and known.get('mtime_ns') == stat.st_mtime_ns:
+        return known['sha1']
+    
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def slice_identity(source_hash, slice_info):
+    """Identity of a slice across runs: source contents plus climax time"""
+    return f"{source_hash}:{slice_info['climax_time']:.3f}"
+
+def load_watch_state(blocks_dir):
+    """Load the processed-slices state of a blocks folder"""
+    state_path = os.path.join(blocks_dir, WATCH_STATE_FILE)
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        state.setdefault('sources', {})
+        state.setdefault('slices', {})
+        return state
+    except FileNotFoundError:
+        return {'version': 1, 'sources': {}, 'slices': {}}
+    except Exception as e:
+        print(f"{Fore.YELLOW}⚠️  Could not read {state_path}, starting fresh: {e}{Style.RESET_ALL}")
+        return {'version': 1, 'sources': {}, 'slices': {}}
+
+def save_watch_state(blocks_dir, state):
+    """Write the processed-slices state atomically"""
+    state_path = os.path.join(blocks_dir, WATCH_STATE_FILE)
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, state_path)
+
+def scan_source_pairs(raw_dir):
+    """Return {audio_file: (txt_file, signature)} for every source that has a label file"""
+    pairs = {}
+    with os.scandir(raw_dir) as entries:
+        names = {entry.name: entry for entry in entries if entry.is_file()}
+    
+    for name, entry in names.items():
+        if not name.lower().endswith(SOURCE_AUDIO_EXTENSIONS):
+            continue
+        txt_name = os.path.splitext(name)[0] + '.txt'
+        txt_entry = names.get(txt_name)
+        if txt_entry is None:
+            continue
+        try:
+            audio_stat = entry.stat()
+            txt_stat = txt_entry.stat()
+        except FileNotFoundError:
+            continue  # removed since the listing; a later poll sees it again if it comes back
+        signature = (audio_stat.st_size, audio_stat.st_mtime_ns, txt_stat.st_size, txt_stat.st_mtime_ns)
+        pairs[entry.path] = (txt_entry.path, signature)
+    return pairs
+
+def process_new_slices(pool, pairs, blocks_dir, state):
+    """Slice the labels of the given pairs that are not in state yet, and catalog them"""
+    hashes = {}
+    for audio_file in pairs:
+        known = state['sources'].get(audio_file)
+        try:
+            hashes[audio_file] = file_content_hash(audio_file, known)
+        except FileNotFoundError:
+            pass  # removed since the scan
+    pairs = {audio_file: pair for audio_file, pair in pairs.items() if audio_file in hashes}
+    
+    def not_processed(audio_file, slice_info):
+        return slice_identity(hashes[audio_file], slice_info) not in state['slices']
+    
+    sources = [(audio_file, txt_file) for audio_file, (txt_file, signature) in pairs.items()]
+    jobs = plan_batch_jobs(sources, blocks_dir, slice_filter=not_processed)
+    
+    entries = []
+    failed_sources = set()
+    if jobs:
+        print(f"{Fore.GREEN}Slicing {len(jobs)} new labels...{Style.RESET_ALL}")
+        for job, entry in run_slice_jobs(pool, jobs):
+            if entry:
+                entries.append(entry)
+                state['slices'][slice_identity(hashes[job['audio_file']], job['slice_info'])] = entry['name']
+            else:
+                failed_sources.add(job['audio_file'])
+        fingerprints = index_new_blocks(blocks_dir, [entry['file'] for entry in entries])
+        for entry in entries:
+            entry['fingerprint'] = fingerprints.get(entry['file'])
+        append_catalog_entries(os.path.join(blocks_dir, "blocks_list.xlsx"), entries)
+    
+    # Sources with failed slices are not marked as seen, so the next poll retries them
+    for audio_file, (txt_file, signature) in pairs.items():
+        if audio_file in failed_sources:
+            continue
+        try:
+            audio_stat = os.stat(audio_file)
+        except FileNotFoundError:
+            continue
+        state['sources'][audio_file] = {
+            'size': audio_stat.st_size,
+            'mtime_ns': audio_stat.st_mtime_ns,
+            'sha1': hashes[audio_file],
+            'signature': list(signature)
+        }
+    save_watch_state(blocks_dir, state)
+    return entries
+
+def run_watch_folder(raw_dir, blocks_dir, interval=2.0, debounce=3.0, workers=None, once=False):
+    """
+    Poll raw_dir for new or changed source/label pairs and slice only labels
+    that were never processed. A pair is picked up once both files have kept
+    the same size and mtime for one poll and are at least debounce seconds old,
+    so half-copied recordings are not sliced. once=True slices what is there
+    now, without the debounce, and returns.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import time
+    
+    if not os.path.isdir(raw_dir):
+        print(f"{Fore.RED}❌ Watch folder not found: {raw_dir}{Style.RESET_ALL}")
+        return False
+    os.makedirs(blocks_dir, exist_ok=True)
+    state = load_watch_state(blocks_dir)
+    
+    print(f"{Fore.CYAN}=== Watching {raw_dir} (every {interval:g}s, Ctrl+C to stop) ==={Style.RESET_ALL}")
+    previous = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        try:
+            while True:
+                pairs = scan_source_pairs(raw_dir)
+                now_ns = time.time_ns()
+                ready = {}
+                for audio_file, (txt_file, signature) in pairs.items():
+                    known = state['sources'].get(audio_file)
+                    if known and tuple(known.get('signature', ())) == signature:
+                        continue
+                    # --once has no later poll to wait for, so it takes every pair as it is
+                    settled = once or previous.get(audio_file) == signature
+                    old_enough = once or (now_ns - max(signature[1], signature[3])) / 1e9 >= debounce
+                    if settled and old_enough:
+                        ready[audio_file] = (txt_file, signature)
+                previous = {audio_file: signature for audio_file, (txt_file, signature) in pairs.items()}
+                
+                if ready:
+                    print(f"{Fore.BLUE}📥 {len(ready)} new or changed sources{Style.RESET_ALL}")
+                    entries = process_new_slices(pool, ready, blocks_dir, state)
+                    print(f"{Fore.GREEN}✅ Added {len(entries)} blocks{Style.RESET_ALL}")
+                
+                if once:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print(f"\n{Fore.YELLOW}👋 Stopped watching{Style.RESET_ALL}")
+    return True
+
+# ============================================================================
+# FFMPEG JOB RUNNER (asyncio: many probe/repair processes, bounded concurrency)
+# ============================================================================
+
+FFMPEG_CONCURRENCY = min(8, os.cpu_count() or 2)
+FFMPEG_TIMEOUT = 120           # seconds per process before it is killed
+
+CommandResult = namedtuple('CommandResult', ['returncode', 'stdout', 'stderr', 'timed_out'])
+
+async def _run_command(cmd, semaphore, timeout):
+    """Run one command once a slot is free; kill it after timeout seconds"""
+    import asyncio
+    async with semaphore:
+        try:
+            process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            return CommandResult(-1, '', str(e), False)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return CommandResult(-1, '', f"timed out after {timeout}s", True)
+        return CommandResult(process.returncode, stdout.decode(errors='ignore'), stderr.decode(errors='ignore'), False)
+
+def run_commands(commands, concurrency=None, timeout=None):
+    """Run commands concurrently (at most `concurrency` at a time); results in input order"""
+    import asyncio
+    if not commands:
+        return []
+    
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency or FFMPEG_CONCURRENCY)
+        return await asyncio.gather(*(_run_command(cmd, semaphore, timeout or FFMPEG_TIMEOUT) for cmd in commands))
+    
+    with trace_span('ffmpeg', files=len(commands)):
+        return asyncio.run(run_all())
+
+def probe_false_video(file_paths):
+    """_is_false_video_detection for many files, answered from the folder probe caches"""
+    by_folder = {}
+    for path in file_paths:
+        # Blocks of a sharded folder share the probe cache of the whole folder
+        by_folder.setdefault(block_folder(path), []).append(path)
+    
+    reasons = {}
+    for folder, paths in by_folder.items():
+        probes = probe_folder(folder, [os.path.basename(path) for path in paths])
+        for path in paths:
+            reasons[path] = probe_false_video_reason(probes.get(os.path.basename(path)))
+    return reasons
+
+def run_diagnosis_commands(file_paths, concurrency=None, timeout=None):
+    """Run `file` and a full ffmpeg decode for each path concurrently; returns {path: (file_result, ffmpeg_result)}"""
+    commands = []
+    for path in file_paths:
+        commands.append(['file', path])
+        commands.append(['ffmpeg', '-v', 'error', '-i', path, '-f', 'null', '-'])
+    results = run_commands(commands, concurrency, timeout)
+    return {path: (results[2 * i], results[2 * i + 1]) for i, path in enumerate(file_paths)}
+
+def fix_problematic_files(file_paths, concurrency=None, timeout=None):
+    """
+    Re-encode many blocks concurrently, each in its own format. Each gets its own
+    temp file next to the original (so concurrent runs never collide and the
+    final replace is atomic). Returns {path: True if fixed}.
+    """
+    import tempfile
+    temp_paths = {}
+    commands = []
+    for path in file_paths:
+        codec = CODECS[codec_for_path(path, 'mp3')]
+        handle, temp_output = tempfile.mkstemp(prefix="fixed_", suffix=codec.extension, dir=os.path.dirname(os.path.abspath(path)))
+        os.close(handle)
+        temp_paths[path] = temp_output
+        input_args = []
+        if codec.name == 'pcm':
+            # Headerless: ffmpeg needs the layout from the sidecar to read it
+            layout = read_metadata_sidecar(path) or {}
+            input_args = ['-f', 's16le', '-ar', str(layout.get('frame_rate', 44100)), '-ac', str(layout.get('channels', 2))]
+        commands.append(['ffmpeg', '-y', '-v', 'error'] + input_args + ['-i', path] +
+                        [arg.format(bitrate=ENCODER_BITRATE_KBPS) for arg in codec.ffmpeg_args] +
+                        ['-map_metadata', '0',  # Copy metadata
+                         temp_output])
+    
+    results = run_commands(commands, concurrency, timeout)
+    
+    fixed = {}
+    for path, result in zip(file_paths, results):
+        temp_output = temp_paths[path]
+        if result.returncode == 0 and os.path.getsize(temp_output) > 0:
+            os.replace(temp_output, path)
+            print(f"{Fore.GREEN}✅ Successfully fixed: {os.path.basename(path)}{Style.RESET_ALL}")
+            fixed[path] = True
+        else:
+            reason = "timed out" if result.timed_out else (result.stderr.strip().splitlines() or ["ffmpeg failed"])[-1]
+            print(f"{Fore.RED}❌ Failed to fix: {os.path.basename(path)} ({reason}){Style.RESET_ALL}")
+            if os.path.exists(temp_output):
+                os.remove(temp_output)
+            fixed[path] = False
+    forget_block_entries(path for path, ok in fixed.items() if ok)
+    return fixed
+
+def repair_blocks_folder(blocks_dir, concurrency=None, timeout=None, dry_run=False):
+    """Find unreadable blocks, re-encode them all concurrently, diagnose what is still broken"""
+    import time
+    print(f"{Fore.CYAN}=== Repairing blocks in {blocks_dir} ==={Style.RESET_ALL}")
+    started = time.perf_counter()
+    
+    m_blocks, v_blocks, j_blocks = scan_available_blocks(blocks_dir)
+    all_blocks = m_blocks + v_blocks + j_blocks
+    _, problematic = check_for_corrupted_files(blocks_dir, all_blocks)
+    print(f"{Fore.BLUE}Checked {len(all_blocks)} blocks: {len(problematic)} unreadable{Style.RESET_ALL}")
+    for filename, error in problematic:
+        print(f"   - {filename}: {error}")
+    if not problematic or dry_run:
+        return not problematic
+    
+    paths = [path for path in (block_path(blocks_dir, filename) for filename, _ in problematic) if os.path.exists(path)]
+    print(f"{Fore.BLUE}🛠️  Re-encoding {len(paths)} files ({concurrency or FFMPEG_CONCURRENCY} at a time)...{Style.RESET_ALL}")
+    fix_problematic_files(paths, concurrency, timeout)
+    
+    _, still_broken = check_for_corrupted_files(blocks_dir, [filename for filename, _ in problematic])
+    if still_broken:
+        broken_paths = [block_path(blocks_dir, filename) for filename, _ in still_broken]
+        diagnosis = run_diagnosis_commands(broken_paths, concurrency, timeout)
+        for path in broken_paths:
+            diagnose_problematic_file(path, diagnosis[path])
+    
+    print(f"\n{Fore.CYAN}--- Repair Summary ---{Style.RESET_ALL}")
+    print(f"{Fore.GREEN}✅ Repaired: {len(problematic) - len(still_broken)}{Style.RESET_ALL}")
+    if still_broken:
+        print(f"{Fore.RED}❌ Still unreadable: {len(still_broken)}{Style.RESET_ALL}")
+        for filename, error in still_broken:
+            print(f"   - {filename}: {error}")
+    print(f"{Fore.BLUE}⏱️  {time.perf_counter() - started:.1f}s for {len(all_blocks)} blocks{Style.RESET_ALL}")
+    return not still_broken
+
+# ============================================================================
+# PROBE CACHE (one ffmpeg call probes many files; results cached per folder)
+# ============================================================================
+
+PROBE_CACHE_FILE = "probe_cache.json"
+TRUNCATION_TOLERANCE = 0.05    # a block decoding to more than this fraction short of its probed duration is truncated
+PROBE_BATCH_FILES = 200        # inputs per ffmpeg invocation
+PROBE_BATCH_CHARS = 24000      # keep command lines well under the Windows limit
+
+def _parse_probe_output(stderr):
+    """
+    Parse the input summaries ffmpeg prints for `ffmpeg -i a -i b ...`.
+    Returns {input_index: info} for every input it managed to open.
+    """
+    import re
+    inputs = {}
+    current = None
+    for line in stderr.splitlines():
+        match = re.match(r"Input #(\d+), (.+?), from '", line)
+        if match:
+            current = {'format': match.group(2), 'duration': None, 'bit_rate': None, 'streams': [], 'error': None, 'unavailable': False}
+            inputs[int(match.group(1))] = current
+            continue
+        if current is None:
+            continue
+        
+        match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", line)
+        if match:
+            hours, minutes, seconds = match.groups()
+            current['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            bit_rate = re.search(r"bitrate: (\d+) kb/s", line)
+            if bit_rate:
+                current['bit_rate'] = int(bit_rate.group(1)) * 1000
+            continue
+        
+        match = re.match(r"\s*Stream #\d+:\d+\S*: (\w+): (\w+)(.*)", line)
+        if match:
+            stream = {'codec_type': match.group(1).lower(), 'codec_name': match.group(2)}
+            sample_rate = re.search(r"(\d+) Hz", match.group(3))
+            if sample_rate:
+                stream['sample_rate'] = int(sample_rate.group(1))
+            channels = re.search(r"Hz, (mono|stereo|(\d+) channels)", match.group(3))
+            if channels:
+                stream['channels'] = {'mono': 1, 'stereo': 2}.get(channels.group(1)) or int(channels.group(2))
+            current['streams'].append(stream)
+    return inputs
+
+def _probe_failure(error, unavailable=False):
+    """Probe result for a file ffmpeg could not open (unavailable: the probe itself could not run)"""
+    return {'format': None, 'duration': None, 'bit_rate': None, 'streams': [], 'error': error, 'unavailable': unavailable}
+
+def _probe_chunks(file_paths):
+    """Split file_paths into ffmpeg invocations bounded by file count and command length"""
+    chunks, chunk, length = [], [], 0
+    for path in file_paths:
+        if chunk and (len(chunk) >= PROBE_BATCH_FILES or length + len(path) > PROBE_BATCH_CHARS):
+            chunks.append(chunk)
+            chunk, length = [], 0
+        chunk.append(path)
+        length += len(path) + 4
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def probe_files(file_paths, concurrency=None, timeout=None):
+    """
+    Probe many files with a few multi-input ffmpeg calls (run concurrently).
+    Returns {path: {'format', 'duration', 'bit_rate', 'streams', 'error'}}.
+    ffmpeg stops at the first input it cannot open, so the rest of that
+    chunk is probed again in the next round.
+    """
+    results = {}
+    pending = _probe_chunks(list(file_paths))
+    while pending:
+        commands = []
+        for chunk in pending:
+            cmd = ['ffmpeg', '-hide_banner', '-nostdin']
+            for path in chunk:
+                cmd += ['-i', path]
+            commands.append(cmd)
+        outputs = run_commands(commands, concurrency, timeout)
+        
+        retry = []
+        for chunk, output in zip(pending, outputs):
+            parsed = _parse_probe_output(output.stderr)
+            for index, path in enumerate(chunk):
+                if index in parsed:
+                    results[path] = parsed[index]
+            opened = len(parsed)
+            if opened >= len(chunk):
+                continue
+            
+            if output.timed_out or (output.returncode == -1 and not parsed):
+                # Timed out, or ffmpeg could not be started: nothing more to learn from this chunk
+                for path in chunk[opened:]:
+                    results[path] = _probe_failure(output.stderr.strip() or "probe failed", unavailable=True)
+                continue
+            
+            lines = [line for line in output.stderr.splitlines() if line.strip()]
+            results[chunk[opened]] = _probe_failure(lines[-1] if lines else "could not open input")
+            if chunk[opened + 1:]:
+                retry.append(chunk[opened + 1:])
+        pending = retry
+    return results
+
+def _probe_cache_path(blocks_dir):
+    return os.path.join(blocks_dir, PROBE_CACHE_FILE)
+
+def load_probe_cache(blocks_dir):
+    """Cached probe results of a folder: {filename: info with 'mtime' and 'size'}"""
+    try:
+        with open(_probe_cache_path(blocks_dir), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_probe_cache(blocks_dir, cache):
+    cache_path = _probe_cache_path(blocks_dir)
+    temp_path = cache_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"{Fore.YELLOW}⚠️  Could not save probe cache: {e}{Style.RESET_ALL}")
+
+def mark_probes_verified(blocks_dir, filenames):
+    """
+    Record in the probe cache that these files decoded in full. The mark is
+    dropped with the rest of the entry when a file's mtime or size changes.
+    """
+    cache = load_probe_cache(blocks_dir)
+    marked = [filename for filename in filenames if filename in cache]
+    for filename in marked:
+        cache[filename]['verified'] = True
+    if marked:
+        save_probe_cache(blocks_dir, cache)
+
+@traced('probe')
+def probe_folder(blocks_dir, filenames=None, refresh=False):
+    """
+    Stream info, duration and codec for the files of a folder as one dict
+    {filename: info}. Files whose mtime and size match the cache are not probed
+    again; the rest are probed in batches and the cache is rewritten.
+    """
+    if filenames is None:
+        filenames = list(scan_block_entries(blocks_dir))
+    # Headerless .pcm blocks are not something ffmpeg can probe; callers decode those
+    filenames = [f for f in filenames if not f.lower().endswith(CODECS['pcm'].extension)]
+    
+    cache = {} if refresh else load_probe_cache(blocks_dir)
+    stale = []
+    current = {}
+    for filename in filenames:
+        try:
+            stat = block_stat(blocks_dir, filename)
+        except OSError:
+            continue
+        current[filename] = (stat.st_mtime, stat.st_size)
+        cached = cache.get(filename)
+        if not cached or cached.get('mtime') != stat.st_mtime or cached.get('size') != stat.st_size:
+            stale.append(filename)
+    
+    if stale:
+        paths = {filename: block_path(blocks_dir, filename) for filename in stale}
+        probed = probe_files(list(paths.values()))
+        changed = False
+        for filename in stale:
+            info = probed[paths[filename]]
+            if info.pop('unavailable'):
+                # The probe could not run (no ffmpeg, timeout): that says nothing about the file
+                cache.pop(filename, None)
+                continue
+            info['mtime'], info['size'] = current[filename]
+            cache[filename] = info
+            changed = True
+        if changed:
+            save_probe_cache(blocks_dir, cache)
+    
+    return {filename: cache[filename] for filename in current if filename in cache}
+
+def is_probe_playable(info):
+    """True when a probe found a readable audio stream with a duration"""
+    return (info is not None and not info.get('error')
+            and (info.get('duration') or 0) > 0
+            and any(stream['codec_type'] == 'audio' for stream in info.get('streams', [])))
+
+def probe_false_video_reason(info):
+    """The _is_false_video_detection verdict for one probe result"""
+    if info is None or info.get('error'):
+        return None
+    for stream in info.get('streams', []):
+        # If FFmpeg detects video in an MP3 file, it's a false positive
+        if stream['codec_type'] == 'video':
+            return f"False video detection (codec: {stream.get('codec_name', 'unknown')})"
+    if not any(stream['codec_type'] == 'audio' for stream in info.get('streams', [])):
+        return "No audio streams detected"
+    return None
+
+# ============================================================================
+# ENCODER POOL (raw PCM in, MP3 or other codec bytes out, no temp files)
+# ============================================================================
+
+ENCODER_BITRATE_KBPS = 192
+ENCODER_QUALITY = 3            # LAME -q, same as the ffmpeg/lame default
+ENCODER_WORKERS = min(4, os.cpu_count() or 1)
+
+def _load_lameenc():
+    """In-process LAME bindings (pip install lameenc) if installed, else None"""
+    try:
+        import lameenc
+        return lameenc
+    except ImportError:
+        return None
+
+def parse_bitrate_kbps(bitrate):
+    """'192k' / '192' / 192 -> 192"""
+    return int(str(bitrate).lower().rstrip('k'))
+
+class PipeDrain:
+    """
+    Read a subprocess pipe (stderr) to EOF on a daemon thread, so a process
+    that writes a lot of errors never blocks on a full pipe while we are busy
+    with its other end. text() waits for EOF and returns what was read.
+    """
+    
+    def __init__(self, stream):
+        import threading
+        self.chunks = []
+        self.thread = threading.Thread(target=self._read, args=(stream,), daemon=True)
+        self.thread.start()
+    
+    def _read(self, stream):
+        for chunk in iter(lambda: stream.read(1 << 16), b''):
+            self.chunks.append(chunk)
+    
+    def text(self):
+        self.thread.join()
+        return b''.join(self.chunks).decode(errors='ignore').strip()
+
+class Mp3StreamWriter:
+    """
+    Incremental MP3 encoder: write() raw 16-bit PCM, close() to finish.
+    Encodes in-process with lameenc when it is installed, otherwise through one
+    ffmpeg process reading PCM on stdin and writing MP3 to stdout.
+    """
+    
+    def __init__(self, out_file, frame_rate, channels, bitrate_kbps=ENCODER_BITRATE_KBPS):
+        self.out_file = out_file
+        self.lame = None
+        self.process = None
+        lameenc = _load_lameenc() if channels in (1, 2) else None
+        if lameenc:
+            self.lame = lameenc.Encoder()
+            self.lame.set_bit_rate(bitrate_kbps)
+            self.lame.set_in_sample_rate(frame_rate)
+            self.lame.set_channels(channels)
+            self.lame.set_quality(ENCODER_QUALITY)
+            return
+        
+        import shutil
+        import subprocess
+        import threading
+        from pydub.utils import get_encoder_name
+        cmd = [get_encoder_name(), '-v', 'error', '-f', 's16le', '-ar', str(frame_rate), '-ac', str(channels),
+               '-i', 'pipe:0', '-f', 'mp3', '-b:a', f"{bitrate_kbps}k", 'pipe:1']
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Drain stdout and stderr on threads so a full pipe never blocks our writes
+        self.reader = threading.Thread(target=shutil.copyfileobj, args=(self.process.stdout, out_file), daemon=True)
+        self.reader.start()
+        self.errors = PipeDrain(self.process.stderr)
+    
+    def write(self, pcm):
+        if self.lame:
+            self.out_file.write(self.lame.encode(pcm))
+        else:
+            self.process.stdin.write(pcm)
+    
+    def close(self):
+        if self.lame:
+            self.out_file.write(self.lame.flush())
+            return
+        self.process.stdin.close()
+        self.reader.join()
+        stderr = self.errors.text()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"MP3 encoder failed: {stderr}")
+
+def finish_lame_tag(head):
+    """
+    Fill in the LAME tag CRC of the first frame (bytes 190-191, CRC-16 of bytes
+    0-189), which a streaming encoder cannot go back and write. Returns the new head.
+    """
+    if len(head) < 192 or head[0] != 0xFF or head.find(b'LAME', 0, 190) < 0:
+        return head
+    crc = 0
+    for byte in head[:190]:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return head[:190] + crc.to_bytes(2, 'big') + head[192:]
+
+def encode_mp3(segment, bitrate_kbps=ENCODER_BITRATE_KBPS):
+    """Encode an AudioSegment to MP3 bytes in memory"""
+    import io
+    segment = segment.set_sample_width(2)
+    buffer = io.BytesIO()
+    writer = Mp3StreamWriter(buffer, segment.frame_rate, segment.channels, bitrate_kbps)
+    writer.write(segment.raw_data)
+    writer.close()
+    return finish_lame_tag(buffer.getvalue())
+
+class EncoderPool:
+    """
+    Long-lived encoder workers shared by every export in this process.
+    submit(segment) returns a Future of the encoded bytes (MP3 unless codec says
+    otherwise); encode(segment) waits for it.
+    """
+    
+    def __init__(self, workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=workers or ENCODER_WORKERS, thread_name_prefix='encoder')
+    
+    def submit(self, segment, bitrate_kbps=ENCODER_BITRATE_KBPS, codec='mp3'):
+        return self.executor.submit(encode_audio, segment, codec, bitrate_kbps)
+    
+    def encode(self, segment, bitrate_kbps=ENCODER_BITRATE_KBPS, codec='mp3'):
+        return self.submit(segment, bitrate_kbps, codec).result()
+    
+    def close(self):
+        self.executor.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+_ENCODER_POOL = None
+_ENCODER_POOL_PID = None
+
+def get_encoder_pool():
+    """The process-wide EncoderPool (created on first use, and again in forked workers)"""
+    global _ENCODER_POOL, _ENCODER_POOL_PID
+    if _ENCODER_POOL is None or _ENCODER_POOL_PID != os.getpid():
+        _ENCODER_POOL = EncoderPool()
+        _ENCODER_POOL_PID = os.getpid()
+    return _ENCODER_POOL
+
+# ============================================================================
+# PIPED DECODING (PCM straight from ffmpeg's stdout, nothing in the temp dir)
+# ============================================================================
+
+def _read_stream(stream, size_hint=0):
+    """Read a pipe to EOF into one buffer preallocated to size_hint (grown if needed)"""
+    buffer = bytearray(max(size_hint, 1 << 16))
+    view = memoryview(buffer)
+    filled = 0
+    while True:
+        if filled == len(buffer):
+            view.release()
+            buffer.extend(bytes(len(buffer)))
+            view = memoryview(buffer)
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    view.release()
+    del buffer[filled:]
+    return buffer
+
+def segment_from_wav_stream(data):
+    """AudioSegment from WAV bytes as ffmpeg writes them to a pipe (chunk sizes left unset)"""
+    import struct
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError("not a WAV stream")
+    position = 12
+    channels = frame_rate = sample_width = None
+    while position + 8 <= len(data):
+        chunk_id = data[position:position + 4]
+        size = struct.unpack('<I', data[position + 4:position + 8])[0]
+        if chunk_id == b'fmt ':
+            _, channels, frame_rate, _, _, bits = struct.unpack('<HHIIHH', data[position + 8:position + 24])
+            sample_width = bits // 8
+        elif chunk_id == b'data':
+            if channels is None:
+                raise ValueError("WAV stream has no format chunk")
+            # On a pipe the data size is a placeholder: the samples run to the end of the stream
+            pcm = data[position + 8:]
+            pcm = pcm[:len(pcm) - len(pcm) % (channels * sample_width)]
+            return AudioSegment(data=bytes(pcm), sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+        position += 8 + size + (size & 1)
+    raise ValueError("WAV stream has no data chunk")
+
+def decode_audio_pipe(file_path, start_seconds=None, duration_seconds=None):
+    """
+    Decode (a range of) any file ffmpeg reads to 16-bit PCM over a pipe.
+    One process, no ffprobe call and no temp file; the read buffer is sized to
+    the expected PCM (the range, or the probed duration of the file).
+    """
+    import subprocess
+    from pydub.utils import get_encoder_name
+    
+    cmd = [get_encoder_name(), '-v', 'error', '-nostdin']
+    if start_seconds:
+        # Seek before -i so ffmpeg skips straight to the range instead of decoding from the start
+        cmd += ['-ss', f"{start_seconds:.3f}"]
+    if duration_seconds is not None:
+        cmd += ['-t', f"{duration_seconds:.3f}"]
+    cmd += ['-i', file_path, '-vn', '-acodec', 'pcm_s16le', '-f', 'wav', 'pipe:1']
+    
+    expected_seconds = duration_seconds
+    if expected_seconds is None:
+        probe = load_probe_cache(block_folder(file_path)).get(os.path.basename(file_path))
+        expected_seconds = probe.get('duration') if probe else None
+    size_hint = estimate_pcm_bytes(expected_seconds) + 4096 if expected_seconds else 0
+    
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors = PipeDrain(process.stderr)
+    data = _read_stream(process.stdout, size_hint)
+    stderr = errors.text()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg could not decode {file_path}: {stderr}")
+    return segment_from_wav_stream(data)
+
+def decode_audio_file(file_path):
+    """Decode a whole file: plain PCM WAVs and raw .pcm blocks are read directly, everything else through decode_audio_pipe"""
+    if file_path.lower().endswith(CODECS['pcm'].extension):
+        return read_pcm_block(file_path)
+    if file_path.lower().endswith('.wav'):
+        import wave
+        try:
+            with wave.open(file_path, 'rb') as wav:
+                if wav.getsampwidth() in (1, 2, 4):
+                    return AudioSegment(data=wav.readframes(wav.getnframes()), sample_width=wav.getsampwidth(),
+                                        frame_rate=wav.getframerate(), channels=wav.getnchannels())
+        except wave.Error:
+            pass
+        # 24-bit and non-PCM WAVs: pydub reads these without ffmpeg or temp files
+        return AudioSegment.from_file(file_path, format="wav")
+    return decode_audio_pipe(file_path)
+
+# ============================================================================
+# CODEC ENGINE (block and sequence formats, chosen separately)
+# ============================================================================
+
+Codec = namedtuple('Codec', ['name', 'extension', 'lossless', 'ffmpeg_args'])
+
+# ffmpeg_args are used by the ffmpeg encoder and by repair; '{bitrate}' is filled in
+CODECS = {
+    'mp3': Codec('mp3', '.mp3', False, ['-f', 'mp3', '-c:a', 'libmp3lame', '-b:a', '{bitrate}k']),
+    'opus': Codec('opus', '.opus', False, ['-f', 'opus', '-c:a', 'libopus', '-b:a', '{bitrate}k']),
+    'flac': Codec('flac', '.flac', True, ['-f', 'flac', '-c:a', 'flac']),
+    'wav': Codec('wav', '.wav', True, ['-f', 'wav', '-c:a', 'pcm_s16le']),
+    'pcm': Codec('pcm', '.pcm', True, ['-f', 's16le', '-c:a', 'pcm_s16le']),  # format kept in the sidecar
+}
+BLOCK_EXTENSIONS = tuple(codec.extension for codec in CODECS.values())
+METADATA_SIDECAR_SUFFIX = '.meta.json'
+
+BLOCK_CODEC = 'mp3'            # format new blocks are written in
+SEQUENCE_CODEC = None          # None: from the output file's extension, else mp3
+
+def set_codecs(block_codec=None, sequence_codec=None):
+    """Choose the block and/or sequence codec for this run"""
+    global BLOCK_CODEC, SEQUENCE_CODEC
+    if block_codec is not None:
+        BLOCK_CODEC = block_codec
+    if sequence_codec is not None:
+        SEQUENCE_CODEC = sequence_codec
+
+def codec_for_path(path, default=None):
+    """Codec name for a file extension, or default when the extension is not one of ours"""
+    extension = os.path.splitext(path)[1].lower()
+    for codec in CODECS.values():
+        if codec.extension == extension:
+            return codec.name
+    return default
+
+def sequence_codec_for(output_path):
+    """Codec a sequence is exported with: --sequence-codec, else the output extension, else mp3"""
+    return SEQUENCE_CODEC or codec_for_path(output_path, 'mp3')
+
+def describe_codec(name, bitrate_kbps=ENCODER_BITRATE_KBPS):
+    """'MP3 192kbps' / 'FLAC (lossless)' for status lines"""
+    codec = CODECS[name]
+    return f"{name.upper()} (lossless)" if codec.lossless else f"{name.upper()} {bitrate_kbps}kbps"
+
+def is_block_file(filename):
+    """m/v/j block in any of the block formats"""
+    return filename[:1] in ('m', 'v', 'j') and filename.lower().endswith(BLOCK_EXTENSIONS)
+
+def metadata_sidecar_path(file_path):
+    """m2025...flac -> m2025....meta.json (blocks are matched by stem, whatever their format)"""
+    return os.path.splitext(file_path)[0] + METADATA_SIDECAR_SUFFIX
+
+def finish_flac_header(data, total_frames):
+    """
+    Fill in the STREAMINFO total sample count, which ffmpeg cannot go back and
+    write when the FLAC goes to a pipe. Returns the new bytes.
+    """
+    if len(data) < 26 or data[:4] != b'fLaC':
+        return data
+    # 64 bits at offset 18: 20 sample rate, 3 channels, 5 bits per sample, 36 total samples
+    packed = int.from_bytes(data[18:26], 'big')
+    packed = (packed & ~((1 << 36) - 1)) | (total_frames & ((1 << 36) - 1))
+    return data[:18] + packed.to_bytes(8, 'big') + data[26:]
+
+def _ffmpeg_encode(segment, codec, bitrate_kbps):
+    """Encode 16-bit PCM through one ffmpeg process, stdin to stdout"""
+    import subprocess
+    from pydub.utils import get_encoder_name
+    cmd = [get_encoder_name(), '-v', 'error', '-nostdin', '-f', 's16le', '-ar', str(segment.frame_rate),
+           '-ac', str(segment.channels), '-i', 'pipe:0']
+    cmd += [arg.format(bitrate=bitrate_kbps) for arg in codec.ffmpeg_args] + ['pipe:1']
+    result = subprocess.run(cmd, input=segment.raw_data, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{codec.name} encoder failed: {result.stderr.decode(errors='ignore').strip()}")
+    if codec.name == 'flac':
+        return finish_flac_header(result.stdout, int(segment.frame_count()))
+    return result.stdout
+
+def encode_audio(segment, codec='mp3', bitrate_kbps=ENCODER_BITRATE_KBPS):
+    """Encode an AudioSegment to bytes in memory in any of the CODECS"""
+    if codec == 'mp3':
+        return encode_mp3(segment, bitrate_kbps)
+    segment = segment.set_sample_width(2)
+    if codec == 'pcm':
+        return segment.raw_data
+    if codec == 'wav':
+        import io
+        import wave
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(segment.channels)
+            wav.setsampwidth(2)
+            wav.setframerate(segment.frame_rate)
+            wav.writeframes(segment.raw_data)
+        return buffer.getvalue()
+    return _ffmpeg_encode(segment, CODECS[codec], bitrate_kbps)
+
+def write_audio(segment, output_path, encoder=None, codec=None, bitrate_kbps=ENCODER_BITRATE_KBPS):
+    """
+    Encode segment with the encoder pool and write it to output_path; returns bytes written.
+    codec defaults to the one matching output_path's extension (mp3 if unknown).
+    """
+    data = (encoder or get_encoder_pool()).encode(segment, bitrate_kbps, codec or codec_for_path(output_path, 'mp3'))
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    if codec_for_path(output_path) == 'pcm':
+        write_metadata_sidecar(output_path, {}, segment)
+    return len(data)
+
+def encode_pcm_stream(chunks, out_f, frame_rate, channels, format="mp3", bitrate="192k"):
+    """
+    Encode an iterable of raw 16-bit PCM chunks to out_f without holding it all:
+    MP3 through Mp3StreamWriter, WAV and raw PCM written directly, other formats through ffmpeg
+    """
+    import subprocess
+    from pydub.utils import get_encoder_name
+    
+    if format == 'pcm':
+        with open(out_f, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        write_metadata_sidecar(out_f, {'frame_rate': frame_rate, 'channels': channels, 'sample_width': 2})
+        return out_f
+    
+    if format == 'wav':
+        import wave
+        with wave.open(out_f, 'wb') as wav:
+            wav.setnchannels(channels)
+            wav.setsampwidth(2)
+            wav.setframerate(frame_rate)
+            for chunk in chunks:
+                wav.writeframes(chunk)
+        return out_f
+    
+    if format == "mp3":
+        with open(out_f, 'wb') as f:
+            writer = Mp3StreamWriter(f, frame_rate, channels, parse_bitrate_kbps(bitrate))
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.close()
+        with open(out_f, 'r+b') as f:
+            head = f.read(192)
+            f.seek(0)
+            f.write(finish_lame_tag(head))
+        return out_f
+    
+    cmd = [get_encoder_name(), '-y', '-v', 'error', '-f', 's16le', '-ar', str(frame_rate),
+           '-ac', str(channels), '-i', 'pipe:0']
+    if format in CODECS:
+        cmd += [arg.format(bitrate=parse_bitrate_kbps(bitrate)) for arg in CODECS[format].ffmpeg_args]
+    else:
+        cmd += ['-f', format] + (['-b:a', bitrate] if bitrate else [])
+    cmd.append(out_f)
+    
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors = PipeDrain(process.stderr)
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+    finally:
+        process.stdin.close()
+        stderr = errors.text()
+        returncode = process.wait()
+    if returncode != 0:
+        raise RuntimeError(f"Encoder failed: {stderr}")
+    return out_f
+
+def write_metadata_sidecar(file_path, metadata, segment=None):
+    """
+    Write (or update) the .meta.json next to a non-MP3 block. segment records the
+    PCM layout, which raw .pcm blocks cannot be decoded without.
+    """
+    sidecar = metadata_sidecar_path(file_path)
+    data = read_metadata_sidecar(file_path) or {}
+    data.update(metadata)
+    data['codec'] = codec_for_path(file_path)
+    if segment is not None:
+        data.update(frame_rate=segment.frame_rate, channels=segment.channels, sample_width=2)
+    temp_path = sidecar + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, sidecar)
+
+def read_metadata_sidecar(file_path):
+    """The .meta.json of a block as a dict, or None if it has none"""
+    try:
+        with open(metadata_sidecar_path(file_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_block_metadata(file_path, origin, description, audio_type, climax_time, data, segment, fingerprint=None):
+    """
+    Write a new block's encoded bytes and its metadata: an ID3 tag for MP3,
+    a .meta.json sidecar for every other format. Returns True if the metadata was written.
+    """
+    if codec_for_path(file_path) == 'mp3':
+        return write_audio_metadata(file_path, origin, description, audio_type, climax_time, mp3_data=data, fingerprint=fingerprint)
+    
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    try:
+        write_metadata_sidecar(file_path, {
+            'origin': origin,
+            'description': description,
+            'audio_type': audio_type,
+            'climax_time': str(climax_time),
+            'slice_size': SLICE_SIZE,
+            'fingerprint': fingerprint
+        }, segment)
+        print(f"{Fore.BLUE}   📝 Metadata written: origin, description, type{Style.RESET_ALL}")
+        return True
+    except Exception as e:
+        print(f"{Fore.YELLOW}⚠️  Could not write metadata to {file_path}: {e}{Style.RESET_ALL}")
+        return False
+
+def read_pcm_block(file_path):
+    """Decode a raw .pcm block using the layout stored in its sidecar"""
+    layout = read_metadata_sidecar(file_path)
+    if not layout or 'frame_rate' not in layout:
+        raise ValueError(f"{os.path.basename(file_path)} has no {METADATA_SIDECAR_SUFFIX} with its PCM format")
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    frame_width = layout['channels'] * layout['sample_width']
+    return AudioSegment(data=data[:len(data) - len(data) % frame_width], sample_width=layout['sample_width'],
+                        frame_rate=layout['frame_rate'], channels=layout['channels'])
+
+def pcm_block_duration(file_path):
+    """Duration of a raw .pcm block from its size and sidecar, without reading it"""
+    layout = read_metadata_sidecar(file_path)
+    if not layout or 'frame_rate' not in layout:
+        raise ValueError(f"{os.path.basename(file_path)} has no {METADATA_SIDECAR_SUFFIX} with its PCM format")
+    return os.path.getsize(file_path) / (layout['frame_rate'] * layout['channels'] * layout['sample_width'])
+
+# ============================================================================
+# BLOCK DURATION INDEX (real block lengths from headers, cached per folder)
+# ============================================================================
+
+DURATION_INDEX_FILE = "block_durations.json"
+SEQUENCE_DURATION_TOLERANCE = 0.5    # seconds a sequence may miss its requested length by
+
+def flac_header_duration(file_path):
+    """Total samples / sample rate from STREAMINFO; None when the encoder left the count at 0"""
+    with open(file_path, 'rb') as f:
+        head = f.read(42)
+    if len(head) < 42 or head[:4] != b'fLaC':
+        return None
+    # 20-bit sample rate, 3-bit channels, 5-bit bits per sample, 36-bit total samples
+    packed = int.from_bytes(head[18:26], 'big')
+    sample_rate = packed >> 44
+    total_samples = packed & ((1 << 36) - 1)
+    return total_samples / sample_rate if sample_rate and total_samples else None
+
+MP3_BITRATES_KBPS = {
+    True: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),   # MPEG-1 layer III
+    False: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)       # MPEG-2/2.5 layer III
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def _mp3_frame_header(data, position):
+    """(sample_rate, samples_per_frame, frame_bytes, mpeg1, mono) of the layer III frame at position, else None"""
+    if position + 4 > len(data) or data[position] != 0xFF or data[position + 1] & 0xE0 != 0xE0:
+        return None
+    header = int.from_bytes(data[position:position + 4], 'big')
+    version, layer = (header >> 19) & 3, (header >> 17) & 3
+    bitrate_index, rate_index = (header >> 12) & 15, (header >> 10) & 3
+    if layer != 1 or version == 1 or rate_index == 3 or bitrate_index in (0, 15):
+        return None
+    mpeg1 = version == 3
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    samples = 1152 if mpeg1 else 576
+    frame_bytes = samples // 8 * MP3_BITRATES_KBPS[mpeg1][bitrate_index] * 1000 // sample_rate + ((header >> 9) & 1)
+    return sample_rate, samples, frame_bytes, mpeg1, (header >> 6) & 3 == 3
+
+def mp3_header_duration(file_path):
+    """
+    Length an MP3 decodes to, from its frame headers: the Xing/Info frame count
+    minus the LAME tag's encoder delay and padding (gapless, as ffmpeg returns it),
+    or, without that header, the frames counted one header at a time.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(10)
+        offset = 0
+        if head[:3] == b'ID3' and len(head) == 10:
+            offset = 10 + ((head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]) + (10 if head[5] & 0x10 else 0)
+        f.seek(offset)
+        data = f.read()
+    
+    position = next((i for i in range(min(len(data), 65536)) if _mp3_frame_header(data, i)), None)
+    if position is None:
+        return None
+    sample_rate, samples, frame_bytes, mpeg1, mono = _mp3_frame_header(data, position)
+    tag = position + 4 + ((17 if mpeg1 else 9) if mono else (32 if mpeg1 else 17))
+    if data[tag:tag + 4] in (b'Xing', b'Info'):
+        flags = int.from_bytes(data[tag + 4:tag + 8], 'big')
+        if flags & 1:
+            frames = int.from_bytes(data[tag + 8:tag + 12], 'big')
+            lame = tag + 12 + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+            delay = padding = 0
+            if data[lame:lame + 4] == b'LAME' and len(data) >= lame + 24:
+                delay = (data[lame + 21] << 4) | (data[lame + 22] >> 4)
+                padding = ((data[lame + 22] & 0x0F) << 8) | data[lame + 23]
+            return max(0, frames * samples - delay - padding) / sample_rate
+        position += frame_bytes  # an Info frame without a count carries no audio
+    
+    frames = 0
+    while True:
+        frame = _mp3_frame_header(data, position)
+        if frame is None:
+            break
+        frames += 1
+        position += frame[2]
+    return frames * samples / sample_rate if frames else None
+
+def ogg_opus_header_duration(file_path):
+    """Granule position of the last Ogg page minus the OpusHead pre-skip, at Opus's 48 kHz"""
+    with open(file_path, 'rb') as f:
+        head = f.read(64)
+        start = head.find(b'OpusHead')
+        if head[:4] != b'OggS' or start < 0:
+            return None
+        pre_skip = int.from_bytes(head[start + 10:start + 12], 'little')
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 65536))
+        tail = f.read()
+    last = tail.rfind(b'OggS')
+    if last < 0 or len(tail) < last + 14:
+        return None
+    return max(0, int.from_bytes(tail[last + 6:last + 14], 'little') - pre_skip) / 48000
+
+def header_duration(file_path):
+    """Duration in seconds read from the file's header (WAV, PCM sidecar, FLAC, MP3, Opus), None when it does not say"""
+    try:
+        codec = codec_for_path(file_path)
+        if codec == 'wav':
+            import wave
+            with wave.open(file_path, 'rb') as wav:
+                return wav.getnframes() / wav.getframerate()
+        if codec == 'pcm':
+            return pcm_block_duration(file_path)
+        if codec == 'flac':
+            return flac_header_duration(file_path)
+        if codec == 'mp3':
+            return mp3_header_duration(file_path)
+        if codec == 'opus':
+            return ogg_opus_header_duration(file_path)
+    except Exception:
+        pass
+    return None
+
+def load_duration_index(blocks_dir):
+    """Cached block durations of a folder: {filename: {'duration', 'mtime', 'size'}}"""
+    try:
+        with open(os.path.join(blocks_dir, DURATION_INDEX_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_duration_index(blocks_dir, index):
+    index_path = os.path.join(blocks_dir, DURATION_INDEX_FILE)
+    temp_path = index_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+    except OSError as e:
+        print(f"{Fore.YELLOW}⚠️  Could not save duration index: {e}{Style.RESET_ALL}")
+
+@traced('durations')
+def block_durations(blocks_dir, filenames):
+    """
+    {filename: seconds} for blocks of a folder without decoding them: from the
+    folder's index while a file's mtime and size match, else from its header,
+    else from the probe cache; a decode is the last resort. Slicing calls this
+    for every new block, so sequencing normally only reads the index.
+    Missing files are left out.
+    """
+    index = load_duration_index(blocks_dir)
+    durations = {}
+    stats = {}
+    unknown = []
+    for filename in dict.fromkeys(filenames):
+        try:
+            stat = block_stat(blocks_dir, filename)
+        except OSError:
+            continue
+        stats[filename] = stat
+        cached = index.get(filename)
+        if cached and cached.get('mtime') == stat.st_mtime and cached.get('size') == stat.st_size:
+            durations[filename] = cached['duration']
+            continue
+        duration = header_duration(block_path(blocks_dir, filename))
+        if duration is None:
+            unknown.append(filename)
+        else:
+            durations[filename] = duration
+    
+    if unknown:
+        probes = probe_folder(blocks_dir, unknown)
+        for filename in unknown:
+            probe = probes.get(filename)
+            if is_probe_playable(probe) and probe.get('duration'):
+                durations[filename] = probe['duration']
+                continue
+            try:
+                durations[filename] = len(decode_audio_file(block_path(blocks_dir, filename))) / 1000
+            except Exception as e:
+                print(f"{Fore.YELLOW}⚠️  Could not read the duration of {filename}: {e}{Style.RESET_ALL}")
+    
+    changed = False
+    for filename, duration in durations.items():
+        stat = stats[filename]
+        entry = {'duration': duration, 'mtime': stat.st_mtime, 'size': stat.st_size}
+        if index.get(filename) != entry:
+            index[filename] = entry
+            changed = True
+    if changed:
+        save_duration_index(blocks_dir, index)
+    return durations
+
+def index_new_blocks(blocks_dir, block_paths):
+    """
+    Record the durations (read from their headers), loudness (measured once,
+    here), fingerprints and query attributes (from their metadata) of freshly
+    written blocks in the folder's indexes. Returns {filename: fingerprint}.
+    """
+    filenames = [os.path.basename(path) for path in block_paths if path]
+    block_durations(blocks_dir, filenames)
+    block_loudness(blocks_dir, filenames)
+    index_block_attributes(blocks_dir, filenames)
+    return block_fingerprints(blocks_dir, filenames)
+
+def max_sequence_minutes(blocks_dir, m_blocks, v_blocks, j_blocks):
+    """Longest sequence the blocks can fill: every music block, or the voice lane's end if that comes first"""
+    durations = block_durations(blocks_dir, m_blocks + v_blocks + j_blocks)
+    music_seconds = sum(durations.get(block, 0) for block in m_blocks)
+    voice_seconds = sum(durations.get(block, 0) for block in v_blocks + j_blocks)
+    return min(music_seconds, VOICE_OFFSET_SECONDS + voice_seconds) / 60
+
+def lane_block_offsets(blocks, durations, start=0.0):
+    """Start time (seconds) of each block of a lane played back to back from start"""
+    offsets = []
+    position = float(start)
+    for block in blocks:
+        offsets.append(position)
+        position += durations.get(block, SLICE_SIZE)
+    return offsets
+
+def _nearest(sorted_values, value):
+    """Index of the entry of sorted_values closest to value"""
+    import bisect
+    index = bisect.bisect_left(sorted_values, value)
+    if index == len(sorted_values) or (index > 0 and value - sorted_values[index - 1] <= sorted_values[index] - value):
+        return index - 1
+    return index
+
+def fit_blocks_to_duration(candidates, durations, target, tolerance=SEQUENCE_DURATION_TOLERANCE, keep_first=False):
+    """
+    Blocks from candidates (already in random order) whose real durations add up
+    to target seconds within tolerance. Blocks are taken in order while each one
+    brings the total closer; then single swaps, additions or removals against the
+    unused blocks (nearest duration first) close the remaining gap.
+    keep_first: never replace the first block (the opening jingle).
+    Returns (blocks, total_seconds); the total can still miss the tolerance when
+    no block lengths get closer.
+    """
+    import bisect
+    chosen = []
+    total = 0.0
+    rest = list(candidates)
+    while rest and total + durations[rest[0]] / 2 < target:
+        chosen.append(rest.pop(0))
+        total += durations[chosen[-1]]
+    
+    unused = sorted(rest, key=lambda block: durations[block])
+    unused_durations = [durations[block] for block in unused]
+    for _ in range(len(candidates)):
+        error = target - total
+        if abs(error) <= tolerance:
+            break
+        best = None  # (new error, chosen index or None, unused index or None)
+        if unused and error > 0:
+            j = _nearest(unused_durations, error)
+            best = (abs(error - unused_durations[j]), None, j)
+        for i in range(1 if keep_first else 0, len(chosen)):
+            current = durations[chosen[i]]
+            if error < 0 and (best is None or abs(error + current) < best[0]):
+                best = (abs(error + current), i, None)
+            if unused:
+                j = _nearest(unused_durations, current + error)
+                new_error = abs(error + current - unused_durations[j])
+                if best is None or new_error < best[0]:
+                    best = (new_error, i, j)
+        if best is None or best[0] >= abs(error):
+            break
+        
+        _, i, j = best
+        if i is not None:
+            removed = chosen[i]
+            total -= durations[removed]
+        if j is not None:
+            block = unused.pop(j)
+            unused_durations.pop(j)
+            total += durations[block]
+            if i is None:
+                chosen.append(block)
+            else:
+                chosen[i] = block
+        elif i is not None:
+            del chosen[i]
+        if i is not None:
+            position = bisect.bisect_left(unused_durations, durations[removed])
+            unused.insert(position, removed)
+            unused_durations.insert(position, durations[removed])
+    return chosen, total
+
+# ============================================================================
+# MEMORY-BOUNDED MODE (--max-memory: stream sources and mixes instead of holding them)
+# ============================================================================
+
+MEMORY_BUDGET_MB = None
+PCM_MEMORY_FACTOR = 3          # pydub keeps extra copies while converting, slicing and concatenating
+VOICE_OFFSET_SECONDS = 15      # voice lane starts this far into the sequence
+STREAM_CHUNK_SECONDS = 10      # mix/encode granularity of a streamed sequence
+
+def set_memory_budget(megabytes):
+    """Set (or clear with None) the per-process memory budget in MB"""
+    global MEMORY_BUDGET_MB
+    MEMORY_BUDGET_MB = megabytes
+
+def estimate_pcm_bytes(seconds, frame_rate=44100, channels=2, sample_width=2):
+    """Decoded size of seconds of audio"""
+    return int(seconds * frame_rate) * channels * sample_width
+
+def fits_in_memory(pcm_bytes):
+    """True when decoding pcm_bytes more audio keeps this process under the budget"""
+    if MEMORY_BUDGET_MB is None:
+        return True
+    return current_rss_bytes() + pcm_bytes * PCM_MEMORY_FACTOR <= MEMORY_BUDGET_MB * MEGABYTE
+
+def load_source_audio(audio_file):
+    """
+    Decode a whole source if it fits the memory budget.
+    Returns (audio, duration_seconds); audio is None when the source is too big,
+    and process_audio_slice_mp3 then decodes each slice's range on its own.
+    """
+    if MEMORY_BUDGET_MB is not None:
+        duration = get_audio_duration(audio_file)
+        if not fits_in_memory(estimate_pcm_bytes(duration)):
+            print(f"{Fore.BLUE}💾 {os.path.basename(audio_file)} ({duration:.0f}s) is sliced range by range to stay under {MEMORY_BUDGET_MB} MB{Style.RESET_ALL}")
+            return None, duration
+    audio = load_audio_file(audio_file)
+    return audio, len(audio) / 1000
+
+class StreamedSequence:
+    """
+    Sequence plan mixed chunk by chunk straight into the encoder, so only the
+    blocks under the current chunk are decoded. Stands in for the AudioSegment
+    returned by build_multi_channel_sequence: supports len() (ms) and export().
+    """
+    
+    def __init__(self, plan, blocks_dir=None):
+        self.plan = plan
+        self.blocks_dir = blocks_dir or plan['blocks_dir']
+        self.frame_rate, self.channels = plan_render_format(plan, self.blocks_dir)
+    
+    def __len__(self):
+        return int(self.plan['duration'] * 1000)
+    
+    def iter_chunks(self):
+        """Yield the mixed sequence as raw PCM chunks of STREAM_CHUNK_SECONDS"""
+        block_cache = plan_block_cache(self.plan, self.blocks_dir, self.frame_rate, self.channels)
+        scratch = {}
+        start = 0.0
+        while start < self.plan['duration']:
+            end = min(start + STREAM_CHUNK_SECONDS, self.plan['duration'])
+            yield render_plan_window(self.plan, start, end, block_cache, scratch).tobytes()
+            start = end
+        block_loudness(self.blocks_dir, [], measured=block_cache.stats)
+    
+    def export(self, out_f, format="mp3", bitrate="192k"):
+        """Encode the mix chunk by chunk (see encode_pcm_stream)"""
+        return encode_pcm_stream(self.iter_chunks(), out_f, self.frame_rate, self.channels, format, bitrate)
+
+# ============================================================================
+# SEQUENCE PLANS AND RENDER CACHE (what to play, separate from rendering it)
+# ============================================================================
+
+PLAN_VERSION = 1
+BLOCK_HASH_CACHE_FILE = "block_hashes.json"
+RENDER_CACHE_DIR = "render_cache"
+RENDER_SEGMENT_SECONDS = 300          # granularity of the cached mixed PCM (10 blocks per lane)
+RENDER_CACHE_MAX_MB = 4096            # oldest cache entries are removed beyond this
+BLOCK_LENGTH_MARGIN_SECONDS = 1.0     # decoded blocks may run past their nominal length (MP3 padding)
+
+def sequence_plan_path(output_path):
+    """mix.mp3 -> mix.plan.json"""
+    return os.path.splitext(output_path)[0] + '.plan.json'
+
+def block_sha256(file_path):
+    """SHA-256 of a block's bytes, read 1 MB at a time"""
+    import hashlib
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def block_content_hashes(blocks_dir, filenames):
+    """
+    {filename: sha256} for blocks of a folder. Hashes are kept in
+    blocks/block_hashes.json and only recomputed when a file's mtime or size changes.
+    """
+    cache_path = os.path.join(blocks_dir, BLOCK_HASH_CACHE_FILE)
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    
+    hashes = {}
+    changed = False
+    for filename in filenames:
+        stat = block_stat(blocks_dir, filename)
+        cached = cache.get(filename)
+        if cached and cached.get('mtime') == stat.st_mtime and cached.get('size') == stat.st_size:
+            hashes[filename] = cached['hash']
+            continue
+        hashes[filename] = block_sha256(block_path(blocks_dir, filename))
+        cache[filename] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'hash': hashes[filename]}
+        changed = True
+    
+    if changed:
+        temp_path = cache_path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            print(f"{Fore.YELLOW}⚠️  Could not save block hashes: {e}{Style.RESET_ALL}")
+    return hashes
+
+def create_sequence_plan(blocks_dir, m_sequence, voice_sequence, seed=None):
+    """Plan of the two classic lanes (see create_lane_plan); the voice lane starts VOICE_OFFSET_SECONDS in"""
+    return create_lane_plan(blocks_dir, [m_sequence, voice_sequence], LANE_PRESETS['classic'], seed)
+
+def save_sequence_plan(plan, plan_path):
+    """Write a plan as JSON; returns True on success"""
+    try:
+        temp_path = plan_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, plan_path)
+        print(f"{Fore.GREEN}✅ Sequence plan saved: {plan_path}{Style.RESET_ALL}")
+        return True
+    except Exception as e:
+        print(f"{Fore.RED}❌ Error saving sequence plan: {e}{Style.RESET_ALL}")
+        return False
+
+def load_sequence_plan(plan_path):
+    """Read a plan written by save_sequence_plan; raises ValueError if it is not one"""
+    with open(plan_path, encoding='utf-8') as f:
+        plan = json.load(f)
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION or not isinstance(plan.get('lanes'), list):
+        raise ValueError(f"{plan_path} is not a version {PLAN_VERSION} sequence plan")
+    return plan
+
+def plan_blocks(plan):
+    """Every block of a plan, all lanes, in start order"""
+    return sorted((block for lane in plan['lanes'] for block in lane['blocks']), key=lambda block: block['offset'])
+
+def plan_sequences(plan):
+    """(m_sequence, voice_sequence) filenames of a plan, for the timeline"""
+    lanes = {lane['name']: [block['file'] for block in lane['blocks']] for lane in plan['lanes']}
+    return lanes.get('music', []), lanes.get('voice', [])
+
+def check_plan_blocks(plan, blocks_dir):
+    """True if every block of the plan exists in blocks_dir with the content hash the plan recorded"""
+    files = sorted({block['file'] for block in plan_blocks(plan)})
+    missing = [f for f in files if not os.path.exists(block_path(blocks_dir, f))]
+    if missing:
+        print(f"{Fore.RED}❌ {len(missing)} blocks of the plan are missing from {blocks_dir}:{Style.RESET_ALL}")
+        for filename in missing:
+            print(f"   - {filename}")
+        return False
+    hashes = block_content_hashes(blocks_dir, files)
+    changed = sorted({block['file'] for block in plan_blocks(plan) if hashes[block['file']] != block['hash']})
+    if changed:
+        print(f"{Fore.RED}❌ {len(changed)} blocks changed since the plan was made:{Style.RESET_ALL}")
+        for filename in changed:
+            print(f"   - {filename}")
+        return False
+    return True
+
+class PlanBlockCache:
+    """
+    Decoded blocks of a plan as int16 samples in the render format. Keeps the
+    last few, since a block spans several render windows. The loudness of every
+    block it decodes is measured on the way (stats, see block_loudness).
+    """
+    
+    def __init__(self, blocks_dir, frame_rate, channels, size=4):
+        from collections import OrderedDict
+        self.blocks_dir = blocks_dir
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.size = size
+        self.blocks = OrderedDict()
+        self.stats = {}
+    
+    def _decode(self, block):
+        segment = load_audio_file(block_path(self.blocks_dir, block['file']))
+        segment = segment.set_frame_rate(self.frame_rate).set_channels(self.channels).set_sample_width(2)
+        return np.frombuffer(segment.raw_data, dtype=np.int16)
+    
+    def samples(self, block):
+        if block['file'] in self.blocks:
+            self.blocks.move_to_end(block['file'])
+            return self.blocks[block['file']]
+        samples = self._decode(block)
+        self.blocks[block['file']] = samples
+        if block['file'] not in self.stats and len(samples):
+            self.stats[block['file']] = block_loudness_stats(samples, self.frame_rate, self.channels)
+        if len(self.blocks) > self.size:
+            self.blocks.popitem(last=False)
+        return samples
+    
+    def frames(self, block, first_frame, frame_count):
+        """frame_count frames of a block from first_frame (fewer where the block ends)"""
+        return self.samples(block)[first_frame * self.channels:(first_frame + frame_count) * self.channels]
+
+class LazyBlockLoader:
+    """
+    Reads only the requested frames of a block: a seek into WAV and raw PCM
+    blocks, a decode stopped at the last frame needed for everything else.
+    Used for previews, where decoding whole blocks would dominate.
+    """
+    
+    def __init__(self, blocks_dir, frame_rate, channels):
+        self.blocks_dir = blocks_dir
+        self.frame_rate = frame_rate
+        self.channels = channels
+    
+    def _convert(self, segment):
+        return np.frombuffer(segment.set_frame_rate(self.frame_rate).set_channels(self.channels)
+                             .set_sample_width(2).raw_data, dtype=np.int16)
+    
+    def _read_frames(self, block_path, first_frame, frame_count):
+        """(raw, sample_width, channels) straight from a WAV/.pcm at the render rate, else None"""
+        if block_path.lower().endswith('.wav'):
+            import wave
+            try:
+                with wave.open(block_path, 'rb') as wav:
+                    if wav.getframerate() != self.frame_rate or wav.getsampwidth() not in (1, 2, 4):
+                        return None
+                    wav.setpos(min(first_frame, wav.getnframes()))
+                    return wav.readframes(frame_count), wav.getsampwidth(), wav.getnchannels()
+            except wave.Error:
+                return None
+        if block_path.lower().endswith(CODECS['pcm'].extension):
+            layout = read_metadata_sidecar(block_path)
+            if not layout or layout.get('frame_rate') != self.frame_rate:
+                return None
+            frame_width = layout['channels'] * layout['sample_width']
+            with open(block_path, 'rb') as f:
+                f.seek(first_frame * frame_width)
+                return f.read(frame_count * frame_width), layout['sample_width'], layout['channels']
+        return None
+    
+    def frames(self, block, first_frame, frame_count):
+        """frame_count frames of a block from first_frame (fewer where the block ends)"""
+        path = block_path(self.blocks_dir, block['file'])
+        with trace_span('load', files=1) as span:
+            direct = self._read_frames(path, first_frame, frame_count)
+            if direct is not None:
+                raw, sample_width, channels = direct
+                span.add(bytes=len(raw))
+                return self._convert(AudioSegment(data=raw, sample_width=sample_width, frame_rate=self.frame_rate, channels=channels))
+            # Compressed (or resampled) blocks: decode from the start, but only as far as needed,
+            # so the frames line up exactly with a full render
+            end_seconds = (first_frame + frame_count) / self.frame_rate + BLOCK_LENGTH_MARGIN_SECONDS
+            if codec_for_path(path) in ('wav', 'pcm'):
+                segment = decode_audio_file(path)
+            else:
+                segment = decode_audio_pipe(path, None, end_seconds)
+            samples = self._convert(segment)
+            span.add(bytes=len(samples) * 2)
+            return samples[first_frame * self.channels:(first_frame + frame_count) * self.channels]
+
+def lane_window_blocks(lane, start, end, slice_size=SLICE_SIZE):
+    """
+    Blocks of one plan lane that can overlap [start, end) seconds. A lane's blocks
+    are in offset order, so this bisects instead of scanning the whole lane.
+    """
+    import bisect
+    # Plans without block durations put every block on the slice-size grid
+    reach = max((block.get('duration', slice_size) for block in lane['blocks']), default=0) + BLOCK_LENGTH_MARGIN_SECONDS
+    offsets = [block['offset'] for block in lane['blocks']]
+    return lane['blocks'][bisect.bisect_right(offsets, start - reach):bisect.bisect_left(offsets, end)]
+
+def plan_window_blocks(plan, start, end):
+    """Blocks of the plan, all lanes, that can overlap [start, end) seconds"""
+    return [block for lane in plan['lanes'] for block in lane_window_blocks(lane, start, end, plan['slice_size'])]
+
+def mix_buffer(scratch, name, size, zero=True):
+    """Float32 buffer of size samples (zeroed unless zero is False); scratch (a dict) keeps it for the next window"""
+    if scratch is None:
+        return np.zeros(size, dtype=np.float32) if zero else np.empty(size, dtype=np.float32)
+    buffer = scratch.get(name)
+    if buffer is None or len(buffer) < size:
+        buffer = scratch[name] = np.empty(size, dtype=np.float32)
+    buffer = buffer[:size]
+    if zero:
+        buffer.fill(0)
+    return buffer
+
+def add_lane_frames(mixed, first, last, lane, plan, loader):
+    """Add the blocks of one lane overlapping frames [first, last) into mixed at their offsets and gains; returns the block count"""
+    frame_rate, channels = loader.frame_rate, loader.channels
+    count = 0
+    for block in lane_window_blocks(lane, first / frame_rate, last / frame_rate, plan['slice_size']):
+        block_start = int(round(block['offset'] * frame_rate))
+        a = max(first, block_start)
+        if a >= last:
+            continue
+        part = loader.frames(block, a - block_start, last - a)
+        if not len(part):
+            continue
+        position = (a - first) * channels
+        target = mixed[position:position + len(part)]
+        gain_db = lane.get('gain_db', 0.0) + block.get('gain_db', 0.0)
+        if gain_db:
+            target += part * np.float32(10 ** (gain_db / 20))
+        else:
+            target += part
+        count += 1
+    return count
+
+def mix_plan_frames(plan, first, last, loader, scratch=None):
+    """
+    Frames [first, last) of the plan's lanes added into one float buffer (int16
+    scale): every overlapping block at its sample offset and gain (lane gain +
+    block gain), the lanes the plan ducks through mix_ducked_lanes.
+    """
+    channels = loader.channels
+    ducking = plan.get('ducking')
+    # mix_ducked_lanes writes every sample of the buffer first
+    mixed = mix_buffer(scratch, 'mix', (last - first) * channels, zero=not ducking)
+    with trace_span('mix', blocks=0) as span:
+        if ducking:
+            span.add(blocks=mix_ducked_lanes(plan, mixed, first, last, loader, scratch))
+        for lane in plan['lanes']:
+            if not ducking or lane['name'] not in ducking['key'] + ducking['ducked']:
+                span.add(blocks=add_lane_frames(mixed, first, last, lane, plan, loader))
+    return mixed
+
+def render_plan_window(plan, start, end, loader, scratch=None):
+    """
+    Mix [start, end) seconds of a plan: only the blocks overlapping the window are
+    read (through loader: PlanBlockCache or LazyBlockLoader) and added into one
+    float buffer (mix_plan_frames), which goes through the plan's master bus, if
+    any (master_plan_frames), and is soft-limited once at the end (see soft_limit).
+    scratch: a dict that keeps the float buffers from one window to the next.
+    Returns interleaved int16 samples.
+    """
+    frame_rate = loader.frame_rate
+    first = int(round(start * frame_rate))
+    last = int(round(end * frame_rate))
+    if plan.get('master'):
+        mixed = master_plan_frames(plan, first, last, loader, scratch)
+    else:
+        mixed = mix_plan_frames(plan, first, last, loader, scratch)
+    return soft_limit(mixed)
+
+def block_audio_format(blocks_dir, filename):
+    """(frame_rate, channels) of a block from its header, sidecar or the cached probe; decodes only as a last resort"""
+    path = block_path(blocks_dir, filename)
+    if filename.lower().endswith('.wav'):
+        import wave
+        try:
+            with wave.open(path, 'rb') as wav:
+                return wav.getframerate(), wav.getnchannels()
+        except wave.Error:
+            pass
+    elif filename.lower().endswith(CODECS['pcm'].extension):
+        layout = read_metadata_sidecar(path)
+        if layout and 'frame_rate' in layout:
+            return layout['frame_rate'], layout['channels']
+    else:
+        probe = probe_folder(blocks_dir, [filename]).get(filename)
+        streams = [stream for stream in (probe or {}).get('streams', []) if stream.get('codec_type') == 'audio']
+        if streams and streams[0].get('sample_rate') and streams[0].get('channels'):
+            return streams[0]['sample_rate'], streams[0]['channels']
+    segment = load_audio_file(path)
+    return segment.frame_rate, segment.channels
+
+def plan_render_format(plan, blocks_dir):
+    """(frame_rate, channels) of a render: taken from the first music block, as in the streamed mix"""
+    music = [block for lane in plan['lanes'] if lane['name'] == 'music' for block in lane['blocks']]
+    frame_rate, channels = block_audio_format(blocks_dir, (music or plan_blocks(plan))[0]['file'])
+    return frame_rate, max(channels, 2)
+
+def render_plan_range(plan, start, end, blocks_dir=None):
+    """
+    Random access into a plan: the audio of [start, end) seconds as an AudioSegment,
+    without rendering the rest. Only the blocks overlapping the window are read, and
+    only their overlapping frames, so the cost does not grow with the sequence length.
+    Raises ValueError for an empty window or blocks that changed since the plan.
+    """
+    blocks_dir = blocks_dir or plan['blocks_dir']
+    start = max(0.0, start)
+    end = min(end, plan['duration'])
+    if end <= start:
+        raise ValueError(f"Window {start:.1f}-{end:.1f}s is outside the {plan['duration']:.1f}s sequence")
+    
+    window_blocks = plan_window_blocks(plan, start, end)
+    hashes = block_content_hashes(blocks_dir, sorted({block['file'] for block in window_blocks}))
+    changed = sorted({block['file'] for block in window_blocks if hashes[block['file']] != block['hash']})
+    if changed:
+        raise ValueError(f"Blocks changed since the plan was made: {', '.join(changed)}")
+    
+    frame_rate, channels = plan_render_format(plan, blocks_dir)
+    samples = render_plan_window(plan, start, end, LazyBlockLoader(blocks_dir, frame_rate, channels))
+    return AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=frame_rate, channels=channels)
+
+def _content_key(data):
+    """SHA-256 of a JSON-serializable value (sorted keys), used for cache names"""
+    import hashlib
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def plan_segment_key(plan, start, end, frame_rate, channels):
+    """
+    Cache key of one render window: what it sounds like depends only on the
+    overlapping blocks' content, offsets and gains (and the mixing code's
+    MIX_VERSION), so plans that share a prefix (or any identical stretch) share
+    keys. With ducking or a master bus, the audio just outside the window counts too.
+    """
+    before, after = (sum(pair) for pair in zip(ducking_margins(plan.get('ducking')), master_margins(plan.get('master'))))
+    return _content_key({
+        'version': PLAN_VERSION, 'mix': MIX_VERSION, 'start': start, 'end': end, 'frame_rate': frame_rate, 'channels': channels,
+        'ducking': plan.get('ducking'), 'master': plan.get('master'),
+        'blocks': [[block['hash'], block['offset'], lane.get('gain_db', 0.0) + block.get('gain_db', 0.0)]
+                   for lane in plan['lanes'] for block in lane_window_blocks(lane, start - before, end + after, plan['slice_size'])]
+    })
+
+def plan_render_windows(plan):
+    """[start, end) windows of RENDER_SEGMENT_SECONDS covering the whole plan"""
+    windows = []
+    start = 0
+    while start < plan['duration']:
+        windows.append((float(start), float(min(start + RENDER_SEGMENT_SECONDS, plan['duration']))))
+        start += RENDER_SEGMENT_SECONDS
+    return windows
+
+def prune_render_cache(cache_dir, max_mb=None):
+    """Delete the least recently used render cache files until it fits in max_mb"""
+    max_bytes = (max_mb or RENDER_CACHE_MAX_MB) * MEGABYTE
+    entries = []
+    for sub_dir in ('segments', 'outputs'):
+        folder = os.path.join(cache_dir, sub_dir)
+        if os.path.isdir(folder):
+            with os.scandir(folder) as scan:
+                entries += [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in scan if entry.is_file()]
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def _render_plan_segment_worker(job):
+    """Pool worker: mix one window of a plan. Returns (int16 PCM bytes, trace_events, block loudness stats)."""
+    if job.get('profile') and not tracing_enabled():
+        enable_tracing()
+    block_cache = plan_block_cache(job['plan'], job['blocks_dir'], job['frame_rate'], job['channels'])
+    pcm = render_plan_window(job['plan'], job['start'], job['end'], block_cache).tobytes()
+    return pcm, collect_trace_events(), block_cache.stats
+
+def iter_plan_segments(plan, blocks_dir, frame_rate, channels, workers=None, cache_dir=None, stats=None):
+    """
+    Yield the mixed PCM of a plan window by window. Windows found in cache_dir are
+    read back instead of mixed; the others are mixed (on a pool when workers > 1,
+    at most two windows per worker in flight) and stored there. The loudness stats
+    of the blocks decoded on the way are added to the stats dict, if given.
+    """
+    from collections import deque
+    
+    windows = plan_render_windows(plan)
+    paths = [None] * len(windows)
+    if cache_dir:
+        os.makedirs(os.path.join(cache_dir, 'segments'), exist_ok=True)
+        paths = [os.path.join(cache_dir, 'segments', plan_segment_key(plan, start, end, frame_rate, channels) + '.pcm')
+                 for start, end in windows]
+    missing = [index for index, path in enumerate(paths) if not (path and os.path.exists(path))]
+    if cache_dir:
+        print(f"{Fore.BLUE}   {len(windows) - len(missing)}/{len(windows)} segments reused from the render cache{Style.RESET_ALL}")
+    
+    pool = None
+    if workers and workers > 1 and len(missing) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(missing)))
+    block_cache = plan_block_cache(plan, blocks_dir, frame_rate, channels)
+    
+    def start(index):
+        if index not in missing or pool is None:
+            return None
+        window_start, window_end = windows[index]
+        return pool.submit(_render_plan_segment_worker, {
+            'plan': plan, 'blocks_dir': blocks_dir, 'start': window_start, 'end': window_end,
+            'frame_rate': frame_rate, 'channels': channels, 'profile': tracing_enabled()
+        })
+    
+    queue = deque()
+    next_index = 0
+    try:
+        while next_index < len(windows) or queue:
+            while next_index < len(windows) and len(queue) < max(1, 2 * (workers or 1)):
+                queue.append((next_index, start(next_index)))
+                next_index += 1
+            index, future = queue.popleft()
+            path = paths[index]
+            if index not in missing:
+                os.utime(path)
+                with open(path, 'rb') as f:
+                    yield f.read()
+                continue
+            if future is not None:
+                pcm, events, block_stats = future.result()
+                if _TRACER is not None:
+                    _TRACER.merge(events)
+                if stats is not None:
+                    stats.update(block_stats)
+            else:
+                pcm = render_plan_window(plan, windows[index][0], windows[index][1], block_cache).tobytes()
+            if path:
+                temp_path = path + f".{os.getpid()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(pcm)
+                os.replace(temp_path, path)
+            yield pcm
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if stats is not None:
+            stats.update(block_cache.stats)
+
+@traced('render')
+def render_plan(plan, output_path, blocks_dir=None, workers=None, use_cache=True):
+    """
+    Render a sequence plan to output_path (codec from --sequence-codec or the
+    extension). Identical plans are copied from the render cache; otherwise
+    cached segments are reused and only the rest is mixed. Returns True on success.
+    """
+    import shutil
+    try:
+        blocks_dir = blocks_dir or plan['blocks_dir']
+        print(f"{Fore.CYAN}=== Rendering Sequence Plan ==={Style.RESET_ALL}")
+        if not check_plan_blocks(plan, blocks_dir):
+            return False
+        
+        codec = sequence_codec_for(output_path)
+        frame_rate, channels = plan_render_format(plan, blocks_dir)
+        cache_dir = os.path.join(blocks_dir, RENDER_CACHE_DIR) if use_cache else None
+        output_key = _content_key({
+            'segments': [plan_segment_key(plan, start, end, frame_rate, channels) for start, end in plan_render_windows(plan)],
+            'codec': codec, 'bitrate': ENCODER_BITRATE_KBPS
+        })
+        cached_output = os.path.join(cache_dir, 'outputs', output_key + CODECS[codec].extension) if cache_dir else None
+        
+        if cached_output and os.path.exists(cached_output):
+            os.utime(cached_output)
+            shutil.copyfile(cached_output, output_path)
+            if codec == 'pcm':
+                write_metadata_sidecar(output_path, {'frame_rate': frame_rate, 'channels': channels, 'sample_width': 2})
+            print(f"{Fore.GREEN}♻️  Identical render found in the cache{Style.RESET_ALL}")
+        else:
+            print(f"{Fore.BLUE}Rendering {plan['duration']:.1f}s as {describe_codec(codec)}...{Style.RESET_ALL}")
+            stats = {}
+            with trace_span('encode') as span:
+                segments = iter_plan_segments(plan, blocks_dir, frame_rate, channels, workers, cache_dir, stats)
+                encode_pcm_stream(segments, output_path, frame_rate, channels, codec, f"{ENCODER_BITRATE_KBPS}k")
+                span.add(bytes=os.path.getsize(output_path))
+            block_loudness(blocks_dir, [], measured=stats)
+            if cached_output:
+                os.makedirs(os.path.dirname(cached_output), exist_ok=True)
+                shutil.copyfile(output_path, cached_output + '.tmp')
+                os.replace(cached_output + '.tmp', cached_output)
+        if cache_dir:
+            prune_render_cache(cache_dir)
+        
+        print(f"{Fore.GREEN}✅ Sequence saved: {output_path}{Style.RESET_ALL}")
+        m_sequence, voice_sequence = plan_sequences(plan)
+        generate_sequence_timeline(output_path, blocks_dir, m_sequence, voice_sequence, plan['duration'], plan)
+        record_block_usage(blocks_dir, os.path.basename(output_path), [block['file'] for block in plan_blocks(plan)])
+        return True
+    except Exception as e:
+        print(f"{Fore.RED}❌ Error rendering sequence plan: {e}{Style.RESET_ALL}")
+        return False
+
+# ============================================================================
+# N-LANE ENGINE (lane layouts mixed on one float buffer)
+# ============================================================================
+
+# A lane plays blocks of the given types ('m', 'v', 'j') back to back from its offset, at its gain
+LaneSpec = namedtuple('LaneSpec', ['name', 'types', 'offset', 'gain_db', 'jingle_first'])
+
+LANE_PRESETS = {
+    # The original sequencer: music from the start, voice/jingle 15 s in, opening with a jingle
+    'classic': [
+        LaneSpec('music', 'm', 0.0, 0.0, False),
+        LaneSpec('voice', 'vj', float(VOICE_OFFSET_SECONDS), 0.0, True)
+    ],
+    # Classic plus a quiet second music lane, out of step with the first, as a bed under the transitions
+    'layered': [
+        LaneSpec('music', 'm', 0.0, 0.0, False),
+        LaneSpec('voice', 'vj', float(VOICE_OFFSET_SECONDS), 0.0, True),
+        LaneSpec('bed', 'm', float(VOICE_OFFSET_SECONDS), -18.0, False)
+    ]
+}
+LANE_LAYOUT = 'classic'        # preset name, or a list of LaneSpec loaded from a layout file
+SOFT_LIMIT_THRESHOLD = 0.89    # fraction of full scale (about -1 dBFS) below which the mix passes untouched
+MIX_VERSION = 2                # bumped when the mixing arithmetic changes, so cached renders are not reused
+
+def load_lane_layout(path):
+    """
+    Lanes from a JSON file: a list (or {"lanes": [...]}) of objects with name,
+    types (block prefixes, e.g. "vj"), offset (s), gain_db and jingle_first.
+    Raises ValueError for anything else.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    lanes = data.get('lanes') if isinstance(data, dict) else data
+    if not isinstance(lanes, list) or not lanes:
+        raise ValueError(f"{path} has no lanes")
+    specs = []
+    for index, lane in enumerate(lanes):
+        if not isinstance(lane, dict):
+            raise ValueError(f"Lane {index + 1} of {path}: expected an object with name, types, offset, gain_db, jingle_first")
+        types = str(lane.get('types', ''))
+        if not types or set(types) - set('mvj'):
+            raise ValueError(f"Lane {index + 1} of {path}: types must be made of m, v and j")
+        try:
+            offset, gain_db = float(lane.get('offset', 0.0)), float(lane.get('gain_db', 0.0))
+        except (TypeError, ValueError):
+            raise ValueError(f"Lane {index + 1} of {path}: offset and gain_db must be numbers")
+        specs.append(LaneSpec(str(lane.get('name', f"lane{index + 1}")), types, offset, gain_db,
+                              bool(lane.get('jingle_first', False))))
+    return specs
+
+def set_lane_layout(layout=None):
+    """Use a preset name or a layout file for every sequence of this run (None keeps the current one)"""
+    global LANE_LAYOUT
+    if layout is None:
+        return
+    LANE_LAYOUT = layout if layout in LANE_PRESETS else load_lane_layout(layout)
+
+def lane_layout():
+    """The LaneSpec list in use"""
+    return LANE_PRESETS[LANE_LAYOUT] if isinstance(LANE_LAYOUT, str) else LANE_LAYOUT
+
+def order_lane_blocks(spec, pools, rng=None, last_used=None):
+    """
+    A lane's candidates in random order: a shuffled copy of its pools, or with
+    jingle_first the order of create_voice_sequence (opening with a random jingle),
+    so seeds keep the sequences they gave before lane layouts.
+    last_used (see block_last_used): reorder the shuffle for rotation (see
+    rotate_blocks); the lane then opens with its first jingle in that order.
+    """
+    rng = rng or random
+    blocks = [block for block_type in spec.types for block in pools.get(block_type, [])]
+    jingles = [block for block in blocks if block.startswith('j')]
+    if last_used is not None:
+        rng.shuffle(blocks)
+        blocks = rotate_blocks(blocks, last_used, rng)
+        if spec.jingle_first and jingles:
+            first = next(block for block in blocks if block.startswith('j'))
+            blocks.remove(first)
+            blocks.insert(0, first)
+        return blocks
+    if spec.jingle_first:
+        return create_voice_sequence([block for block in blocks if not block.startswith('j')], jingles, rng)
+    rng.shuffle(blocks)
+    return blocks
+
+def select_lane_sequences(blocks_dir, pools, specs=None, target_seconds=None, tolerance=None, rng=None):
+    """
+    Block order of every lane of a layout ({'m': [...], 'v': [...], 'j': [...]} pools),
+    rotated by usage history with --rotation (see rotate_blocks).
+    Without target_seconds every lane gets as many blocks as the shortest lane can
+    supply. With it, the first lane is fitted to the target by real durations (see
+    fit_blocks_to_duration) and the others get every block that still ends by then.
+    Returns [blocks per lane], or None when the blocks cannot fill the target.
+    """
+    specs = specs or lane_layout()
+    last_used = block_last_used(blocks_dir) if ROTATION else None
+    orders = [order_lane_blocks(spec, pools, rng, last_used) for spec in specs]
+    empty = [spec.name for spec, order in zip(specs, orders) if not order]
+    if empty:
+        print(f"{Fore.RED}❌ No blocks for lane(s): {', '.join(empty)}{Style.RESET_ALL}")
+        return None
+    
+    print(f"{Fore.BLUE}🎵 Sequence Configuration:{Style.RESET_ALL}")
+    if target_seconds is None:
+        count = min(len(order) for order in orders)
+        for spec, order in zip(specs, orders):
+            skipped = f" ({len(order) - count} skipped)" if len(order) > count else ""
+            print(f"{Fore.GREEN}   {spec.name}: {count} blocks{skipped}{Style.RESET_ALL}")
+        return [order[:count] for order in orders]
+    
+    tolerance = SEQUENCE_DURATION_TOLERANCE if tolerance is None else tolerance
+    durations = block_durations(blocks_dir, [block for order in orders for block in order])
+    orders = [[block for block in order if block in durations] for order in orders]
+    available = min(spec.offset + sum(durations[block] for block in order) for spec, order in zip(specs, orders))
+    if target_seconds > available + tolerance:
+        print(f"{Fore.YELLOW}⚠️  Only {available / 60:.1f} minutes of blocks available for a {target_seconds / 60:.1f} minute sequence{Style.RESET_ALL}")
+        return None
+    
+    lead, lead_seconds = fit_blocks_to_duration(orders[0], durations, target_seconds - specs[0].offset, tolerance,
+                                                keep_first=specs[0].jingle_first)
+    total = specs[0].offset + lead_seconds
+    lanes = [lead]
+    for spec, order in zip(specs[1:], orders[1:]):
+        lane = []
+        lane_end = spec.offset
+        for block in order:
+            if lane_end + durations[block] > total + tolerance:
+                break
+            lane.append(block)
+            lane_end += durations[block]
+        lanes.append(lane)
+    
+    for spec, lane in zip(specs, lanes):
+        print(f"{Fore.GREEN}   {spec.name}: {len(lane)} blocks{Style.RESET_ALL}")
+    print(f"{Fore.GREEN}   {total:.2f}s for a {target_seconds:.2f}s target{Style.RESET_ALL}")
+    if abs(total - target_seconds) > tolerance:
+        print(f"{Fore.YELLOW}⚠️  No combination of block lengths is within {tolerance:g}s of the target; "
+              f"closest is {total - target_seconds:+.2f}s{Style.RESET_ALL}")
+    return lanes
+
+def create_lane_plan(blocks_dir, lane_sequences, specs=None, seed=None):
+    """
+    Serializable description of a sequence: the seed that chose it and, per lane
+    (name, offset, gain), every block's ID, file, start offset and duration
+    (seconds), gain and content hash, plus the ducking and master bus settings
+    (or None). Blocks of a lane play back to back at their
+    real durations (from the duration index, so nothing is decoded).
+    """
+    from datetime import datetime
+    specs = specs or lane_layout()
+    filenames = sorted({block for blocks in lane_sequences for block in blocks})
+    hashes = block_content_hashes(blocks_dir, filenames)
+    durations = block_durations(blocks_dir, filenames)
+    
+    lanes = []
+    for spec, blocks in zip(specs, lane_sequences):
+        lanes.append({
+            'name': spec.name,
+            'offset': float(spec.offset),
+            'gain_db': float(spec.gain_db),
+            'blocks': [{
+                'id': os.path.splitext(block)[0],
+                'file': block,
+                'offset': block_offset,
+                'duration': durations.get(block, float(SLICE_SIZE)),
+                'gain_db': 0.0,
+                'hash': hashes[block]
+            } for block, block_offset in zip(blocks, lane_block_offsets(blocks, durations, spec.offset))]
+        })
+    plan = {
+        'version': PLAN_VERSION,
+        'seed': seed,
+        'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'blocks_dir': os.path.abspath(blocks_dir),
+        'slice_size': SLICE_SIZE,
+        'duration': max((lane['blocks'][-1]['offset'] + lane['blocks'][-1]['duration'] for lane in lanes if lane['blocks']), default=0.0),
+        'lanes': lanes,
+        'ducking': ducking_settings(specs)
+    }
+    plan['master'] = master_settings(plan, blocks_dir)
+    return plan
+
+def soft_limit(mixed):
+    """
+    Float mix (int16 scale) to int16. Samples under SOFT_LIMIT_THRESHOLD pass
+    unchanged; louder ones are bent towards full scale on a tanh curve instead of
+    being clipped flat like overlay() does. Works in place on mixed.
+    """
+    full_scale = 32767.0
+    knee = SOFT_LIMIT_THRESHOLD * full_scale
+    over = np.abs(mixed) > knee
+    if over.any():
+        loud = mixed[over]
+        headroom = full_scale - knee
+        mixed[over] = np.sign(loud) * (knee + headroom * np.tanh((np.abs(loud) - knee) / headroom))
+    return np.rint(mixed, out=mixed).astype(np.int16)
+
+def plan_block_cache(plan, blocks_dir, frame_rate, channels):
+    """PlanBlockCache sized for the plan: two blocks per lane meet at every transition"""
+    return PlanBlockCache(blocks_dir, frame_rate, channels, size=max(4, 2 * len(plan['lanes'])))
+
+def render_plan_audio(plan, blocks_dir=None, workers=None):
+    """
+    Render a whole plan into an AudioSegment. Every block is added into one
+    float buffer (RENDER_SEGMENT_SECONDS long, reused window after window) and
+    soft-limited once, so the cost is linear in the lane-seconds.
+    workers > 1 mixes the windows on a process pool (see iter_plan_segments).
+    """
+    blocks_dir = blocks_dir or plan['blocks_dir']
+    frame_rate, channels = plan_render_format(plan, blocks_dir)
+    windows = plan_render_windows(plan)
+    block_count = sum(len(lane['blocks']) for lane in plan['lanes'])
+    if workers and workers > 1 and len(windows) > 1:
+        print(f"{Fore.BLUE}🔊 Mixing {len(plan['lanes'])} lanes ({block_count} blocks) on {min(workers, len(windows))} workers...{Style.RESET_ALL}")
+        stats = {}
+        pcm = b''.join(iter_plan_segments(plan, blocks_dir, frame_rate, channels, workers, stats=stats))
+        block_loudness(blocks_dir, [], measured=stats)
+    else:
+        print(f"{Fore.BLUE}🔊 Mixing {len(plan['lanes'])} lanes ({block_count} blocks)...{Style.RESET_ALL}")
+        block_cache = plan_block_cache(plan, blocks_dir, frame_rate, channels)
+        scratch = {}
+        mixed = np.empty(int(round(plan['duration'] * frame_rate)) * channels, dtype=np.int16)
+        for start, end in windows:
+            samples = render_plan_window(plan, start, end, block_cache, scratch)
+            position = int(round(start * frame_rate)) * channels
+            mixed[position:position + len(samples)] = samples
+        block_loudness(blocks_dir, [], measured=block_cache.stats)
+        pcm = mixed.tobytes()
+        del mixed
+    final_audio = AudioSegment(data=pcm, sample_width=2, frame_rate=frame_rate, channels=channels)
+    print(f"{Fore.GREEN}✅ Sequence built: {len(final_audio)/1000:.1f}s total duration{Style.RESET_ALL}")
+    return final_audio
+
+def stream_plan_audio(plan, blocks_dir=None):
+    """Memory-bounded render_plan_audio: a StreamedSequence, mixed while it is exported"""
+    print(f"{Fore.BLUE}🔊 Building audio sequence (streamed to stay under {MEMORY_BUDGET_MB} MB)...{Style.RESET_ALL}")
+    sequence = StreamedSequence(plan, blocks_dir)
+    print(f"{Fore.GREEN}✅ Sequence planned: {len(sequence)/1000:.1f}s total duration{Style.RESET_ALL}")
+    return sequence
+
+# ============================================================================
+# SIDECHAIN DUCKING (music lanes dipped under voice, from the voice envelope)
+# ============================================================================
+
+DUCK_DEPTH_DB = None           # music gain reduction under voice, in dB; None: no ducking
+DUCK_ATTACK_SECONDS = 0.08     # music reaches full depth this long before the voice does (the mix is offline)
+DUCK_RELEASE_SECONDS = 0.6     # and comes back up over this long after the voice stops
+DUCK_THRESHOLD_DBFS = -30.0    # voice level (RMS) at and above which the music is fully ducked
+DUCK_FLOOR_DBFS = -50.0        # voice level at and below which the music is left alone
+DUCK_FRAME_SECONDS = 0.01      # envelope resolution; gains are interpolated between frames
+
+def set_ducking(depth_db=None):
+    """Duck music lanes by depth_db under voice/jingle lanes in every sequence of this run (None: off)"""
+    global DUCK_DEPTH_DB
+    DUCK_DEPTH_DB = abs(depth_db) if depth_db else None
+
+def ducking_settings(specs):
+    """
+    The plan's 'ducking' entry for a layout: lanes with voice or jingle blocks are
+    the key, lanes of music only are ducked. None when ducking is off or the
+    layout has nothing to duck.
+    """
+    if DUCK_DEPTH_DB is None:
+        return None
+    key = [spec.name for spec in specs if set(spec.types) & set('vj')]
+    ducked = [spec.name for spec in specs if set(spec.types) == {'m'}]
+    if not key or not ducked:
+        return None
+    return {
+        'key': key, 'ducked': ducked, 'depth_db': -DUCK_DEPTH_DB,
+        'attack': DUCK_ATTACK_SECONDS, 'release': DUCK_RELEASE_SECONDS,
+        'threshold_db': DUCK_THRESHOLD_DBFS, 'floor_db': DUCK_FLOOR_DBFS, 'frame': DUCK_FRAME_SECONDS
+    }
+
+def ducking_margins(ducking):
+    """(before, after) seconds of key audio outside a window that still change its gains"""
+    if not ducking:
+        return 0.0, 0.0
+    return ducking['release'] + 3 * ducking['frame'], ducking['attack'] + 3 * ducking['frame']
+
+def ducking_gains(key, key_first, frame, channels, ducking):
+    """
+    Music gain at the start of every envelope frame of the key mix (interleaved
+    float samples starting at frame key_first, a multiple of frame). The follower
+    runs on frame-long RMS levels in dB, clamped between floor and threshold: it
+    falls towards a louder level over the attack time ahead of it and decays over
+    the release time after it. Both ramps are linear in dB, so each is a running
+    maximum (np.maximum.accumulate) instead of a per-sample loop. Frame indexes are
+    absolute, so any window of the same plan gets exactly the same gains.
+    """
+    floor, threshold = ducking['floor_db'], ducking['threshold_db']
+    frame_samples = frame * channels
+    count = len(key) // frame_samples
+    rows = key[:count * frame_samples].reshape(count, frame_samples)
+    power = np.einsum('ij,ij->i', rows, rows) / (frame_samples * 32767.0 ** 2)
+    level = np.clip(10 * np.log10(power + 1e-12), floor, threshold)
+    
+    index = np.arange(key_first // frame, key_first // frame + count, dtype=np.float64)
+    attack = (threshold - floor) * ducking['frame'] / max(ducking['attack'], ducking['frame'])
+    release = (threshold - floor) * ducking['frame'] / max(ducking['release'], ducking['frame'])
+    released = np.maximum.accumulate(level + index * release) - index * release
+    attacked = np.maximum.accumulate((level - index * attack)[::-1])[::-1] + index * attack
+    envelope = np.maximum(released, attacked)
+    return (10 ** (ducking['depth_db'] * (envelope - floor) / (threshold - floor) / 20)).astype(np.float32)
+
+def apply_frame_gains(buffer, gains, frame, channels):
+    """
+    Scale a buffer of whole envelope frames in place, ramping linearly from each
+    frame's gain to the next one's (gains has one more entry than the buffer has
+    frames). Frames at a steady gain cost one multiply; only the frames where the
+    gain moves get a ramp.
+    """
+    rows = buffer.reshape(-1, frame * channels)
+    start, step = gains[:-1], np.diff(gains)
+    moving = np.flatnonzero(step)
+    if not len(moving) and not (start != 1).any():
+        return
+    np.multiply(rows, start[:, None], out=rows)
+    if len(moving):
+        ramp = np.repeat(np.arange(frame, dtype=np.float32) / frame, channels)
+        rows[moving] *= 1 + (step[moving] / start[moving])[:, None] * ramp
+
+def mix_ducked_lanes(plan, mixed, first, last, loader, scratch=None):
+    """
+    Fill mixed (frames [first, last); its contents are overwritten) with the key
+    lanes of plan['ducking'] as they are plus its ducked lanes scaled by the key
+    mix's ducking_gains. The key lanes are
+    mixed a little past the window for the envelope, the ducked ones out to whole
+    envelope frames. Returns the number of blocks mixed.
+    """
+    ducking = plan['ducking']
+    frame_rate, channels = loader.frame_rate, loader.channels
+    frame = max(1, int(round(ducking['frame'] * frame_rate)))
+    before, after = ducking_margins(ducking)
+    ducked_first = first // frame * frame
+    ducked_last = -(-last // frame) * frame
+    key_first = (ducked_first - int(before * frame_rate)) // frame * frame
+    key_last = -(-(ducked_last + int(after * frame_rate)) // frame) * frame + frame
+    
+    count = 0
+    key = mix_buffer(scratch, 'key', (key_last - key_first) * channels)
+    ducked = mix_buffer(scratch, 'ducked', (ducked_last - ducked_first) * channels)
+    for lane in plan['lanes']:
+        if lane['name'] in ducking['key']:
+            count += add_lane_frames(key, key_first, key_last, lane, plan, loader)
+        elif lane['name'] in ducking['ducked']:
+            count += add_lane_frames(ducked, ducked_first, ducked_last, lane, plan, loader)
+    
+    with trace_span('duck'):
+        gains = ducking_gains(key, key_first, frame, channels, ducking)
+        offset = (ducked_first - key_first) // frame
+        apply_frame_gains(ducked, gains[offset:offset + (ducked_last - ducked_first) // frame + 1], frame, channels)
+        ducked_position = (first - ducked_first) * channels
+        key_position = (first - key_first) * channels
+        np.add(ducked[ducked_position:ducked_position + len(mixed)], key[key_position:key_position + len(mixed)], out=mixed)
+    return count
+
+# ============================================================================
+# MASTER BUS (target loudness and a true-peak lookahead limiter, window by window)
+# ============================================================================
+
+MASTER_LOUDNESS = None         # target loudness of the whole sequence (dBFS RMS, unweighted); None: no master bus
+MASTER_CEILING_DBTP = -1.0     # true-peak ceiling of the limiter
+MASTER_LOOKAHEAD_SECONDS = 0.005   # the limiter reaches any reduction this long before the peak that needs it
+MASTER_RELEASE_SECONDS = 0.3       # and recovers from its deepest reduction over this long (shallower ones sooner)
+MASTER_MAX_REDUCTION_DB = 24.0     # deepest limiter reduction; louder overs are left to the soft limiter
+MASTER_FRAME_SECONDS = 0.001   # limiter resolution; gains are interpolated between frames
+MASTER_MAX_GAIN_DB = 30.0      # the master gain is capped at this many dB either way
+LOUDNESS_INDEX_FILE = "block_loudness.json"
+LOUDNESS_WINDOW_SECONDS = 0.4  # BS.1770 gating block
+LOUDNESS_GATE_DBFS = -70.0     # absolute gate: quieter gating blocks do not count
+
+def set_master_bus(loudness=None, ceiling_dbtp=None):
+    """Master every sequence of this run to loudness (dBFS RMS) with a true-peak ceiling (None: off / unchanged)"""
+    global MASTER_LOUDNESS, MASTER_CEILING_DBTP
+    MASTER_LOUDNESS = loudness
+    if ceiling_dbtp is not None:
+        MASTER_CEILING_DBTP = ceiling_dbtp
+
+def block_loudness_stats(samples, frame_rate, channels):
+    """
+    Loudness stats of decoded int16 samples: {'power', 'active'}, the mean power
+    (sum over channels, full scale = 1) of the 400 ms gating blocks above the
+    absolute gate, and how many seconds those cover. Unweighted (no K-filter),
+    so levels are dBFS RMS, not LUFS.
+    """
+    window = int(LOUDNESS_WINDOW_SECONDS * frame_rate) * channels
+    count = len(samples) // window
+    if not count:
+        return {'power': 0.0, 'active': 0.0}
+    rows = samples[:count * window].reshape(count, window).astype(np.float32)
+    power = np.einsum('ij,ij->i', rows, rows) * channels / (window * 32768.0 ** 2)
+    gated = power > 10 ** (LOUDNESS_GATE_DBFS / 10)
+    if not gated.any():
+        return {'power': 0.0, 'active': 0.0}
+    return {'power': float(power[gated].mean()), 'active': float(gated.sum() * LOUDNESS_WINDOW_SECONDS)}
+
+def load_loudness_index(blocks_dir):
+    """Cached block loudness stats of a folder: {filename: {'power', 'active', 'mtime', 'size'}}"""
+    try:
+        with open(os.path.join(blocks_dir, LOUDNESS_INDEX_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_loudness_index(blocks_dir, index):
+    index_path = os.path.join(blocks_dir, LOUDNESS_INDEX_FILE)
+    temp_path = index_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+    except OSError as e:
+        print(f"{Fore.YELLOW}⚠️  Could not save loudness index: {e}{Style.RESET_ALL}")
+
+@traced('loudness')
+def block_loudness(blocks_dir, filenames, measured=None, analyze=True):
+    """
+    {filename: stats} (see block_loudness_stats) for blocks of a folder. Stats are
+    measured when a block is sliced (index_new_blocks) and refreshed by every
+    render (PlanBlockCache measures each block it decodes; pass them as
+    measured). analyze: decode blocks with no current stats and measure them
+    (False: leave them out). Missing or unreadable files are left out.
+    """
+    index = load_loudness_index(blocks_dir)
+    changed = False
+    for filename, stats in (measured or {}).items():
+        try:
+            stat = block_stat(blocks_dir, filename)
+        except OSError:
+            continue
+        entry = dict(stats, mtime=stat.st_mtime, size=stat.st_size)
+        if index.get(filename) != entry:
+            index[filename] = entry
+            changed = True
+    
+    loudness = {}
+    for filename in dict.fromkeys(filenames):
+        try:
+            stat = block_stat(blocks_dir, filename)
+        except OSError:
+            continue
+        cached = index.get(filename)
+        if not (cached and cached.get('mtime') == stat.st_mtime and cached.get('size') == stat.st_size):
+            if not analyze:
+                continue
+            try:
+                segment = load_audio_file(block_path(blocks_dir, filename)).set_sample_width(2)
+            except Exception as e:
+                print(f"{Fore.YELLOW}⚠️  Could not measure the loudness of {filename}: {e}{Style.RESET_ALL}")
+                continue
+            samples = np.frombuffer(segment.raw_data, dtype=np.int16)
+            cached = index[filename] = dict(block_loudness_stats(samples, segment.frame_rate, segment.channels),
+                                            mtime=stat.st_mtime, size=stat.st_size)
+            changed = True
+        loudness[filename] = {'power': cached['power'], 'active': cached['active']}
+    if changed:
+        save_loudness_index(blocks_dir, index)
+    return loudness
+
+def power_to_dbfs(power):
+    return 10 * np.log10(max(power, 1e-12))
+
+def estimate_plan_loudness(plan, loudness):
+    """
+    Integrated loudness (dBFS RMS, unweighted) the plan's mix will have at unity master
+    gain, predicted from per-block stats instead of measuring the mix: lanes are
+    taken as uncorrelated, so their powers add, and ducked lanes lose their depth
+    for the share of time the voice lanes are active. A lane with unmeasured blocks
+    is extrapolated from its measured ones over its whole length. None when a lane
+    has no measured block at all, or the plan is silent: there is nothing to predict from.
+    """
+    lanes = []
+    for lane in plan['lanes']:
+        lane_energy = lane_active = 0.0
+        lane_seconds = measured_seconds = 0.0
+        for block in lane['blocks']:
+            seconds = block.get('duration', SLICE_SIZE)
+            lane_seconds += seconds
+            stats = loudness.get(block['file'])
+            if stats:
+                lane_energy += stats['power'] * stats['active'] * 10 ** ((lane.get('gain_db', 0.0) + block.get('gain_db', 0.0)) / 10)
+                lane_active += stats['active']
+                measured_seconds += seconds
+        if not lane_seconds:
+            continue
+        if not measured_seconds:
+            return None
+        # Unmeasured blocks are taken to sound like the measured blocks of their lane
+        scale = lane_seconds / measured_seconds
+        lanes.append((lane['name'], lane_energy * scale, lane_active * scale))
+    
+    ducking = plan.get('ducking')
+    key_share = 0.0
+    if ducking and plan['duration'] > 0:
+        key_active = sum(active for name, _, active in lanes if name in ducking['key'])
+        key_share = min(1.0, key_active / plan['duration'])
+    
+    energy = 0.0
+    active = 0.0
+    for name, lane_energy, lane_active in lanes:
+        if ducking and name in ducking['ducked']:
+            lane_energy *= 1 - key_share + key_share * 10 ** (ducking['depth_db'] / 10)
+        energy += lane_energy
+        active += lane_active
+    # Overlapping lanes play at the same time, so the mix is as long as its longest stretch, not the sum
+    seconds = min(active, plan['duration']) or plan['duration']
+    if not seconds or energy <= 0:
+        return None
+    return power_to_dbfs(energy / seconds)
+
+def master_settings(plan, blocks_dir):
+    """
+    The plan's 'master' entry: target, ceiling and the fixed gain that brings the
+    predicted loudness to the target (see estimate_plan_loudness), at most
+    MASTER_MAX_GAIN_DB either way. Only the stored block stats are read: nothing
+    is decoded at plan time. Without a prediction the gain stays at 0 dB and only
+    the limiter applies. None when the master bus is off.
+    """
+    if MASTER_LOUDNESS is None:
+        return None
+    files = sorted({block['file'] for lane in plan['lanes'] for block in lane['blocks']})
+    loudness = block_loudness(blocks_dir, files, analyze=False)
+    predicted = estimate_plan_loudness(plan, loudness)
+    if predicted is None:
+        print(f"{Fore.YELLOW}⚠️  No loudness prediction ({len(files) - len(loudness)} of {len(files)} blocks not measured, "
+              f"a whole lane unmeasured or a silent plan): master gain left at 0 dB, only the limiter applies. "
+              f"Run sync-catalog first to measure the blocks{Style.RESET_ALL}")
+    elif len(loudness) < len(files):
+        print(f"{Fore.YELLOW}⚠️  {len(files) - len(loudness)} of {len(files)} blocks have no loudness measurement yet: "
+              f"each lane's level is extrapolated from its measured blocks (sync-catalog measures the rest){Style.RESET_ALL}")
+    gain_db = 0.0 if predicted is None else MASTER_LOUDNESS - predicted
+    if abs(gain_db) > MASTER_MAX_GAIN_DB:
+        print(f"{Fore.YELLOW}⚠️  Master gain {gain_db:+.1f} dB capped at ±{MASTER_MAX_GAIN_DB:g} dB{Style.RESET_ALL}")
+        gain_db = max(-MASTER_MAX_GAIN_DB, min(MASTER_MAX_GAIN_DB, gain_db))
+    predicted_text = f"{predicted:.1f} dBFS" if predicted is not None else "no"
+    print(f"{Fore.BLUE}🎚️  Master bus: {predicted_text} predicted, "
+          f"{gain_db:+.1f} dB to {MASTER_LOUDNESS:g} dBFS, ceiling {MASTER_CEILING_DBTP:g} dBTP{Style.RESET_ALL}")
+    return {
+        'loudness': MASTER_LOUDNESS, 'gain_db': round(gain_db, 3), 'ceiling_db': MASTER_CEILING_DBTP,
+        'lookahead': MASTER_LOOKAHEAD_SECONDS, 'release': MASTER_RELEASE_SECONDS,
+        'max_reduction_db': MASTER_MAX_REDUCTION_DB, 'frame': MASTER_FRAME_SECONDS
+    }
+
+def master_margins(master):
+    """(before, after) seconds of mix outside a window that still change its limiter gains"""
+    if not master:
+        return 0.0, 0.0
+    return master['release'] + 3 * master['frame'], master['lookahead'] + 3 * master['frame']
+
+def true_peak_filter(oversample=4, taps=24):
+    """
+    Polyphase interpolation filter: one row of taps per in-between phase
+    (1/4, 2/4, 3/4 of a sample), Kaiser-windowed sinc, unity gain at DC. Longer
+    than the 12 taps of BS.1770 so that content near Nyquist is not under-read.
+    Sample k of a row weighs the input at offset k - taps // 2 + 1.
+    """
+    offsets = np.arange(taps) - taps // 2 + 1
+    phases = []
+    for phase in range(1, oversample):
+        row = np.sinc(phase / oversample - offsets) * np.kaiser(taps, 5.0)
+        phases.append(row / row.sum())
+    return np.array(phases, dtype=np.float32)
+
+TRUE_PEAK_FILTER = None        # true_peak_filter(), built on first use
+TRUE_PEAK_MARGIN_DB = 3.0      # frames whose sample peak is further below the ceiling are not oversampled
+
+def true_peak_frames(mixed, frame, channels, gain, ceiling):
+    """
+    Peak of every frame of a float mix (int16 scale) after gain, including the
+    peaks between samples: frames whose sample peak is within TRUE_PEAK_MARGIN_DB
+    of the ceiling are oversampled 4x (true_peak_filter) and their
+    in-between peaks count too. Frames at the ends of the buffer reuse their edge
+    samples for the filter's context.
+    """
+    global TRUE_PEAK_FILTER
+    if TRUE_PEAK_FILTER is None:
+        TRUE_PEAK_FILTER = true_peak_filter()
+    rows = mixed.reshape(-1, frame * channels)
+    peaks = np.maximum(rows.max(axis=1), -rows.min(axis=1)) * gain
+    close = np.flatnonzero(peaks > ceiling * 10 ** (-TRUE_PEAK_MARGIN_DB / 20))
+    if len(close):
+        taps = TRUE_PEAK_FILTER.shape[1]
+        frames = mixed.reshape(-1, channels)
+        if 2 * len(close) > len(peaks):
+            # Mostly close: the whole buffer in one run is cheaper than gathering frames
+            starts, span = np.zeros(1, dtype=np.int64), len(frames)
+        else:
+            starts, span = close * frame, frame
+        # Every run with taps // 2 samples of context on each side
+        index = starts[:, None] + np.arange(-(taps // 2 - 1), span + taps // 2)
+        context = frames[np.clip(index, 0, len(frames) - 1)]
+        between = np.zeros((len(starts), span, channels), dtype=np.float32)
+        interpolated = np.empty_like(between)
+        term = np.empty_like(between)
+        for phase in TRUE_PEAK_FILTER:
+            np.multiply(context[:, :span], phase[0], out=interpolated)
+            for k in range(1, taps):
+                np.multiply(context[:, k:k + span], phase[k], out=term)
+                interpolated += term
+            np.abs(interpolated, out=interpolated)
+            np.maximum(between, interpolated, out=between)
+        between = between.reshape(-1, frame * channels).max(axis=1)
+        if span != frame:
+            between = between[close]
+        peaks[close] = np.maximum(peaks[close], between * gain)
+    return peaks
+
+def limiter_gains(peaks, first_frame, ceiling, master):
+    """
+    Limiter gain at the start of every frame (one more than there are frames) that
+    keeps the master-gained mix under the ceiling, or None when nothing is over.
+    The reduction each frame needs is ramped in linear dB over the lookahead before
+    it and the release after it with running maxima, as in ducking_gains; each
+    frame boundary takes the lower gain of the two frames it joins, so the gain
+    is under the limit through the whole of every frame.
+    """
+    deepest = master['max_reduction_db']
+    reduction = np.clip(20 * np.log10(np.maximum(peaks, 1e-9) / ceiling), 0.0, deepest)
+    if not reduction.any():
+        return None
+    index = np.arange(first_frame, first_frame + len(peaks), dtype=np.float64)
+    attack = deepest * master['frame'] / max(master['lookahead'], master['frame'])
+    release = deepest * master['frame'] / max(master['release'], master['frame'])
+    released = np.maximum.accumulate(reduction + index * release) - index * release
+    attacked = np.maximum.accumulate((reduction - index * attack)[::-1])[::-1] + index * attack
+    envelope = np.maximum(released, attacked)
+    boundary = np.maximum(np.concatenate([envelope[:1], envelope]), np.concatenate([envelope, envelope[-1:]]))
+    return (10 ** (-boundary / 20)).astype(np.float32)
+
+def master_plan_frames(plan, first, last, loader, scratch=None):
+    """
+    Frames [first, last) of the plan's mix through its master bus: the mix is made
+    a little past both ends of the window (whole limiter frames, see master_margins),
+    then the window is scaled by master gain times limiter gain in one pass. The
+    limiter looks only at frames on an absolute grid, so windows of any size give
+    the same audio. Returns a float buffer (int16 scale).
+    """
+    master = plan['master']
+    frame_rate, channels = loader.frame_rate, loader.channels
+    frame = max(1, int(round(master['frame'] * frame_rate)))
+    before, after = master_margins(master)
+    bus_first = (first - int(before * frame_rate)) // frame * frame
+    bus_last = -(-(last + int(after * frame_rate)) // frame) * frame
+    mixed = mix_plan_frames(plan, bus_first, bus_last, loader, scratch)
+    with trace_span('master'):
+        gain = np.float32(10 ** (master['gain_db'] / 20))
+        ceiling = 10 ** (master['ceiling_db'] / 20) * 32768.0
+        gains = limiter_gains(true_peak_frames(mixed, frame, channels, gain, ceiling), bus_first // frame, ceiling, master)
+        position = (first - bus_first) * channels
+        window = mixed[position:position + (last - first) * channels]
+        if gains is None:
+            window *= gain
+        else:
+            # Only the frames the window touches are scaled
+            touched_first = (first - bus_first) // frame
+            touched_last = -(-(last - bus_first) // frame)
+            touched = mixed[touched_first * frame * channels:touched_last * frame * channels]
+            apply_frame_gains(touched, gains[touched_first:touched_last + 1] * gain, frame, channels)
+    return window
+
+# ============================================================================
+# RADIO MODE (endless sequence, mixed just in time and paced to a live sink)
+# ============================================================================
+
+RADIO_CHUNK_SECONDS = 0.5      # mix/encode granularity of the live stream
+RADIO_LEAD_SECONDS = 2.0       # audio produced ahead of the wall clock, absorbs decode hiccups
+RADIO_SCHEDULE_BLOCKS = 2      # blocks per lane chosen (and decoded in the background) ahead of the playhead
+RADIO_RESYNC_SECONDS = 5.0     # further behind than this (sink stalled), restart the clock instead of bursting
+RADIO_CLIENT_QUEUE = 64        # chunks buffered per HTTP listener before it is dropped as too slow
+RADIO_FORMATS = {'mp3': 'audio/mpeg', 'wav': 'audio/wav', 'pcm': 'application/octet-stream'}
+
+class RadioScheduler:
+    """
+    Endless lanes of the current layout (lane_layout()) chosen with the sequencer's
+    rules: each lane starts at its offset and is refilled with a fresh shuffle (voice
+    rounds open with a jingle) when it runs out. The folder is rescanned every round,
+    so new blocks join the rotation. Blocks follow each other at their real durations
+    (duration index). Only blocks around the playhead are kept, as a small plan that
+    render_plan_window can mix.
+    """
+    
+    def __init__(self, blocks_dir, rng=None, specs=None):
+        self.blocks_dir = blocks_dir
+        self.rng = rng or random
+        self.specs = specs or lane_layout()
+        self.plan = {'slice_size': SLICE_SIZE, 'ducking': ducking_settings(self.specs), 'lanes': [
+            {'name': spec.name, 'offset': float(spec.offset), 'gain_db': float(spec.gain_db), 'blocks': []}
+            for spec in self.specs
+        ]}
+        self.lane_end = [lane['offset'] for lane in self.plan['lanes']]
+        self.queued = [[] for _ in self.specs]
+        self.durations = {}
+    
+    def _next_round(self, spec, last_block):
+        m_blocks, v_blocks, j_blocks = scan_available_blocks(self.blocks_dir)
+        last_used = block_last_used(self.blocks_dir) if ROTATION else None
+        round_blocks = order_lane_blocks(spec, {'m': m_blocks, 'v': v_blocks, 'j': j_blocks}, self.rng, last_used)
+        # Never play the same block twice in a row across rounds (jingle-first rounds open with a jingle instead)
+        if not spec.jingle_first and len(round_blocks) > 1 and round_blocks[0] == last_block:
+            round_blocks[0], round_blocks[1] = round_blocks[1], round_blocks[0]
+        # Only this round's lengths are kept, so the lookup does not grow with uptime
+        self.durations = {block: duration for block, duration in self.durations.items()
+                          if any(block in queued for queued in self.queued)}
+        self.durations.update(block_durations(self.blocks_dir, round_blocks))
+        return [block for block in round_blocks if self.durations.get(block)]
+    
+    def advance(self, position):
+        """Schedule blocks up to RADIO_SCHEDULE_BLOCKS ahead of position (seconds), drop the ones behind it; returns the new blocks"""
+        added = []
+        # Voice that ended within the ducking release still shapes the music
+        behind = position - ducking_margins(self.plan['ducking'])[0]
+        for index, (spec, lane) in enumerate(zip(self.specs, self.plan['lanes'])):
+            lane['blocks'] = [block for block in lane['blocks']
+                              if block['offset'] + block['duration'] + BLOCK_LENGTH_MARGIN_SECONDS > behind]
+            while self.lane_end[index] < position + RADIO_SCHEDULE_BLOCKS * SLICE_SIZE:
+                if not self.queued[index]:
+                    last_block = lane['blocks'][-1]['file'] if lane['blocks'] else None
+                    self.queued[index] = self._next_round(spec, last_block)
+                    if not self.queued[index]:
+                        raise RuntimeError(f"No {spec.name} blocks left in {self.blocks_dir}")
+                filename = self.queued[index].pop(0)
+                block = {
+                    'id': os.path.splitext(filename)[0],
+                    'file': filename,
+                    'offset': self.lane_end[index],
+                    'duration': self.durations[filename],
+                    'gain_db': 0.0
+                }
+                lane['blocks'].append(block)
+                added.append(block)
+                self.lane_end[index] += block['duration']
+        if added:
+            record_block_usage(self.blocks_dir, 'radio', [block['file'] for block in added])
+        return added
+
+class RadioBlockCache(PlanBlockCache):
+    """
+    PlanBlockCache that decodes scheduled blocks on a background thread before they
+    are due, so the mixing loop never waits on ffmpeg. An unreadable block plays as silence.
+    """
+    
+    def __init__(self, blocks_dir, frame_rate, channels, size=4):
+        from concurrent.futures import ThreadPoolExecutor
+        super().__init__(blocks_dir, frame_rate, channels, size)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='radio-decode')
+        self.pending = {}
+    
+    def _decode_or_silence(self, block):
+        try:
+            return PlanBlockCache._decode(self, block)
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️  Playing silence for unreadable block {block['file']}: {e}{Style.RESET_ALL}")
+            return np.zeros(0, dtype=np.int16)
+    
+    def prefetch(self, block):
+        if block['file'] not in self.blocks and block['file'] not in self.pending:
+            self.pending[block['file']] = self.executor.submit(self._decode_or_silence, block)
+    
+    def _decode(self, block):
+        future = self.pending.pop(block['file'], None)
+        return future.result() if future else self._decode_or_silence(block)
+    
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.pending.clear()
+        self.blocks.clear()
+
+def wav_stream_header(frame_rate, channels):
+    """16-bit WAV header for a stream of unknown length (sizes at the maximum, as live WAV streams do)"""
+    import struct
+    block_align = channels * 2
+    return (b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE' +
+            b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, frame_rate, frame_rate * block_align, block_align, 16) +
+            b'data' + struct.pack('<I', 0xFFFFFFFF))
+
+class RawStreamWriter:
+    """PCM passed straight to the sink (wav and pcm streams), same interface as Mp3StreamWriter"""
+    
+    def __init__(self, out_file):
+        self.out_file = out_file
+    
+    def write(self, pcm):
+        self.out_file.write(pcm)
+    
+    def close(self):
+        pass
+
+class FileRadioSink:
+    """
+    Stdout, a file or a named pipe (created when missing). When the listener of a
+    pipe goes away, the pipe is reopened and the stream resumes for the next one;
+    on stdout or a file that ends the stream (closed is set).
+    """
+    
+    def __init__(self, path=None, header=b''):
+        self.path = path
+        self.header = header
+        self.closed = False
+        self.stream = None
+        self.is_pipe = False
+        if path is not None and not os.path.exists(path) and hasattr(os, 'mkfifo'):
+            os.mkfifo(path)
+        if path is not None:
+            import stat
+            self.is_pipe = stat.S_ISFIFO(os.stat(path).st_mode)
+        self._open()
+    
+    def _open(self):
+        if self.path is None:
+            self.stream = sys.stdout.buffer
+        else:
+            if self.is_pipe:
+                print(f"{Fore.CYAN}📻 Waiting for a listener on {self.path}...{Style.RESET_ALL}")
+            self.stream = open(self.path, 'wb')
+        self.stream.write(self.header)
+    
+    def write(self, data):
+        if self.closed:
+            return
+        try:
+            self.stream.write(data)
+            self.stream.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            if not self.is_pipe:
+                self.closed = True
+                if self.path is None:
+                    # Keep the interpreter from failing to flush the dead stdout at exit
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), self.stream.fileno())
+                return
+            print(f"{Fore.YELLOW}📻 Listener disconnected from {self.path}{Style.RESET_ALL}")
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+            self._open()
+    
+    def close(self):
+        if self.path is not None and self.stream and not self.stream.closed:
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+
+class HttpRadioSink:
+    """
+    Local HTTP stream: every GET receives the live audio from the moment it connects.
+    A listener that falls RADIO_CLIENT_QUEUE chunks behind is dropped, so one slow
+    client never stalls the others or grows memory.
+    """
+    
+    def __init__(self, host, port, content_type, header=b''):
+        import queue
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.header = header
+        self.closed = False
+        self.listeners = set()
+        self.lock = threading.Lock()
+        sink = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                listener = queue.Queue(maxsize=RADIO_CLIENT_QUEUE)
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                with sink.lock:
+                    sink.listeners.add(listener)
+                try:
+                    self.wfile.write(sink.header)
+                    while True:
+                        data = listener.get()
+                        if data is None:
+                            break
+                        self.wfile.write(data)
+                except OSError:
+                    pass
+                finally:
+                    with sink.lock:
+                        sink.listeners.discard(listener)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='radio-http', daemon=True).start()
+        print(f"{Fore.CYAN}📻 Streaming on http://{host}:{self.server.server_address[1]}/{Style.RESET_ALL}")
+    
+    def _drop(self, listener):
+        import queue
+        with self.lock:
+            self.listeners.discard(listener)
+        while True:
+            try:
+                listener.get_nowait()
+            except queue.Empty:
+                break
+        listener.put_nowait(None)
+    
+    def write(self, data):
+        import queue
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener.put_nowait(data)
+            except queue.Full:
+                print(f"{Fore.YELLOW}📻 Dropped a listener that fell behind{Style.RESET_ALL}")
+                self._drop(listener)
+    
+    def close(self):
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            self._drop(listener)
+        self.server.shutdown()
+        self.server.server_close()
+
+def open_radio_sink(target, format, frame_rate, channels):
+    """
+    Sink for a radio stream: '-' for stdout, http://host:port for a local HTTP
+    stream, anything else a named pipe (created when missing) or file path.
+    An object with write/close/closed is used as it is.
+    """
+    from urllib.parse import urlparse
+    header = wav_stream_header(frame_rate, channels) if format == 'wav' else b''
+    if not isinstance(target, str):
+        return target
+    if target == '-':
+        return FileRadioSink(None, header)
+    if target.startswith('http://'):
+        address = urlparse(target)
+        return HttpRadioSink(address.hostname or '127.0.0.1', address.port or 8000, RADIO_FORMATS[format], header)
+    return FileRadioSink(target, header)
+
+def run_radio(blocks_dir, output='-', format='mp3', bitrate_kbps=ENCODER_BITRATE_KBPS, frame_rate=44100,
+              channels=2, seed=None, duration=None, realtime=True):
+    """
+    Play a blocks folder as an endless live stream. Blocks are chosen as the sequencer
+    does (RadioScheduler), decoded ahead on a background thread, mixed RADIO_CHUNK_SECONDS
+    at a time and encoded straight to the sink, paced at real time RADIO_LEAD_SECONDS ahead
+    of the wall clock. Memory stays flat: only the blocks around the playhead are held.
+    duration: stop after this many seconds of audio (default: never)
+    realtime: False produces as fast as the sink takes it (tests, files)
+    Returns True when the stream ended cleanly.
+    """
+    import contextlib
+    import time
+    if format not in RADIO_FORMATS:
+        print(f"{Fore.RED}❌ Radio streams can be {', '.join(RADIO_FORMATS)}, not {format}{Style.RESET_ALL}")
+        return False
+    
+    try:
+        sink = open_radio_sink(output, format, frame_rate, channels)
+    except OSError as e:
+        print(f"{Fore.RED}❌ Error opening radio output {output}: {e}{Style.RESET_ALL}")
+        return False
+    
+    # Audio goes to stdout, so the status messages must not
+    status = contextlib.redirect_stdout(sys.stderr) if output == '-' else contextlib.nullcontext()
+    with status:
+        if not validate_sequence_requirements(*scan_available_blocks(blocks_dir)):
+            sink.close()
+            return False
+        
+        scheduler = RadioScheduler(blocks_dir, random.Random(seed) if seed is not None else None)
+        cache = RadioBlockCache(blocks_dir, frame_rate, channels, size=len(scheduler.specs) * (RADIO_SCHEDULE_BLOCKS + 2))
+        writer = Mp3StreamWriter(sink, frame_rate, channels, bitrate_kbps) if format == 'mp3' else RawStreamWriter(sink)
+        chunk_frames = int(round(RADIO_CHUNK_SECONDS * frame_rate))
+        total_frames = int(round(duration * frame_rate)) if duration else None
+        produced = 0
+        scratch = {}
+        print(f"{Fore.GREEN}📻 On air: {describe_codec(format, bitrate_kbps)}, {frame_rate} Hz{Style.RESET_ALL}")
+        
+        clock = time.monotonic()
+        try:
+            while total_frames is None or produced < total_frames:
+                frames = chunk_frames if total_frames is None else min(chunk_frames, total_frames - produced)
+                start = produced / frame_rate
+                for block in scheduler.advance(start):
+                    cache.prefetch(block)
+                samples = render_plan_window(scheduler.plan, start, (produced + frames) / frame_rate, cache, scratch)
+                writer.write(samples.tobytes())
+                produced += frames
+                if sink.closed:
+                    print(f"{Fore.YELLOW}📻 Listener closed the stream after {produced / frame_rate:.0f}s{Style.RESET_ALL}")
+                    break
+                if not realtime:
+                    continue
+                # Stay RADIO_LEAD_SECONDS ahead of the wall clock
+                ahead = clock + produced / frame_rate - RADIO_LEAD_SECONDS - time.monotonic()
+                if ahead > 0:
+                    time.sleep(ahead)
+                elif ahead < -RADIO_RESYNC_SECONDS:
+                    print(f"{Fore.YELLOW}⚠️  Stream fell {-ahead:.1f}s behind real time, resynchronizing{Style.RESET_ALL}")
+                    clock = time.monotonic() - produced / frame_rate + RADIO_LEAD_SECONDS
+            return True
+        except RuntimeError as e:
+            print(f"{Fore.RED}❌ Radio stopped: {e}{Style.RESET_ALL}")
+            return False
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+            cache.close()
+            sink.close()
+
+# ============================================================================
+# FINGERPRINT INDEX (near-duplicate blocks by band-energy hash)
+# ============================================================================
+
+FINGERPRINT_INDEX_FILE = "block_fingerprints.json"
+FINGERPRINT_SEGMENTS = 9       # time slices of a block; neighbouring slices give 8 rows of bits
+FINGERPRINT_BANDS = 9          # log-spaced bands between the edges below; neighbouring bands give 8 columns
+FINGERPRINT_LOW_HZ = 300.0
+FINGERPRINT_HIGH_HZ = 5000.0
+FINGERPRINT_FFT_SIZE = 4096
+FINGERPRINT_MAX_DISTANCE = 6   # fingerprints this many bits apart (of 64) or closer are near-duplicates
+FINGERPRINT_TABLES = 4         # LSH tables, one per 16-bit quarter of the fingerprint
+FINGERPRINT_INDEX_REACH = 2 * FINGERPRINT_TABLES - 1   # distances the LSH lookup is guaranteed to find
+SKIP_DUPLICATES = False        # leave near-duplicates out of sequences and the catalog (--skip-duplicates)
+
+def set_duplicate_policy(skip=False):
+    """Skip near-duplicate blocks when sequencing and syncing the catalog for this run"""
+    global SKIP_DUPLICATES
+    SKIP_DUPLICATES = bool(skip)
+
+def audio_fingerprint(samples, frame_rate, channels):
+    """
+    64-bit fingerprint of int16 samples as 16 hex digits, or None for audio too
+    short to fingerprint. The block is cut into FINGERPRINT_SEGMENTS slices and
+    the mean power spectrum of each is summed into log-spaced bands; every bit is
+    the sign of the energy difference of two neighbouring bands, minus the same
+    difference one slice earlier. Taken in dB, both differences cancel gain, fades
+    and normalization, and codec noise rarely flips a sign.
+    """
+    mono = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1, dtype=np.float32)
+    size = FINGERPRINT_FFT_SIZE
+    per_segment = len(mono) // (FINGERPRINT_SEGMENTS * size)
+    if not per_segment:
+        return None
+    frames = mono[:FINGERPRINT_SEGMENTS * per_segment * size].reshape(FINGERPRINT_SEGMENTS, per_segment, size)
+    power = (np.abs(np.fft.rfft(frames * np.hanning(size).astype(np.float32), axis=2)) ** 2).mean(axis=1)
+    
+    high = min(FINGERPRINT_HIGH_HZ, 0.45 * frame_rate)
+    edges = np.round(np.geomspace(FINGERPRINT_LOW_HZ, high, FINGERPRINT_BANDS + 1) * size / frame_rate).astype(int)
+    # At least one FFT bin per band, whatever the sample rate
+    edges = np.maximum(edges, edges[0] + np.arange(len(edges)))
+    energy = np.add.reduceat(power[:, :edges[-1]], edges[:-1], axis=1)
+    level = np.log10(energy + 1e-12)
+    band_difference = level[:, :-1] - level[:, 1:]
+    bits = (band_difference[1:] - band_difference[:-1]) > 0
+    return np.packbits(bits.ravel()).tobytes().hex()
+
+def segment_fingerprint(segment):
+    """audio_fingerprint of an AudioSegment"""
+    samples = np.frombuffer(segment.set_sample_width(2).raw_data, dtype=np.int16)
+    return audio_fingerprint(samples, segment.frame_rate, segment.channels)
+
+def fingerprint_distance(first, second):
+    """Number of differing bits between two fingerprints"""
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+class FingerprintIndex:
+    """
+    Near-neighbour search over fingerprints (LSH on bit slices): each of the
+    FINGERPRINT_TABLES tables buckets the fingerprints by one 16-bit quarter.
+    A query looks up its own quarters and every quarter one bit away, so by the
+    pigeonhole principle every fingerprint within FINGERPRINT_INDEX_REACH (7)
+    bits is a candidate; only candidates are compared bit by bit. A lookup
+    touches a few dozen buckets, whatever the size of the library. Wider
+    queries compare every indexed fingerprint instead, so they miss nothing.
+    """
+    
+    def __init__(self, fingerprints=None):
+        self.fingerprints = {}
+        self.tables = [{} for _ in range(FINGERPRINT_TABLES)]
+        for name, fingerprint in (fingerprints or {}).items():
+            self.add(name, fingerprint)
+    
+    def __len__(self):
+        return len(self.fingerprints)
+    
+    @staticmethod
+    def _quarters(value):
+        width = 64 // FINGERPRINT_TABLES
+        mask = (1 << width) - 1
+        return [(value >> (width * table)) & mask for table in range(FINGERPRINT_TABLES)]
+    
+    def add(self, name, fingerprint):
+        if not fingerprint:
+            return
+        value = int(fingerprint, 16)
+        self.fingerprints[name] = value
+        for table, key in zip(self.tables, self._quarters(value)):
+            table.setdefault(key, []).append(name)
+    
+    def query(self, fingerprint, max_distance=None):
+        """[(distance, name)] of the indexed fingerprints within max_distance bits (default FINGERPRINT_MAX_DISTANCE), closest first"""
+        if max_distance is None:
+            max_distance = FINGERPRINT_MAX_DISTANCE
+        value = int(fingerprint, 16)
+        width = 64 // FINGERPRINT_TABLES
+        if max_distance > FINGERPRINT_INDEX_REACH:
+            candidates = self.fingerprints
+        else:
+            candidates = set()
+            for table, key in zip(self.tables, self._quarters(value)):
+                for probe in [key] + [key ^ (1 << bit) for bit in range(width)]:
+                    candidates.update(table.get(probe, ()))
+        matches = []
+        for name in candidates:
+            distance = bin(self.fingerprints[name] ^ value).count('1')
+            if distance <= max_distance:
+                matches.append((distance, name))
+        return sorted(matches)
+
+def load_fingerprint_index(blocks_dir):
+    """Cached block fingerprints of a folder: {filename: {'fingerprint', 'mtime', 'size'}}"""
+    try:
+        with open(os.path.join(blocks_dir, FINGERPRINT_INDEX_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_fingerprint_index(blocks_dir, index):
+    index_path = os.path.join(blocks_dir, FINGERPRINT_INDEX_FILE)
+    temp_path = index_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+    except OSError as e:
+        print(f"{Fore.YELLOW}⚠️  Could not save fingerprint index: {e}{Style.RESET_ALL}")
+
+@traced('fingerprints')
+def block_fingerprints(blocks_dir, filenames):
+    """
+    {filename: fingerprint} for blocks of a folder: from the folder's index while
+    a file's mtime and size match, else from the block's metadata (written at
+    slice time), else by decoding the block. Missing files and blocks too short
+    to fingerprint are left out.
+    """
+    index = load_fingerprint_index(blocks_dir)
+    fingerprints = {}
+    changed = False
+    for filename in dict.fromkeys(filenames):
+        path = block_path(blocks_dir, filename)
+        try:
+            stat = block_stat(blocks_dir, filename)
+        except OSError:
+            continue
+        cached = index.get(filename)
+        if cached and cached.get('mtime') == stat.st_mtime and cached.get('size') == stat.st_size:
+            fingerprint = cached['fingerprint']
+        else:
+            metadata = read_audio_metadata(path) or {}
+            fingerprint = metadata.get('fingerprint')
+            if not fingerprint:
+                try:
+                    fingerprint = segment_fingerprint(load_audio_file(path))
+                except Exception as e:
+                    print(f"{Fore.YELLOW}⚠️  Could not fingerprint {filename}: {e}{Style.RESET_ALL}")
+                    continue
+            index[filename] = {'fingerprint': fingerprint, 'mtime': stat.st_mtime, 'size': stat.st_size}
+            changed = True
+        if fingerprint:
+            fingerprints[filename] = fingerprint
+    if changed:
+        save_fingerprint_index(blocks_dir, index)
+    return fingerprints
+
+def find_duplicate_blocks(blocks_dir, filenames, fingerprints=None, max_distance=None):
+    """
+    {duplicate: original} for blocks that are near-duplicates of one listed
+    before them (the original is the first block of its group, so the oldest
+    when filenames are in ID order). fingerprints: from block_fingerprints, if
+    already known.
+    """
+    if fingerprints is None:
+        fingerprints = block_fingerprints(blocks_dir, filenames)
+    index = FingerprintIndex()
+    duplicates = {}
+    for filename in filenames:
+        fingerprint = fingerprints.get(filename)
+        if not fingerprint:
+            continue
+        matches = index.query(fingerprint, max_distance)
+        if matches:
+            duplicates[filename] = matches[0][1]
+        else:
+            index.add(filename, fingerprint)
+    return duplicates
+
+# ============================================================================
+# BLOCK USAGE HISTORY (rotation across sequences)
+# ============================================================================
+# Every exported or rendered sequence (and every block radio schedules) is
+# logged per folder in an SQLite file. The last_use table keeps one row per
+# block that ever played, so rotation reads it with a single query instead of
+# going through the log or old timeline files.
+
+USAGE_DB_FILE = "block_usage.sqlite"
+ROTATION_MODES = ('lru', 'weighted')
+ROTATION = None                # None: plain shuffle; 'lru': least recently used first; 'weighted': random, favouring blocks unused longest
+ROTATION_MAX_AGE_DAYS = 30.0   # weighted: blocks unused this long (or never used) get the full weight
+
+def set_rotation(mode=None):
+    """Order sequence candidates by usage history for this run (one of ROTATION_MODES, None: plain shuffle)"""
+    global ROTATION
+    if mode is not None and mode not in ROTATION_MODES:
+        raise ValueError(f"unknown rotation '{mode}' (expected one of {', '.join(ROTATION_MODES)})")
+    ROTATION = mode
+
+def open_usage_store(blocks_dir):
+    """Connection to the folder's usage log, created on first use"""
+    import sqlite3
+    connection = sqlite3.connect(os.path.join(blocks_dir, USAGE_DB_FILE), timeout=30)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS usage (block TEXT NOT NULL, sequence TEXT NOT NULL, used REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS usage_by_block ON usage (block, used);
+        CREATE TABLE IF NOT EXISTS last_use (block TEXT PRIMARY KEY, used REAL NOT NULL, uses INTEGER NOT NULL) WITHOUT ROWID;
+    """)
+    return connection
+
+@traced('usage')
+def record_block_usage(blocks_dir, sequence, blocks, used=None):
+    """
+    Log that blocks (filenames) played in sequence (a name, e.g. the output
+    file) at used (epoch seconds, default now). Returns True on success.
+    """
+    import sqlite3
+    import time
+    from contextlib import closing
+    blocks = list(blocks)
+    if not blocks:
+        return True
+    used = time.time() if used is None else used
+    try:
+        with closing(open_usage_store(blocks_dir)) as connection, connection:
+            connection.executemany("INSERT INTO usage VALUES (?, ?, ?)", [(block, sequence, used) for block in blocks])
+            connection.executemany("""
+                INSERT INTO last_use VALUES (?, ?, 1)
+                ON CONFLICT (block) DO UPDATE SET used = max(used, excluded.used), uses = uses + 1
+            """, [(block, used) for block in blocks])
+        return True
+    except (sqlite3.Error, OSError) as e:
+        print(f"{Fore.YELLOW}⚠️  Could not record block usage: {e}{Style.RESET_ALL}")
+        return False
+
+def block_last_used(blocks_dir):
+    """{filename: (last used, epoch seconds; times used)} for every block of a folder that ever played"""
+    import sqlite3
+    from contextlib import closing
+    if not os.path.exists(os.path.join(blocks_dir, USAGE_DB_FILE)):
+        return {}
+    try:
+        with closing(open_usage_store(blocks_dir)) as connection:
+            return {block: (used, uses) for block, used, uses in connection.execute("SELECT block, used, uses FROM last_use")}
+    except sqlite3.Error as e:
+        print(f"{Fore.YELLOW}⚠️  Could not read block usage: {e}{Style.RESET_ALL}")
+        return {}
+
+def block_usage_history(blocks_dir, block, limit=20):
+    """[(sequence, used)] of the last limit times a block played, newest first"""
+    from contextlib import closing
+    if not os.path.exists(os.path.join(blocks_dir, USAGE_DB_FILE)):
+        return []
+    with closing(open_usage_store(blocks_dir)) as connection:
+        return connection.execute("SELECT sequence, used FROM usage WHERE block = ? ORDER BY used DESC LIMIT ?",
+                                  (block, limit)).fetchall()
+
+def rotate_blocks(blocks, last_used, rng=None, mode=None, now=None):
+    """
+    Shuffled blocks reordered by their usage (last_used from block_last_used).
+    lru: never used first, then oldest use first; the shuffle breaks ties.
+    weighted: a weighted random order (one key rng.random() ** (1 / weight) per
+    block, largest first) where weight grows by one per day since the last use,
+    up to ROTATION_MAX_AGE_DAYS, so recent blocks are rare but not banned.
+    """
+    import time
+    rng = rng or random
+    mode = mode or ROTATION
+    if mode == 'lru':
+        return sorted(blocks, key=lambda block: last_used[block][0] if block in last_used else 0.0)
+    now = time.time() if now is None else now
+    max_age = ROTATION_MAX_AGE_DAYS * 86400
+    
+    def key(block):
+        age = min(now - last_used[block][0], max_age) if block in last_used else max_age
+        return rng.random() ** (1.0 / (1.0 + max(age, 0.0) / 86400))
+    return sorted(blocks, key=key, reverse=True)
+
+# ============================================================================
+# BLOCK QUERY INDEX (words and attributes of the catalog, searchable in SQLite)
+# ============================================================================
+# One row per block (type, origin, description, duration, loudness, climax)
+# plus an inverted index of the words of its description and origin, kept in
+# blocks/block_catalog.sqlite and updated as blocks are cataloged. Queries are
+# written as words and field filters, e.g.
+#     type:v origin:"morning show" weather duration>=25 loudness<-18
+
+QUERY_INDEX_FILE = "block_catalog.sqlite"
+QUERY_NUMERIC_FIELDS = ('duration', 'loudness', 'climax')
+POOL_QUERY = None              # parsed query narrowing the sequencer's pools (--pool); None: every block
+
+def set_pool_query(text=None):
+    """Sequence only blocks matching a query (see parse_block_query) for this run; raises ValueError on a bad query"""
+    global POOL_QUERY
+    POOL_QUERY = parse_block_query(text) if text else None
+
+def query_terms(text):
+    """Lower-case words of a text, as indexed"""
+    import re
+    return re.findall(r"[^\W_]+", (text or '').lower())
+
+def parse_block_query(text):
+    """
+    Parse a block query. Bare words must all appear in the description (word*
+    matches a prefix); type:vj keeps those types; origin:NAME needs every word
+    of NAME in the origin file; duration, loudness (dBFS RMS) and climax (seconds
+    into the source) compare with <, <=, >, >= or =. Quote values with spaces.
+    """
+    import re
+    import shlex
+    query = {'types': None, 'terms': [], 'ranges': []}
+    for part in shlex.split(text):
+        comparison = re.fullmatch(r'(\w+)(<=|>=|<|>|=)(-?\d+(?:\.\d*)?)', part)
+        field, _, value = part.partition(':')
+        if comparison:
+            if comparison.group(1) not in QUERY_NUMERIC_FIELDS:
+                raise ValueError(f"unknown query field '{comparison.group(1)}' (expected one of {', '.join(QUERY_NUMERIC_FIELDS)})")
+            query['ranges'].append((comparison.group(1), comparison.group(2), float(comparison.group(3))))
+        elif value and field == 'type':
+            if not set(value) <= set('mvj'):
+                raise ValueError(f"unknown block type in '{part}' (expected m, v or j)")
+            query['types'] = ''.join(sorted(set(value)))
+        elif value and field == 'origin':
+            query['terms'].extend(('origin', term, False) for term in query_terms(value))
+        elif value and re.fullmatch(r'\w+', field):
+            raise ValueError(f"unknown query field '{field}' (expected type, origin or a comparison)")
+        else:
+            prefix = part.endswith('*')
+            query['terms'].extend(('description', term, prefix) for term in query_terms(part))
+    return query
+
+def open_query_index(blocks_dir):
+    """Connection to the folder's query index, created on first use"""
+    import sqlite3
+    connection = sqlite3.connect(os.path.join(blocks_dir, QUERY_INDEX_FILE), timeout=30)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS blocks (file TEXT PRIMARY KEY, type TEXT, origin TEXT, description TEXT,
+                                           duration REAL, loudness REAL, climax REAL, mtime REAL, size INTEGER);
+        CREATE INDEX IF NOT EXISTS blocks_by_type ON blocks (type, duration);
+        CREATE TABLE IF NOT EXISTS terms (term TEXT NOT NULL, file TEXT NOT NULL, PRIMARY KEY (term, file)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS terms_by_file ON terms (file);
+    """)
+    return connection
+
+def _block_query_row(blocks_dir, filename, stat, durations, loudness_index):
+    """(blocks row, terms) of one block from its metadata and the folder's duration and loudness indexes"""
+    metadata = read_audio_metadata(block_path(blocks_dir, filename)) or {}
+    origin = metadata.get('origin') or ''
+    description = metadata.get('description') or ''
+    try:
+        climax = float(metadata.get('climax_time'))
+    except (TypeError, ValueError):
+        climax = None
+    loudness = None
+    stats = loudness_index.get(filename)
+    if stats and stats.get('mtime') == stat.st_mtime and stats.get('size') == stat.st_size and stats['active']:
+        loudness = float(power_to_dbfs(stats['power']))
+    row = (filename, metadata.get('audio_type') or filename[0], origin, description,
+           durations.get(filename), loudness, climax, stat.st_mtime, stat.st_size)
+    origin_name = os.path.splitext(os.path.basename(origin.replace('\\', '/')))[0]
+    terms = {f"description:{term}" for term in query_terms(description)} | {f"origin:{term}" for term in query_terms(origin_name)}
+    return row, terms
+
+@traced('query index')
+def index_block_attributes(blocks_dir, filenames, refresh=True, prune=False):
+    """
+    Add blocks to the folder's query index, reading their metadata once. refresh:
+    also re-read indexed blocks whose mtime or size changed (False: only add the
+    ones not indexed yet, without a stat per block). prune: drop the rows of
+    blocks not in filenames. Returns the number of blocks (re)indexed.
+    """
+    import sqlite3
+    from contextlib import closing
+    try:
+        with closing(open_query_index(blocks_dir)) as connection, connection:
+            known = {}
+            unmeasured = set()
+            for file, mtime, size, loudness in connection.execute("SELECT file, mtime, size, loudness FROM blocks"):
+                known[file] = (mtime, size)
+                if loudness is None:
+                    unmeasured.add(file)
+            loudness_index = load_loudness_index(blocks_dir) if refresh and unmeasured else None
+            changed = []
+            for filename in dict.fromkeys(filenames):
+                if filename in known and not refresh:
+                    continue
+                try:
+                    stat = block_stat(blocks_dir, filename)
+                except OSError:
+                    continue
+                # Unchanged rows are re-read too once their block has been measured since (see block_loudness)
+                stats = loudness_index.get(filename) if filename in unmeasured else None
+                measured_since = bool(stats and stats['active'] and (stats.get('mtime'), stats.get('size')) == (stat.st_mtime, stat.st_size))
+                if known.get(filename) != (stat.st_mtime, stat.st_size) or measured_since:
+                    changed.append((filename, stat))
+            
+            if changed:
+                durations = block_durations(blocks_dir, [filename for filename, _ in changed])
+                loudness_index = loudness_index if loudness_index is not None else load_loudness_index(blocks_dir)
+                for filename, stat in changed:
+                    row, terms = _block_query_row(blocks_dir, filename, stat, durations, loudness_index)
+                    connection.execute("DELETE FROM terms WHERE file = ?", (filename,))
+                    connection.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                    connection.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?)", [(term, filename) for term in terms])
+            if prune:
+                gone = [(filename,) for filename in set(known) - set(filenames)]
+                connection.executemany("DELETE FROM terms WHERE file = ?", gone)
+                connection.executemany("DELETE FROM blocks WHERE file = ?", gone)
+        return len(changed)
+    except (sqlite3.Error, OSError) as e:
+        print(f"{Fore.YELLOW}⚠️  Could not update the query index: {e}{Style.RESET_ALL}")
+        return 0
+
+@traced('query')
+def query_blocks(blocks_dir, query, limit=None):
+    """
+    Indexed blocks matching a query (text or parse_block_query result), in ID
+    order, as dicts with file, type, origin, description, duration, loudness and
+    climax. The rarest word drives the search through the terms index and every
+    other condition is checked per match, so the cost follows the number of
+    matches, not the size of the library.
+    """
+    import sqlite3
+    from contextlib import closing
+    if isinstance(query, str):
+        query = parse_block_query(query)
+    
+    def term_range(field, term, prefix):
+        return (f"{field}:{term}", f"{field}:{term}\uffff") if prefix else (f"{field}:{term}",)
+    
+    columns = ('file', 'type', 'origin', 'description', 'duration', 'loudness', 'climax')
+    try:
+        with closing(open_query_index(blocks_dir)) as connection:
+            terms = list(dict.fromkeys(query['terms']))
+            driver = None
+            exact = [term for term in terms if not term[2]]
+            if exact:
+                counts = {term: connection.execute("SELECT count(*) FROM terms WHERE term = ?", term_range(*term)).fetchone()[0]
+                          for term in exact}
+                driver = min(exact, key=counts.get)
+                if not counts[driver]:
+                    return []
+            elif terms:
+                driver = terms[0]
+            
+            clauses, params = [], []
+            source = "blocks b"
+            if driver:
+                # CROSS JOIN keeps the terms index as the outer loop
+                source = "terms t CROSS JOIN blocks b ON b.file = t.file"
+                clauses.append("t.term >= ? AND t.term < ?" if driver[2] else "t.term = ?")
+                params.extend(term_range(*driver))
+            if query['types']:
+                clauses.append(f"b.type IN ({', '.join('?' * len(query['types']))})")
+                params.extend(query['types'])
+            for field, operator, value in query['ranges']:
+                # field and operator come from fixed lists (parse_block_query)
+                clauses.append(f"b.{field} {operator} ?")
+                params.append(value)
+            for term in terms:
+                if term != driver:
+                    condition = "term >= ? AND term < ?" if term[2] else "term = ?"
+                    clauses.append(f"EXISTS (SELECT 1 FROM terms WHERE {condition} AND file = b.file)")
+                    params.extend(term_range(*term))
+            
+            sql = f"SELECT DISTINCT {', '.join('b.' + column for column in columns)} FROM {source}"
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += " ORDER BY b.file"
+            if limit:
+                sql += f" LIMIT {int(limit)}"
+            return [dict(zip(columns, row)) for row in connection.execute(sql, params)]
+    except sqlite3.Error as e:
+        print(f"{Fore.YELLOW}⚠️  Could not query the block index: {e}{Style.RESET_ALL}")
+        return []
+
+def filter_block_pools(blocks_dir, query, m_blocks, v_blocks, j_blocks):
+    """
+    (m, v, j) pools narrowed to the blocks matching query. Only the types the
+    query names are narrowed (all of them when it names none), so a voice-only
+    query still leaves the music pool whole. Blocks not indexed yet are indexed first.
+    """
+    index_block_attributes(blocks_dir, m_blocks + v_blocks + j_blocks, refresh=False)
+    matches = {row['file'] for row in query_blocks(blocks_dir, query)}
+    narrowed = query['types'] or 'mvj'
+    pools = []
+    for block_type, blocks in (('m', m_blocks), ('v', v_blocks), ('j', j_blocks)):
+        pools.append([block for block in blocks if block in matches] if block_type in narrowed else blocks)
+    return tuple(pools)
+
+# ============================================================================
+# SHARDED BLOCKS LAYOUT (blocks/<type>/<yyyymm>/ for very large libraries)
+# ============================================================================
+# Listing one flat folder of 100k+ blocks is slow, most of all on network
+# filesystems. A folder whose blocks_layout.json says "sharded" keeps every
+# block under <type>/<yyyymm>/ taken from its ID instead (m2025031412000000.mp3
+# lives in m/202503/). Blocks are still named by filename everywhere (catalog,
+# plans, indexes, usage log): block_path() resolves a name to wherever the file
+# is, and scan_block_entries() walks the folder with os.scandir and keeps the
+# DirEntry of every block, so the stat-keyed caches reuse its stat.
+
+BLOCKS_LAYOUT_FILE = "blocks_layout.json"
+BLOCK_LAYOUTS = ('flat', 'sharded')
+SHARD_OTHER = 'other'          # shard for blocks whose name has no yyyymm ID
+
+_FOLDER_LAYOUTS = {}           # blocks_dir -> layout, read once per process
+_BLOCK_ENTRIES = {}            # blocks_dir -> {filename: os.DirEntry} from its last scan
+
+def blocks_layout(blocks_dir):
+    """'sharded' when the folder's blocks_layout.json says so, else 'flat' (read once per process)"""
+    layout = _FOLDER_LAYOUTS.get(blocks_dir)
+    if layout is None:
+        try:
+            with open(os.path.join(blocks_dir, BLOCKS_LAYOUT_FILE), 'r', encoding='utf-8') as f:
+                layout = json.load(f).get('layout')
+        except (OSError, ValueError, AttributeError):
+            layout = None
+        layout = _FOLDER_LAYOUTS[blocks_dir] = layout if layout in BLOCK_LAYOUTS else 'flat'
+    return layout
+
+def save_blocks_layout(blocks_dir, layout):
+    """Record the folder's layout (atomically, like the other per-folder files)"""
+    layout_path = os.path.join(blocks_dir, BLOCKS_LAYOUT_FILE)
+    temp_path = layout_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'layout': layout}, f)
+    os.replace(temp_path, layout_path)
+    _FOLDER_LAYOUTS[blocks_dir] = layout
+
+def block_shard(filename):
+    """m2025031412000000.mp3 -> m/202503, the folder a block lives in when sharded"""
+    month = filename[1:7]
+    return os.path.join(filename[:1], month if len(month) == 6 and month.isdigit() else SHARD_OTHER)
+
+def block_path(blocks_dir, filename):
+    """
+    Path of a block of a folder. Sharded folders look in the block's shard, then
+    at the top (a block left there by an older version or an interrupted
+    migration); a block found in neither gets its shard path, where it is written.
+    """
+    if blocks_layout(blocks_dir) == 'flat':
+        return os.path.join(blocks_dir, filename)
+    entry = _BLOCK_ENTRIES.get(blocks_dir, {}).get(filename)
+    if entry is not None:
+        return entry.path
+    sharded = os.path.join(blocks_dir, block_shard(filename), filename)
+    flat = os.path.join(blocks_dir, filename)
+    return flat if not os.path.exists(sharded) and os.path.exists(flat) else sharded
+
+def block_folder(file_path):
+    """
+    The blocks folder a file belongs to, for its per-folder caches: the folder
+    above its shard when it sits in the shard of a sharded folder, else its own folder
+    """
+    folder = os.path.dirname(file_path) or '.'
+    shard = block_shard(os.path.basename(file_path))
+    normalized = os.path.normpath(folder)
+    if normalized == shard or normalized.endswith(os.sep + shard):
+        parent = os.path.dirname(os.path.dirname(normalized)) or '.'
+        if blocks_layout(parent) == 'sharded':
+            return parent
+    return folder
+
+def scan_block_entries(blocks_dir):
+    """
+    {filename: os.DirEntry} of every block of a folder, flat or sharded, from one
+    os.scandir pass per directory. The entries are kept for block_path and
+    block_stat until the folder is scanned again.
+    """
+    sharded = blocks_layout(blocks_dir) == 'sharded'
+    entries = {}
+    
+    def visit(folder, depth):
+        with os.scandir(folder) as scan:
+            for entry in scan:
+                if is_block_file(entry.name):
+                    # A block both in its shard and at the top resolves to the shard, as in block_path
+                    if depth:
+                        entries[entry.name] = entry
+                    else:
+                        entries.setdefault(entry.name, entry)
+                elif sharded and depth < 2 and (depth or entry.name in ('m', 'v', 'j')) and entry.is_dir():
+                    visit(entry.path, depth + 1)
+    
+    try:
+        visit(blocks_dir, 0)
+    except FileNotFoundError:
+        pass
+    _BLOCK_ENTRIES[blocks_dir] = entries
+    return entries
+
+def block_stat(blocks_dir, filename):
+    """os.stat of a block, from its DirEntry when the folder was scanned (raises OSError when missing)"""
+    entry = _BLOCK_ENTRIES.get(blocks_dir, {}).get(filename)
+    if entry is not None:
+        return entry.stat()
+    return os.stat(block_path(blocks_dir, filename))
+
+def forget_block_entries(paths):
+    """Drop the scanned entries of files that were just rewritten, so their new stat is read"""
+    for path in paths:
+        filename = os.path.basename(path)
+        for entries in _BLOCK_ENTRIES.values():
+            entries.pop(filename, None)
+
+def migrate_blocks_layout(blocks_dir, layout):
+    """
+    Move every block of a folder, with its metadata sidecar, into layout ('flat'
+    or 'sharded'). The folder is marked sharded before anything moves and flat
+    only once everything has, so block_path finds every block while a migration
+    runs and after one is interrupted (running it again finishes the job).
+    Files keep their mtime and size, so none of the folder's caches go stale.
+    Returns the number of blocks moved.
+    """
+    if layout not in BLOCK_LAYOUTS:
+        raise ValueError(f"unknown layout '{layout}' (expected one of {', '.join(BLOCK_LAYOUTS)})")
+    if layout == 'sharded':
+        save_blocks_layout(blocks_dir, layout)
+    else:
+        # Scan the shards too, whatever the folder says now
+        _FOLDER_LAYOUTS[blocks_dir] = 'sharded'
+    
+    moved = 0
+    created = set()
+    for filename, entry in scan_block_entries(blocks_dir).items():
+        target_dir = os.path.join(blocks_dir, block_shard(filename)) if layout == 'sharded' else blocks_dir
+        target = os.path.join(target_dir, filename)
+        if entry.path == target:
+            continue
+        if target_dir not in created:
+            os.makedirs(target_dir, exist_ok=True)
+            created.add(target_dir)
+        sidecar = metadata_sidecar_path(entry.path)
+        if os.path.exists(sidecar):
+            os.replace(sidecar, metadata_sidecar_path(target))
+        os.replace(entry.path, target)
+        moved += 1
+    _BLOCK_ENTRIES.pop(blocks_dir, None)
+    
+    if layout == 'flat':
+        save_blocks_layout(blocks_dir, layout)
+        for block_type in ('m', 'v', 'j'):
+            for folder, _, _ in os.walk(os.path.join(blocks_dir, block_type), topdown=False):
+                try:
+                    os.rmdir(folder)  # only succeeds on the (now empty) shard folders
+                except OSError:
+                    pass
+    return moved
+
+# ============================================================================
+# HEADLESS COMMAND LINE INTERFACE
+# ============================================================================
+
+def apply_slice_settings(slice_size=None, fade_duration=None):
+    """Override the hardcoded slice parameters for this run"""
+    global SLICE_SIZE, FADE_DURATION
+    if slice_size is not None:
+        SLICE_SIZE = slice_size
+        FADE_DURATION = SLICE_SIZE / 2
+    if fade_duration is not None:
+        FADE_DURATION = fade_duration
+
+def _cli_excel_path(args):
+    """Catalog path from --excel, defaulting to blocks_list.xlsx in the blocks folder"""
+    return args.excel or os.path.join(args.blocks_dir, "blocks_list.xlsx")
+
+def _cli_slice(args):
+    """slice: cut blocks at the labels of an Audacity label file"""
+    os.makedirs(args.output, exist_ok=True)
+    return 0 if slice_audio_from_labels(args.audio, args.output, args.labels) else 1
+
+def _cli_random_slice(args):
+    """random-slice: cut randomly placed blocks, optionally sequencing them"""
+    if not os.path.exists(args.audio):
+        print(f"{Fore.RED}❌ Error: Audio file not found: {args.audio}{Style.RESET_ALL}")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+    
+    try:
+        audio, audio_duration_seconds = load_source_audio(args.audio)
+    except Exception as e:
+        print(f"{Fore.RED}❌ Error loading audio file: {e}{Style.RESET_ALL}")
+        return 1
+    pyramid = get_peak_pyramid(args.audio, audio)
+    
+    if args.minutes is not None:
+        max_minutes = calculate_max_possible_minutes(audio_duration_seconds)
+        if args.minutes <= 0 or args.minutes > max_minutes:
+            print(f"{Fore.RED}❌ Cannot generate {args.minutes:.1f} minutes. Maximum possible is {max_minutes:.1f} minutes{Style.RESET_ALL}")
+            return 1
+        slices = generate_balanced_random_slices(audio_duration_seconds, args.minutes, pyramid=pyramid)
+    else:
+        slices = generate_random_labels(args.audio)
+    
+    if not slices:
+        print(f"{Fore.RED}❌ Could not generate valid slices{Style.RESET_ALL}")
+        return 1
+    
+    print(f"\n{Fore.CYAN}Processing slices...{Style.RESET_ALL}")
+    created = [process_audio_slice_mp3(audio, slice_info, args.output, args.audio) for slice_info in slices]
+    index_new_blocks(args.output, created)
+    verify_files_vs_excel(args.output, os.path.join(args.output, "blocks_list.xlsx"))
+    
+    if args.sequence:
+        success, final_audio, blocks_info = create_sequence_from_blocks(args.output, args.minutes, fix_problematic=args.fix)
+        if not success or not export_sequence(final_audio, args.sequence, blocks_info):
+            return 1
+    return 0
+
+def _cli_sequence(args):
+    """sequence: mix existing blocks into one output file"""
+    m_blocks, v_blocks, j_blocks = scan_available_blocks(args.blocks_dir)
+    if not validate_sequence_requirements(m_blocks, v_blocks, j_blocks):
+        return 1
+    
+    max_minutes = max_sequence_minutes(args.blocks_dir, m_blocks, v_blocks, j_blocks)
+    if args.minutes is not None and (args.minutes <= 0 or args.minutes > max_minutes + SEQUENCE_DURATION_TOLERANCE / 60):
+        print(f"{Fore.RED}❌ Cannot create {args.minutes:.1f} minutes. Maximum possible is {max_minutes:.1f} minutes{Style.RESET_ALL}")
+        return 1
+    
+    success, final_audio, blocks_info = create_sequence_from_blocks(args.blocks_dir, args.minutes, fix_problematic=args.fix,
+                                                                    workers=args.jobs, seed=args.seed, tolerance=args.tolerance)
+    if not success:
+        print(f"{Fore.RED}❌ Sequencing failed{Style.RESET_ALL}")
+        return 1
+    return 0 if export_sequence(final_audio, args.output, blocks_info) else 1
+
+def _cli_plan(args):
+    """plan: choose a sequence and save it as a plan file, without rendering"""
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    selection = select_sequence_blocks(args.blocks_dir, args.minutes, fix_problematic=args.fix, rng=random.Random(seed),
+                                       tolerance=args.tolerance)
+    if not selection:
+        return 1
+    plan = create_lane_plan(args.blocks_dir, selection, seed=seed)
+    return 0 if save_sequence_plan(plan, args.output) else 1
+
+def _cli_render(args):
+    """render: render a plan file, reusing the render cache"""
+    try:
+        plan = load_sequence_plan(args.plan)
+    except (OSError, ValueError) as e:
+        print(f"{Fore.RED}❌ Error loading plan: {e}{Style.RESET_ALL}")
+        return 1
+    return 0 if render_plan(plan, args.output, args.blocks_dir, args.jobs, use_cache=not args.no_cache) else 1
+
+def _cli_preview(args):
+    """preview: render one time window of a plan"""
+    import time
+    try:
+        plan = load_sequence_plan(args.plan)
+        started = time.perf_counter()
+        audio = render_plan_range(plan, parse_timestamp(args.start), parse_timestamp(args.end), args.blocks_dir)
+        elapsed = time.perf_counter() - started
+        write_audio(audio, args.output, codec=sequence_codec_for(args.output))
+    except (OSError, ValueError, RuntimeError) as e:  # RuntimeError: the encoder failed
+        print(f"{Fore.RED}❌ Error rendering preview: {e}{Style.RESET_ALL}")
+        return 1
+    print(f"{Fore.GREEN}✅ Preview saved: {args.output} ({len(audio)/1000:.1f}s, rendered in {elapsed * 1000:.0f} ms){Style.RESET_ALL}")
+    return 0
+
+def _cli_radio(args):
+    """radio: stream the blocks folder endlessly in real time"""
+    return 0 if run_radio(args.blocks_dir, args.output, args.format, parse_bitrate_kbps(args.bitrate), args.rate,
+                          seed=args.seed, duration=args.duration, realtime=not args.no_realtime) else 1
+
+def _cli_batch(args):
+    """batch: slice many sources from a directory or manifest on one worker pool"""
+    return 0 if run_batch_slicer(args.inputs, args.output, args.jobs) else 1
+
+def _cli_watch(args):
+    """watch: keep slicing new recordings dropped into a folder"""
+    return 0 if run_watch_folder(args.raw_dir, args.output, args.interval, args.debounce, args.jobs, args.once) else 1
+
+def _cli_sync_catalog(args):
+    """sync-catalog: rebuild the Excel catalog from the blocks folder"""
+    return 0 if update_excel_from_folder(args.blocks_dir, _cli_excel_path(args)) else 1
+
+def _cli_duplicates(args):
+    """duplicates: list near-duplicate blocks by fingerprint"""
+    m_blocks, v_blocks, j_blocks = scan_available_blocks(args.blocks_dir)
+    all_blocks = m_blocks + v_blocks + j_blocks
+    fingerprints = block_fingerprints(args.blocks_dir, all_blocks)
+    duplicates = find_duplicate_blocks(args.blocks_dir, all_blocks, fingerprints, args.max_distance)
+    if not duplicates:
+        print(f"{Fore.GREEN}✅ No near-duplicates among {len(fingerprints)} blocks{Style.RESET_ALL}")
+        return 0
+    groups = {}
+    for duplicate, original in duplicates.items():
+        groups.setdefault(original, []).append(duplicate)
+    print(f"{Fore.YELLOW}⚠️  {len(duplicates)} near-duplicates of {len(groups)} blocks:{Style.RESET_ALL}")
+    for original, group in groups.items():
+        print(f"   {original}")
+        for duplicate in group:
+            print(f"     ≈ {duplicate} ({fingerprint_distance(fingerprints[original], fingerprints[duplicate])} bits apart)")
+    return 1
+
+def _cli_usage(args):
+    """usage: show how recently and how often blocks played"""
+    from datetime import datetime
+    
+    def when(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+    
+    if args.blocks:
+        for block in args.blocks:
+            history = block_usage_history(args.blocks_dir, block, args.limit)
+            if not history:
+                print(f"{Fore.CYAN}{block}: never played{Style.RESET_ALL}")
+                continue
+            print(f"{Fore.CYAN}{block}: last {len(history)} plays{Style.RESET_ALL}")
+            for sequence, used in history:
+                print(f"   {when(used)}  {sequence}")
+        return 0
+    
+    m_blocks, v_blocks, j_blocks = scan_available_blocks(args.blocks_dir)
+    last_used = block_last_used(args.blocks_dir)
+    for block_type, blocks in (('m', m_blocks), ('v', v_blocks), ('j', j_blocks)):
+        never = [block for block in blocks if block not in last_used]
+        print(f"{Fore.CYAN}--- {block_type}: {len(blocks)} blocks, {len(never)} never played ---{Style.RESET_ALL}")
+        for block in sorted(blocks, key=lambda block: last_used.get(block, (0.0, 0))[0])[:args.limit]:
+            used, uses = last_used.get(block, (None, 0))
+            print(f"   {block}: {when(used) if used else 'never'} ({uses} plays)")
+    return 0
+
+def _cli_find(args):
+    """find: list the blocks matching a query"""
+    import time
+    try:
+        query = parse_block_query(' '.join(args.query))
+    except ValueError as e:
+        print(f"{Fore.RED}❌ {e}{Style.RESET_ALL}")
+        return 2
+    m_blocks, v_blocks, j_blocks = scan_available_blocks(args.blocks_dir)
+    index_block_attributes(args.blocks_dir, m_blocks + v_blocks + j_blocks, refresh=False)
+    started = time.perf_counter()
+    matches = query_blocks(args.blocks_dir, query, args.limit)
+    elapsed = time.perf_counter() - started
+    for block in matches:
+        details = [f"{block['duration']:.1f}s" if block['duration'] is not None else None,
+                   f"{block['loudness']:.1f} dBFS" if block['loudness'] is not None else None,
+                   f"climax {block['climax']:g}s" if block['climax'] is not None else None]
+        print(f"{Fore.GREEN}{block['file']}{Style.RESET_ALL}  {', '.join(d for d in details if d)}")
+        print(f"   {block['description']}  ({block['origin']})")
+    print(f"{Fore.CYAN}{len(matches)} blocks in {elapsed * 1000:.1f} ms{Style.RESET_ALL}")
+    return 0 if matches else 1
+
+def _cli_migrate_layout(args):
+    """migrate-layout: move the blocks of a folder into the flat or sharded layout"""
+    import time
+    if not os.path.isdir(args.blocks_dir):
+        print(f"{Fore.RED}❌ Blocks folder not found: {args.blocks_dir}{Style.RESET_ALL}")
+        return 1
+    started = time.perf_counter()
+    try:
+        moved = migrate_blocks_layout(args.blocks_dir, args.to)
+    except OSError as e:
+        print(f"{Fore.RED}❌ Migration stopped: {e} (run it again to finish){Style.RESET_ALL}")
+        return 1
+    print(f"{Fore.GREEN}✅ {args.blocks_dir} is {args.to}: moved {moved} blocks in {time.perf_counter() - started:.1f}s{Style.RESET_ALL}")
+    return 0
+
+def _cli_verify(args):
+    """verify: compare the blocks folder against the catalog"""
+    synchronized = verify_files_vs_excel(args.blocks_dir, _cli_excel_path(args))
+    if args.metadata:
+        synchronized = verify_audio_metadata(args.blocks_dir) and synchronized
+    if args.audio:
+        m_blocks, v_blocks, j_blocks = scan_available_blocks(args.blocks_dir)
+        _, problematic = check_for_corrupted_files(args.blocks_dir, m_blocks + v_blocks + j_blocks)
+        if problematic:
+            print(f"{Fore.RED}❌ {len(problematic)} unreadable blocks:{Style.RESET_ALL}")
+            for filename, error in problematic:
+                print(f"   - {filename}: {error}")
+            synchronized = False
+        else:
+            print(f"{Fore.GREEN}✅ All {len(m_blocks) + len(v_blocks) + len(j_blocks)} blocks are readable{Style.RESET_ALL}")
+    return 0 if synchronized else 1
+
+def _cli_repair(args):
+    """repair: probe every block and re-encode the unreadable ones in parallel"""
+    if not os.path.isdir(args.blocks_dir):
+        print(f"{Fore.RED}❌ Error: Blocks folder not found: {args.blocks_dir}{Style.RESET_ALL}")
+        return 1
+    return 0 if repair_blocks_folder(args.blocks_dir, args.jobs, args.timeout, args.dry_run) else 1
+
+def _cli_peaks(args):
+    """peaks: build the peak pyramid and answer loudness queries from it"""
+    if not os.path.exists(args.audio):
+        print(f"{Fore.RED}❌ Error: Audio file not found: {args.audio}{Style.RESET_ALL}")
+        return 1
+    pyramid = get_peak_pyramid(args.audio, rebuild=args.rebuild)
+    if not pyramid:
+        return 1
+    print(f"{Fore.GREEN}✅ Peak overview: {get_peak_file_path(args.audio)} ({pyramid['duration']:.1f}s){Style.RESET_ALL}")
+    for timestamp in args.at or []:
+        print(f"   {timestamp}: {format_dbfs(loudness_at(pyramid, timestamp, args.window))} dBFS RMS")
+    if args.labels:
+        audition_labels(args.audio)
+    return 0
+
+def build_arg_parser():
+    """Build the argument parser for headless runs"""
+    parser = argparse.ArgumentParser(
+        description="Audio Slicer & Sequencer. Run without arguments for the interactive menu."
+    )
+    parser.add_argument('--slice-size', type=float, help=f"Slice duration in seconds (default {SLICE_SIZE})")
+    parser.add_argument('--fade', type=float, help="Fade in/out duration in seconds (default: half the slice size)")
+    parser.add_argument('--seed', type=int, help="Random seed for reproducible slicing and sequencing")
+    parser.add_argument('--profile', metavar='PATH', help="Time every stage and write PATH.json (summary) and PATH.trace.json (Chrome trace)")
+    parser.add_argument('--max-memory', type=int, metavar='MB',
+                        help="Memory budget: stream sources and mixes that would not fit, and report RSS high-water marks per stage")
+    parser.add_argument('--block-codec', choices=list(CODECS),
+                        help=f"Format new blocks are written in (default {BLOCK_CODEC}; flac/wav/pcm are lossless and cheap to decode)")
+    parser.add_argument('--sequence-codec', choices=list(CODECS),
+                        help="Format of exported sequences (default: from the output extension, else mp3)")
+    parser.add_argument('--duck', type=float, metavar='DB',
+                        help="Duck music lanes by DB dB under voice/jingle lanes in sequences, plans and radio (default: off)")
+    parser.add_argument('--loudness', type=float, metavar='DBFS',
+                        help="Master sequences and plans to this loudness (unweighted RMS, dBFS) through a true-peak limiter (default: off)")
+    parser.add_argument('--true-peak', type=float, metavar='DBTP',
+                        help=f"True-peak ceiling of the master bus limiter (default {MASTER_CEILING_DBTP:g})")
+    parser.add_argument('--skip-duplicates', action='store_true',
+                        help="Leave near-duplicate blocks (by audio fingerprint) out of sequences, plans and sync-catalog")
+    parser.add_argument('--rotation', choices=ROTATION_MODES,
+                        help="Prefer blocks that played least recently in sequences, plans and radio: lru (strictly) "
+                             "or weighted (random, favouring the longest unplayed) (default: plain shuffle)")
+    parser.add_argument('--pool', metavar='QUERY',
+                        help="Sequence only blocks matching QUERY in sequences and plans, e.g. 'type:v origin:morning weather' "
+                             "(types the query does not name keep every block; see 'find')")
+    parser.add_argument('--lanes', metavar='LAYOUT',
+                        help=f"Lane layout of sequences, plans and radio: {', '.join(LANE_PRESETS)} or a JSON layout file (default {LANE_LAYOUT})")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    slice_parser = subparsers.add_parser('slice', help="Slice an audio file at its Audacity labels")
+    slice_parser.add_argument('audio', help="Source audio file")
+    slice_parser.add_argument('-o', '--output', required=True, help="Output blocks folder")
+    slice_parser.add_argument('--labels', help="Label file (default: <audio>.txt)")
+    slice_parser.set_defaults(handler=_cli_slice)
+    
+    random_parser = subparsers.add_parser('random-slice', help="Slice an audio file at random positions")
+    random_parser.add_argument('audio', help="Source audio file")
+    random_parser.add_argument('-o', '--output', required=True, help="Output blocks folder")
+    random_parser.add_argument('--minutes', type=float, help="Minutes of balanced m/v/j content (default: ~1 slice per 2 minutes)")
+    random_parser.add_argument('--sequence', help="Also sequence the blocks into this file")
+    random_parser.add_argument('--fix', action='store_true', help="Try to repair unreadable blocks before sequencing")
+    random_parser.set_defaults(handler=_cli_random_slice)
+    
+    sequence_parser = subparsers.add_parser('sequence', help="Sequence existing blocks into one file")
+    sequence_parser.add_argument('blocks_dir', help="Blocks folder")
+    sequence_parser.add_argument('-o', '--output', required=True, help="Output sequence file")
+    sequence_parser.add_argument('--minutes', type=float, help="Sequence length in minutes (default: all blocks)")
+    sequence_parser.add_argument('--fix', action='store_true', help="Try to repair unreadable blocks")
+    sequence_parser.add_argument('--tolerance', type=float, help=f"Seconds the length may miss --minutes by (default {SEQUENCE_DURATION_TOLERANCE})")
+    sequence_parser.add_argument('-j', '--jobs', type=int, help="Render segments of the mix on this many processes (default: one)")
+    sequence_parser.set_defaults(handler=_cli_sequence)
+    
+    plan_parser = subparsers.add_parser('plan', help="Choose a sequence and save it as a plan file (render it with 'render')")
+    plan_parser.add_argument('blocks_dir', help="Blocks folder")
+    plan_parser.add_argument('-o', '--output', required=True, help="Plan file to write (.plan.json)")
+    plan_parser.add_argument('--minutes', type=float, help="Sequence length in minutes (default: all blocks)")
+    plan_parser.add_argument('--fix', action='store_true', help="Try to repair unreadable blocks")
+    plan_parser.add_argument('--tolerance', type=float, help=f"Seconds the length may miss --minutes by (default {SEQUENCE_DURATION_TOLERANCE})")
+    plan_parser.set_defaults(handler=_cli_plan)
+    
+    render_parser = subparsers.add_parser('render', help="Render a sequence plan, reusing cached segments and outputs")
+    render_parser.add_argument('plan', help="Plan file written by 'plan' or next to a sequence")
+    render_parser.add_argument('-o', '--output', required=True, help="Output sequence file")
+    render_parser.add_argument('--blocks-dir', help="Blocks folder (default: the one recorded in the plan)")
+    render_parser.add_argument('-j', '--jobs', type=int, help="Mix segments on this many processes (default: one)")
+    render_parser.add_argument('--no-cache', action='store_true', help="Neither read nor fill the render cache")
+    render_parser.set_defaults(handler=_cli_render)
+    
+    preview_parser = subparsers.add_parser('preview', help="Render just one time window of a plan, e.g. to check a transition")
+    preview_parser.add_argument('plan', help="Plan file")
+    preview_parser.add_argument('--start', required=True, help="Window start, e.g. 01:12:20")
+    preview_parser.add_argument('--end', required=True, help="Window end, e.g. 01:12:40")
+    preview_parser.add_argument('-o', '--output', required=True, help="Output file (format from the extension)")
+    preview_parser.add_argument('--blocks-dir', help="Blocks folder (default: the one recorded in the plan)")
+    preview_parser.set_defaults(handler=_cli_preview)
+    
+    radio_parser = subparsers.add_parser('radio', help="Stream the blocks folder endlessly in real time (stdout, named pipe or HTTP)")
+    radio_parser.add_argument('blocks_dir', help="Blocks folder (rescanned as blocks are added)")
+    radio_parser.add_argument('-o', '--output', default='-', help="'-' for stdout (default), http://HOST:PORT to serve a stream, else a named pipe or file")
+    radio_parser.add_argument('--format', choices=list(RADIO_FORMATS), default='mp3', help="Stream format (default mp3)")
+    radio_parser.add_argument('--bitrate', default=f"{ENCODER_BITRATE_KBPS}k", help=f"MP3 bitrate (default {ENCODER_BITRATE_KBPS}k)")
+    radio_parser.add_argument('--rate', type=int, default=44100, help="Sample rate of the stream (default 44100)")
+    radio_parser.add_argument('--duration', type=float, help="Stop after this many seconds (default: never)")
+    radio_parser.add_argument('--no-realtime', action='store_true', help="Produce as fast as the output takes it instead of at real time")
+    radio_parser.set_defaults(handler=_cli_radio)
+    
+    batch_parser = subparsers.add_parser('batch', help="Slice many sources (directories, manifests or files) in parallel")
+    batch_parser.add_argument('inputs', nargs='+', help="Source folders, manifest files (.json/.txt/.lst) or audio files")
+    batch_parser.add_argument('-o', '--output', required=True, help="Output blocks folder")
+    batch_parser.add_argument('-j', '--jobs', type=int, help="Worker processes (default: CPU count)")
+    batch_parser.set_defaults(handler=_cli_batch)
+    
+    watch_parser = subparsers.add_parser('watch', help="Watch a folder and slice new recordings as they arrive")
+    watch_parser.add_argument('raw_dir', help="Folder where recordings and label files are dropped")
+    watch_parser.add_argument('-o', '--output', required=True, help="Output blocks folder")
+    watch_parser.add_argument('--interval', type=float, default=2.0, help="Polling interval in seconds (default 2)")
+    watch_parser.add_argument('--debounce', type=float, default=3.0, help="Seconds a file must be unchanged before slicing (default 3)")
+    watch_parser.add_argument('-j', '--jobs', type=int, help="Worker processes (default: CPU count)")
+    watch_parser.add_argument('--once', action='store_true', help="Process what is there now and exit")
+    watch_parser.set_defaults(handler=_cli_watch)
+    
+    sync_parser = subparsers.add_parser('sync-catalog', help="Update the Excel catalog from the blocks folder")
+    sync_parser.add_argument('blocks_dir', help="Blocks folder")
+    sync_parser.add_argument('--excel', help="Catalog path (default: <blocks_dir>/blocks_list.xlsx)")
+    sync_parser.set_defaults(handler=_cli_sync_catalog)
+    
+    duplicates_parser = subparsers.add_parser('duplicates', help="List near-duplicate blocks by audio fingerprint (exit 1 if any)")
+    duplicates_parser.add_argument('blocks_dir', help="Blocks folder")
+    duplicates_parser.add_argument('--max-distance', type=int,
+                                   help=f"Fingerprints at most this many bits apart are duplicates (default {FINGERPRINT_MAX_DISTANCE}; "
+                                        f"above {FINGERPRINT_INDEX_REACH} every pair of blocks is compared, which is slow on large folders)")
+    duplicates_parser.set_defaults(handler=_cli_duplicates)
+    
+    usage_parser = subparsers.add_parser('usage', help="Show when blocks last played (least recently played first)")
+    usage_parser.add_argument('blocks_dir', help="Blocks folder")
+    usage_parser.add_argument('blocks', nargs='*', help="Show the play history of these blocks instead")
+    usage_parser.add_argument('--limit', type=int, default=20, help="Blocks (or plays) listed (default 20)")
+    usage_parser.set_defaults(handler=_cli_usage)
+    
+    find_parser = subparsers.add_parser('find', help="Find blocks by description words, origin, type, duration, loudness or climax")
+    find_parser.add_argument('blocks_dir', help="Blocks folder")
+    find_parser.add_argument('query', nargs='+', help="Words (word* for a prefix) and filters: type:v origin:NAME "
+                                                      "duration>=25 loudness<-18 climax<600 (exit 1 if nothing matches)")
+    find_parser.add_argument('--limit', type=int, help="List at most this many blocks")
+    find_parser.set_defaults(handler=_cli_find)
+    
+    layout_parser = subparsers.add_parser('migrate-layout', help="Move the blocks of a folder into the flat or the sharded <type>/<yyyymm>/ layout")
+    layout_parser.add_argument('blocks_dir', help="Blocks folder")
+    layout_parser.add_argument('--to', choices=BLOCK_LAYOUTS, default='sharded', help="Layout to move to (default sharded)")
+    layout_parser.set_defaults(handler=_cli_migrate_layout)
+    
+    verify_parser = subparsers.add_parser('verify', help="Verify the blocks folder against the catalog")
+    verify_parser.add_argument('blocks_dir', help="Blocks folder")
+    verify_parser.add_argument('--excel', help="Catalog path (default: <blocks_dir>/blocks_list.xlsx)")
+    verify_parser.add_argument('--metadata', action='store_true', help="Also check the metadata of every block")
+    verify_parser.add_argument('--audio', action='store_true', help="Also check every block is readable (uses the cached folder probe)")
+    verify_parser.set_defaults(handler=_cli_verify)
+    
+    repair_parser = subparsers.add_parser('repair', help="Find unreadable blocks and re-encode them in parallel")
+    repair_parser.add_argument('blocks_dir', help="Blocks folder")
+    repair_parser.add_argument('-j', '--jobs', type=int, help=f"Concurrent ffmpeg processes (default {FFMPEG_CONCURRENCY})")
+    repair_parser.add_argument('--timeout', type=float, help=f"Seconds before one ffmpeg process is killed (default {FFMPEG_TIMEOUT})")
+    repair_parser.add_argument('--dry-run', action='store_true', help="Only report unreadable blocks")
+    repair_parser.set_defaults(handler=_cli_repair)
+    
+    peaks_parser = subparsers.add_parser('peaks', help="Build a peak overview and query loudness")
+    peaks_parser.add_argument('audio', help="Source audio file")
+    peaks_parser.add_argument('--at', action='append', help="Report loudness around a timestamp (repeatable), e.g. 01:23:45")
+    peaks_parser.add_argument('--window', type=float, default=1.0, help="Loudness window in seconds (default 1.0)")
+    peaks_parser.add_argument('--labels', action='store_true', help="Preview every label of the matching .txt file")
+    peaks_parser.add_argument('--rebuild', action='store_true', help="Rebuild even if a fresh peak file exists")
+    peaks_parser.set_defaults(handler=_cli_peaks)
+    
+    return parser
+
+def run_cli(argv=None):
+    """Headless entry point. Returns a process exit code."""
+    args = build_arg_parser().parse_args(argv)
+    apply_slice_settings(args.slice_size, args.fade)
+    set_codecs(args.block_codec, args.sequence_codec)
+    set_ducking(args.duck)
+    set_master_bus(args.loudness, args.true_peak)
+    set_duplicate_policy(args.skip_duplicates)
+    set_rotation(args.rotation)
+    try:
+        set_pool_query(args.pool)
+    except ValueError as e:
+        print(f"{Fore.RED}❌ Error in --pool: {e}{Style.RESET_ALL}")
+        return 2
+    try:
+        set_lane_layout(args.lanes)
+    except (OSError, ValueError) as e:
+        print(f"{Fore.RED}❌ Error loading lane layout: {e}{Style.RESET_ALL}")
+        return 2
+    if args.seed is not None:
+        random.seed(args.seed)
+    if args.profile or args.max_memory is not None:
+        enable_tracing()
+    if args.max_memory is not None:
+        set_memory_budget(args.max_memory)
+        _TRACER.track_memory()
+    
+    try:
+        if args.command is None:
+            # Only global options given: run the interactive menu with them applied
+            main()
+            return 0
+        return args.handler(args)
+    except KeyboardInterrupt:
+        print(f"\n{Fore.YELLOW}👋 Interrupted{Style.RESET_ALL}")
+        return 130
+    finally:
+        if args.profile:
+            write_trace_report(args.profile)
+        elif args.max_memory is not None:
+            print_trace_report()
+
 def main():
     """Main program entry point"""
     try:
@@ -2052,4 +7050,9 @@ def main():
         traceback.print_exc()
 
 if __name__ == "__main__":
+    # Needed for worker pools inside the PyInstaller executable
+    import multiprocessing
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(run_cli())
     main()
\ No newline at end of file